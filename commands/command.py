@@ -22,11 +22,27 @@ import copy
 import sys
 import datetime
 import glob
+import select
+import signal
+import subprocess
+import threading
+import time
 import traceback
 import re
 import shlex
 import os
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    import hashlib
+    HAS_HASHLIB = True
+except ImportError:
+    HAS_HASHLIB = False
+
 DOCUMENTATION = '''
 ---
 module: command
@@ -74,12 +90,104 @@ options:
     description:
       - if command warnings are on in ansible.cfg, do not warn about this particular line if set to no/false.
     required: false
+  stdout_file:
+    version_added: "2.2"
+    description:
+      - write the complete standard output of the command to this file instead of
+        keeping it in memory. The returned C(stdout) is then limited to
+        C(stdout_max_bytes), 64 KiB by default.
+    required: false
+    default: null
+  stdout_max_bytes:
+    version_added: "2.2"
+    description:
+      - maximum number of bytes of C(stdout) and C(stderr) kept in memory and returned.
+        When the output is larger, its beginning and its end are kept and the middle
+        is replaced by a marker saying how many bytes were left out. Must be at least 1.
+    required: false
+    default: null
+  progress_file:
+    version_added: "2.2"
+    description:
+      - while the command runs, append a JSON record with the elapsed time and the
+        number of bytes written so far to this file every C(progress_interval) seconds,
+        and a final record with the return code. Useful to follow long running
+        commands started with C(async).
+    required: false
+    default: null
+  progress_interval:
+    version_added: "2.2"
+    description:
+      - seconds between two C(progress_file) records, at least 1.
+    required: false
+    default: 10
+  cmds:
+    version_added: "2.2"
+    description:
+      - list of commands to run in a single task, instead of the free form command.
+        Each entry is either a command line or a dict with C(cmd) and optionally
+        C(creates), C(removes) and C(chdir), which behave like the options of the same
+        name for that command only (relative C(creates)/C(removes) are relative to
+        its C(chdir)). C(cmd) may also be a list of arguments, except with the
+        M(shell) module.
+      - The result has a C(results) list with C(cmd), C(rc), C(stdout), C(stderr),
+        C(start), C(end) and C(delta) for every entry. Once a command fails, the
+        following ones are not started and the task fails.
+    required: false
+    default: null
+  parallel:
+    version_added: "2.2"
+    description:
+      - number of C(cmds) run at the same time. With the default of 1 they run one
+        after the other, in order.
+    required: false
+    default: 1
+  cache_key_paths:
+    version_added: "2.2"
+    description:
+      - list of files, directories or glob patterns the command reads. Their contents,
+        together with the command, C(chdir), C(executable), C(cache_key) and the
+        environment variables listed in C(cache_key_env), are digested before running. If the digest is the one recorded
+        after the last successful (C(rc=0)) run of the same command, the command is
+        B(not) run again and the recorded result is returned with C(changed=False).
+    required: false
+    default: null
+  cache_key:
+    version_added: "2.2"
+    description:
+      - extra string mixed into the digest, for inputs that are not files (a version
+        number, a template checksum, ...). Can be used on its own without C(cache_key_paths).
+    required: false
+    default: null
+  cache_key_env:
+    version_added: "2.2"
+    description:
+      - names of the environment variables mixed into the digest, in addition to
+        C(PATH), C(LANG) and the C(LC_*) variables that are always included.
+        C(SUDO_*) variables change with every become run and are never included.
+    required: false
+    default: null
+  cache_dir:
+    version_added: "2.2"
+    description:
+      - directory on the remote host where the digests and results are recorded.
+    required: false
+    default: "~/.ansible/command_cache"
+  cache_max_entries:
+    version_added: "2.2"
+    description:
+      - number of commands kept in C(cache_dir); the least recently used are removed
+        beyond that.
+    required: false
+    default: 256
 notes:
     -  If you want to run a command through the shell (say you are using C(<),
        C(>), C(|), etc), you actually want the M(shell) module instead. The
        M(command) module is much more secure as it's not affected by the user's
        environment.
     -  " C(creates), C(removes), and C(chdir) can be specified after the command. For instance, if you only want to run a command if a certain file does not exist, use this."
+    -  When C(stdout_file), C(stdout_max_bytes) or C(progress_file) are used, the output is
+       read as it is produced and never held in memory as a whole.
 author: 
     - Ansible Core Team
     - Michael DeHaan
@@ -154,6 +262,409 @@ def check_command(commandline):
     return warnings
 
 
+# stdout kept in memory when it is written to stdout_file and no
+# stdout_max_bytes was given
+DEFAULT_SPOOLED_MAX_BYTES = 64 * 1024
+READ_SIZE = 64 * 1024
+EMPTY_BYTES = ''.encode('ascii')
+
+
+class HeadTailBuffer(object):
+    """
+    Keeps the first and last limit/2 bytes written to it, and counts the
+    rest. With no limit, everything is kept.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.head = []
+        self.head_size = 0
+        self.tail = []
+        self.tail_size = 0
+        self.total = 0
+
+    def write(self, data):
+        self.total += len(data)
+        if self.limit is None:
+            self.head.append(data)
+            return
+        head_limit = self.limit // 2
+        if self.head_size < head_limit:
+            part = data[:head_limit - self.head_size]
+            self.head.append(part)
+            self.head_size += len(part)
+            data = data[len(part):]
+        if not data:
+            return
+        tail_limit = self.limit - head_limit
+        self.tail.append(data)
+        self.tail_size += len(data)
+        if self.tail_size > 2 * tail_limit:
+            joined = EMPTY_BYTES.join(self.tail)[-tail_limit:]
+            self.tail = [joined]
+            self.tail_size = len(joined)
+
+    @property
+    def truncated(self):
+        return self.limit is not None and self.total > self.limit
+
+    def getvalue(self):
+        head = EMPTY_BYTES.join(self.head)
+        if self.limit is None:
+            return head
+        tail = EMPTY_BYTES.join(self.tail)
+        if not self.truncated:
+            return head + tail
+        tail = tail[len(tail) - (self.limit - len(head)):]
+        omitted = self.total - len(head) - len(tail)
+        return head + ("\n[... %d bytes omitted ...]\n" % omitted).encode('ascii') + tail
+
+
+def _to_text(data):
+    if sys.version_info[0] >= 3:
+        return data.decode('utf-8', 'replace')
+    return data
+
+
+def _write_progress(progress_file, record):
+    f = open(progress_file, 'a')
+    try:
+        f.write(json.dumps(record) + "\n")
+    finally:
+        f.close()
+
+
+def _restore_sigpipe():
+    # python ignores SIGPIPE, let commands like "cat big | head -1" die of it quietly
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def run_streaming(module, args, shell, executable, max_bytes=None, stdout_file=None,
+                  progress_file=None, progress_interval=10, cwd=None):
+    """
+    Run a command like module.run_command() does, but read its output as
+    it is produced: stdout is copied to stdout_file, both streams are kept
+    in HeadTailBuffers of max_bytes, and progress records are appended to
+    progress_file. Returns (rc, stdout, stderr, info). Raises OSError if
+    the command can not be started.
+
+    Unlike module.run_command() this never changes the current directory,
+    so it can be used from several threads.
+    """
+    if stdout_file and max_bytes is None:
+        max_bytes = DEFAULT_SPOOLED_MAX_BYTES
+
+    popen_args = args
+    if not shell:
+        # expand things like $HOME and ~, as module.run_command() does
+        popen_args = [os.path.expanduser(os.path.expandvars(x)) for x in args if x is not None]
+    elif executable:
+        popen_args = [executable, '-c', args]
+        executable = None
+    env = os.environ.copy()
+    env.update(module.run_command_environ_update or {})
+
+    spool = None
+    proc = None
+    if stdout_file:
+        spool = open(os.path.expanduser(stdout_file), 'wb')
+    try:
+        proc = subprocess.Popen(popen_args, executable=executable, shell=shell and not isinstance(popen_args, list),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True, env=env, cwd=cwd,
+                                preexec_fn=_restore_sigpipe)
+
+        buffers = {
+            proc.stdout.fileno(): HeadTailBuffer(max_bytes),
+            proc.stderr.fileno(): HeadTailBuffer(max_bytes),
+        }
+        stdout_fd = proc.stdout.fileno()
+        open_fds = list(buffers)
+        start = time.time()
+        next_progress = start + progress_interval
+
+        while open_fds:
+            timeout = None
+            if progress_file:
+                timeout = max(0, next_progress - time.time())
+            readable = select.select(open_fds, [], [], timeout)[0]
+            for fd in readable:
+                data = os.read(fd, READ_SIZE)
+                if not data:
+                    open_fds.remove(fd)
+                    continue
+                if fd == stdout_fd and spool is not None:
+                    spool.write(data)
+                buffers[fd].write(data)
+            if progress_file and time.time() >= next_progress:
+                _write_progress(progress_file, dict(
+                    elapsed=round(time.time() - start, 3),
+                    stdout_bytes=buffers[stdout_fd].total,
+                    stderr_bytes=buffers[proc.stderr.fileno()].total,
+                ))
+                next_progress = time.time() + progress_interval
+
+        rc = proc.wait()
+        stdout = buffers[stdout_fd]
+        stderr = buffers[proc.stderr.fileno()]
+        proc.stdout.close()
+        proc.stderr.close()
+    finally:
+        if spool is not None:
+            spool.close()
+        if proc is not None and proc.returncode is None:
+            # reading or spooling failed, do not leave the command running
+            try:
+                os.kill(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+
+    info = dict(
+        stdout_bytes=stdout.total,
+        stderr_bytes=stderr.total,
+        stdout_truncated=stdout.truncated,
+        stderr_truncated=stderr.truncated,
+    )
+    if stdout_file:
+        info['stdout_file'] = stdout_file
+    if progress_file:
+        _write_progress(progress_file, dict(elapsed=round(time.time() - start, 3), rc=rc,
+                                            stdout_bytes=stdout.total, stderr_bytes=stderr.total))
+    return rc, _to_text(stdout.getvalue()), _to_text(stderr.getvalue()), info
+
+
+# environment variables always part of the digest; others only when they
+# are listed in cache_key_env, as most differ between connections
+DIGEST_ENV = frozenset(['PATH', 'LANG'])
+
+
+class CommandCache(object):
+    """
+    Results of commands keyed by a digest of their inputs. Every command
+    (with its chdir, executable and cache_key) has one slot file in
+    cache_dir holding the input digest and the result of its last
+    successful run.
+    """
+
+    def __init__(self, cache_dir, max_entries):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_entries = max_entries
+
+    def _hash_file(self, digest, path):
+        f = open(path, 'rb')
+        try:
+            while True:
+                data = f.read(READ_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+        finally:
+            f.close()
+
+    def _hash_path(self, digest, path):
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    digest.update(('file:%s\0' % os.path.relpath(full, path)).encode('utf-8'))
+                    self._hash_file(digest, full)
+        else:
+            self._hash_file(digest, path)
+
+    def slot(self, args, chdir, executable, cache_key):
+        identity = json.dumps([args, chdir, executable, cache_key])
+        return os.path.join(self.cache_dir, hashlib.sha256(identity.encode('utf-8')).hexdigest() + '.json')
+
+    def digest(self, args, chdir, executable, cache_key, paths, env_names=None):
+        digest = hashlib.sha256()
+        names = set(DIGEST_ENV).union(env_names or [])
+        env = sorted((k, v) for (k, v) in os.environ.items()
+                     if (k in names or k.startswith('LC_')) and not k.startswith('SUDO_'))
+        digest.update(json.dumps([args, chdir, executable, cache_key, env]).encode('utf-8'))
+        for pattern in paths or []:
+            pattern = os.path.expanduser(pattern)
+            matches = sorted(glob.glob(pattern))
+            digest.update(('pattern:%s:%d\0' % (pattern, len(matches))).encode('utf-8'))
+            for path in matches:
+                digest.update(('path:%s\0' % path).encode('utf-8'))
+                self._hash_path(digest, path)
+        return digest.hexdigest()
+
+    def lookup(self, slot, digest):
+        try:
+            f = open(slot)
+            try:
+                entry = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+        if entry.get('digest') != digest:
+            return None
+        # most recently used, for evict()
+        os.utime(slot, None)
+        return entry
+
+    def record(self, slot, digest, result):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, int('0700', 8))
+        entry = dict(result, digest=digest)
+        tmp = slot + '.tmp.%d' % os.getpid()
+        f = open(tmp, 'w')
+        try:
+            json.dump(entry, f)
+        finally:
+            f.close()
+        os.rename(tmp, slot)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    entries.append((os.stat(path).st_mtime, path))
+                except OSError:
+                    pass
+        entries.sort()
+        for mtime, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _batch_entries(module, cmds, shell):
+    """
+    Normalize the cmds option into dicts with cmd, args, creates, removes
+    and chdir, failing before anything runs if an entry is invalid.
+    """
+    entries = []
+    for item in cmds:
+        if isinstance(item, dict):
+            entry = dict(item)
+            unknown = set(entry) - set(['cmd', 'creates', 'removes', 'chdir'])
+            if unknown:
+                module.fail_json(rc=256, msg="unsupported keys in cmds entry: %s" % ", ".join(sorted(unknown)))
+        else:
+            entry = dict(cmd=item)
+        cmd = entry.get('cmd')
+        if not cmd or (not isinstance(cmd, list) and not str(cmd).strip()):
+            module.fail_json(rc=256, msg="no command given in cmds entry: %s" % item)
+        if isinstance(cmd, list):
+            if shell:
+                module.fail_json(rc=256, msg="cmds entries must be strings when running through the shell: %s" % item)
+            entry['args'] = cmd
+        elif shell:
+            entry['args'] = cmd
+        else:
+            try:
+                entry['args'] = shlex.split(cmd)
+            except ValueError:
+                e = get_exception()
+                module.fail_json(rc=256, msg="unable to parse cmds entry %s: %s" % (cmd, str(e)))
+        if entry.get('chdir'):
+            entry['chdir'] = os.path.abspath(os.path.expanduser(entry['chdir']))
+        entries.append(entry)
+    return entries
+
+
+def _batch_glob(pattern, chdir):
+    pattern = os.path.expanduser(pattern)
+    if chdir and not os.path.isabs(pattern):
+        pattern = os.path.join(chdir, pattern)
+    return pattern, glob.glob(pattern)
+
+
+def _run_batch_entry(module, entry, shell, executable):
+    cmd = entry['args']
+    chdir = entry.get('chdir')
+    result = dict(cmd=cmd, changed=False)
+    if entry.get('creates'):
+        pattern, matches = _batch_glob(entry['creates'], chdir)
+        if matches:
+            result.update(rc=0, skipped=True, stdout="skipped, since %s exists" % pattern, stderr='')
+            return result
+    if entry.get('removes'):
+        pattern, matches = _batch_glob(entry['removes'], chdir)
+        if not matches:
+            result.update(rc=0, skipped=True, stdout="skipped, since %s does not exist" % pattern, stderr='')
+            return result
+
+    startd = datetime.datetime.now()
+    try:
+        rc, out, err, info = run_streaming(module, cmd, shell, executable,
+                                           max_bytes=module.params['stdout_max_bytes'], cwd=chdir)
+    except (OSError, IOError):
+        e = get_exception()
+        rc, out, err, info = e.errno or 1, '', str(e), {}
+        result['msg'] = str(e)
+    endd = datetime.datetime.now()
+    result.update(info)
+    result.update(
+        cmd     = cmd,
+        stdout  = out.rstrip("\r\n"),
+        stderr  = err.rstrip("\r\n"),
+        rc      = rc,
+        start   = str(startd),
+        end     = str(endd),
+        delta   = str(endd - startd),
+        changed = True,
+    )
+    return result
+
+
+def run_batch(module, entries, shell, executable, parallel):
+    """
+    Run every entry, in order, with up to parallel of them at a time.
+    Once one fails no further entries are started, they are reported as
+    skipped. Returns the results in the order of entries.
+    """
+    results = [None] * len(entries)
+    pending = list(range(len(entries)))
+    lock = threading.Lock()
+    failed = []
+
+    def worker():
+        while True:
+            lock.acquire()
+            try:
+                if not pending:
+                    return
+                index = pending.pop(0)
+                if failed:
+                    results[index] = dict(cmd=entries[index]['args'], changed=False, skipped=True,
+                                          msg="not run, an earlier command failed")
+                    continue
+            finally:
+                lock.release()
+
+            try:
+                result = _run_batch_entry(module, entries[index], shell, executable)
+            except:
+                # anything escaping here would end the thread silently and
+                # leave the entry without a result
+                e = get_exception()
+                result = dict(cmd=entries[index]['args'], changed=False, rc=1, stdout='',
+                              stderr=str(e), msg=str(e))
+            lock.acquire()
+            results[index] = result
+            if result['rc'] != 0:
+                failed.append(index)
+            lock.release()
+
+    workers = [threading.Thread(target=worker) for i in range(max(1, min(parallel, len(entries))))]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return results
+
+
 def main():
 
     # the command module is the one ansible module that does not take key=value args
@@ -167,6 +678,17 @@ def main():
           creates = dict(),
           removes = dict(),
           warn = dict(type='bool', default=True),
+          stdout_file = dict(type='path'),
+          stdout_max_bytes = dict(type='int'),
+          progress_file = dict(type='path'),
+          progress_interval = dict(type='int', default=10),
+          cache_key_paths = dict(type='list'),
+          cache_key = dict(),
+          cache_key_env = dict(type='list'),
+          cache_dir = dict(default='~/.ansible/command_cache'),
+          cache_max_entries = dict(type='int', default=256),
+          cmds = dict(type='list'),
+          parallel = dict(type='int', default=1),
         )
     )
 
@@ -177,8 +699,22 @@ def main():
     creates  = module.params['creates']
     removes  = module.params['removes']
     warn = module.params['warn']
+    cmds = module.params['cmds']
+
+    if module.params['stdout_max_bytes'] is not None and module.params['stdout_max_bytes'] < 1:
+        module.fail_json(rc=256, msg="stdout_max_bytes must be at least 1")
+    if module.params['progress_interval'] < 1:
+        module.fail_json(rc=256, msg="progress_interval must be at least 1")
 
-    if args.strip() == '':
+    if cmds is not None:
+        if args and args.strip():
+            module.fail_json(rc=256, msg="cmds can not be combined with a free form command")
+        if not cmds:
+            module.fail_json(rc=256, msg="no command given")
+        for option in ('stdout_file', 'progress_file', 'cache_key_paths', 'cache_key', 'cache_key_env'):
+            if module.params[option] is not None:
+                module.fail_json(rc=256, msg="%s can not be used with cmds" % option)
+    elif args is None or args.strip() == '':
         module.fail_json(rc=256, msg="no command given")
 
     if chdir:
@@ -214,14 +750,72 @@ def main():
             )
 
     warnings = list()
+    if cmds is not None:
+        entries = _batch_entries(module, cmds, shell)
+        if warn:
+            for entry in entries:
+                if not isinstance(entry['cmd'], list):
+                    warnings.extend(w for w in check_command(entry['cmd']) if w not in warnings)
+        startd = datetime.datetime.now()
+        results = run_batch(module, entries, shell, executable, module.params['parallel'])
+        endd = datetime.datetime.now()
+        failed = [r for r in results if r.get('rc', 0) != 0]
+        changed = any(r['changed'] for r in results)
+        if failed:
+            module.fail_json(msg="%d of %d commands failed" % (len(failed), len(results)),
+                             rc=failed[0]['rc'], results=results, changed=changed,
+                             start=str(startd), end=str(endd), delta=str(endd - startd), warnings=warnings)
+        module.exit_json(changed=changed, rc=0, results=results, start=str(startd), end=str(endd),
+                         delta=str(endd - startd), warnings=warnings)
+
     if warn:
         warnings = check_command(args)
 
     if not shell:
         args = shlex.split(args)
+
+    cache = None
+    if module.params['cache_key_paths'] or module.params['cache_key'] is not None:
+        if not HAS_HASHLIB:
+            module.fail_json(cmd=args, rc=256, msg="cache_key_paths and cache_key require hashlib (python 2.5 or later)")
+        cache = CommandCache(module.params['cache_dir'], module.params['cache_max_entries'])
+        try:
+            cache_slot = cache.slot(args, chdir, executable, module.params['cache_key'])
+            cache_digest = cache.digest(args, chdir, executable, module.params['cache_key'],
+                                        module.params['cache_key_paths'], module.params['cache_key_env'])
+        except (IOError, OSError):
+            e = get_exception()
+            module.fail_json(cmd=args, rc=256, msg="Unable to digest cache_key_paths: %s" % str(e))
+        entry = cache.lookup(cache_slot, cache_digest)
+        if entry is not None:
+            module.exit_json(
+                cmd      = args,
+                stdout   = entry['stdout'],
+                stderr   = entry['stderr'],
+                rc       = entry['rc'],
+                start    = entry['start'],
+                end      = entry['end'],
+                delta    = entry['delta'],
+                changed  = False,
+                cached   = True,
+                warnings = warnings
+            )
+
     startd = datetime.datetime.now()
 
-    rc, out, err = module.run_command(args, executable=executable, use_unsafe_shell=shell)
+    stream_info = {}
+    if module.params['stdout_file'] or module.params['stdout_max_bytes'] is not None or module.params['progress_file']:
+        try:
+            rc, out, err, stream_info = run_streaming(module, args, shell, executable,
+                                                      max_bytes=module.params['stdout_max_bytes'],
+                                                      stdout_file=module.params['stdout_file'],
+                                                      progress_file=module.params['progress_file'],
+                                                      progress_interval=module.params['progress_interval'])
+        except (OSError, IOError):
+            e = get_exception()
+            module.fail_json(rc=e.errno, msg=str(e), cmd=args)
+    else:
+        rc, out, err = module.run_command(args, executable=executable, use_unsafe_shell=shell)
 
     endd = datetime.datetime.now()
     delta = endd - startd
@@ -231,16 +825,27 @@ def main():
     if err is None:
         err = ''
 
-    module.exit_json(
-        cmd      = args,
+    result = dict(
         stdout   = out.rstrip("\r\n"),
         stderr   = err.rstrip("\r\n"),
         rc       = rc,
         start    = str(startd),
         end      = str(endd),
         delta    = str(delta),
+    )
+    if cache is not None and rc == 0:
+        try:
+            cache.record(cache_slot, cache_digest, result)
+        except (IOError, OSError):
+            e = get_exception()
+            warnings.append("Unable to record the result in %s: %s" % (cache.cache_dir, str(e)))
+
+    result.update(stream_info)
+    module.exit_json(
+        cmd      = args,
         changed  = True,
-        warnings = warnings
+        warnings = warnings,
+        **result
     )
 
 # import module snippets
@@ -111,6 +111,8 @@ options:
             - Create a shallow clone with a history truncated to the specified
               number or revisions. The minimum possible value is C(1), otherwise
               ignored. Needs I(git>=1.9.1) to work correctly.
+            - If C(version) is a full I(SHA-1), that commit is fetched directly
+              when the server allows it, with a fallback to a full fetch.
     clone:
         required: false
         default: "yes"
@@ -162,6 +164,48 @@ options:
               main project. This is equivalent to specifying the --remote flag
               to git submodule update.
 
+    submodule_jobs:
+        required: false
+        default: 4
+        version_added: "2.2"
+        description:
+            - Number of submodules fetched at the same time when C(track_submodules=yes),
+              and passed as C(--jobs) to C(git submodule update) with git 2.9 and later.
+
+    filter:
+        required: false
+        default: null
+        version_added: "2.2"
+        description:
+            - Object filter for a partial clone, for example C(blob:none) or C(tree:0).
+              Only the objects needed for the checkout are downloaded and the rest
+              is fetched on demand. Only used when cloning and needs I(git>=2.19)
+              and a server that supports it.
+
+    sparse_paths:
+        required: false
+        default: null
+        version_added: "2.2"
+        description:
+            - List of directories to check out, using a cone mode sparse checkout.
+              Everything else in the repository is left out of the working tree.
+              An empty list turns a sparse checkout back into a full one.
+              Needs I(git>=2.25) and can not be used with C(bare).
+
+    refs_cache_ttl:
+        required: false
+        default: 0
+        version_added: "2.2"
+        description:
+            - If set, the remote refs, HEAD, index timestamp and submodule HEADs are
+              recorded in the git directory after every run. A later run with the same
+              parameters within this many seconds returns C(changed=False) without
+              running git at all when HEAD still matches C(version) in the recorded refs
+              and HEAD, the index and the submodules are unchanged.
+            - Remote changes are only noticed once the recorded refs are older than this,
+              and modifications to tracked files that did not touch the index are not
+              detected by this check.
+
     verify_commit:
         required: false
         default: "no"
@@ -173,6 +217,53 @@ options:
               to be installed. The commit MUST be signed and the public key MUST
               be trusted in the GPG trustdb.
 
+    mirror_cache:
+        required: false
+        default: "no"
+        choices: ["yes", "no"]
+        version_added: "2.2"
+        description:
+            - if C(yes), keep a bare mirror of C(repo) in C(mirror_cache_dir),
+              shared by every checkout of the same repository URL on the host.
+              New clones borrow objects from the mirror (like C(reference)) and
+              existing checkouts get it added to their alternates, so only the
+              mirror downloads objects over the network.
+            - Can not be combined with C(reference).
+    mirror_cache_dir:
+        required: false
+        default: "/var/cache/ansible/git"
+        version_added: "2.2"
+        description:
+            - Directory holding the mirrors used by C(mirror_cache).
+    mirror_cache_refresh:
+        required: false
+        default: 300
+        version_added: "2.2"
+        description:
+            - Number of seconds after which a mirror is refreshed with
+              C(git fetch --prune). A mirror is always refreshed when it does
+              not contain the requested C(version).
+            - Automatic garbage collection is disabled in the mirrors
+              (C(gc.auto=0), C(gc.pruneExpire=never)) because checkouts
+              borrow objects from them. Never run C(git gc) or C(git prune)
+              in a mirror by hand, it can corrupt the checkouts using it.
+    mirror_cache_expire:
+        required: false
+        default: 30
+        version_added: "2.2"
+        description:
+            - Mirrors that have not been used by any checkout for this many
+              days are removed. C(0) keeps them forever.
+    mirror_cache_max_size:
+        required: false
+        default: null
+        version_added: "2.2"
+        description:
+            - Maximum size in megabytes of all mirrors. The least recently used
+              mirrors are removed until the cache fits.
+            - Before a mirror is removed, checkouts that borrow objects from it
+              are repacked so they no longer depend on it.
+
 requirements:
     - git>=1.7.1 (the command line tool)
 
@@ -202,12 +293,36 @@ EXAMPLES = '''
 
 # Example checkout a github repo and use refspec to fetch all pull requests
 - git: repo=https://github.com/ansible/ansible-examples.git dest=/src/ansible-examples refspec=+refs/pull/*:refs/heads/*
+
+# Example check out a single service of a large repository, without the history
+# or the blobs of anything else
+- git: repo=https://example.com/big/monorepo.git dest=/srv/billing
+       depth=1 filter=blob:none sparse_paths=services/billing,libs/common
+
+# Example deploy the same repository for several tenants, downloading it only once
+- git: repo=ssh://git@example.com/big/monorepo.git dest=/srv/{{ item }}/app mirror_cache=yes mirror_cache_max_size=20480
+  with_items: "{{ tenants }}"
 '''
 
+import fcntl
 import re
+import shutil
+import subprocess
 import tempfile
+import threading
+import time
 from distutils.version import LooseVersion
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
+
 def get_submodule_update_params(module, git_path, cwd):
 
     #or: git submodule [--quiet] update [--init] [-N|--no-fetch] 
@@ -293,30 +408,128 @@ def get_version(module, git_path, dest, ref="HEAD"):
     sha = stdout.rstrip('\n')
     return sha
 
-def get_submodule_versions(git_path, module, dest, version='HEAD'):
-    cmd = [git_path, 'submodule', 'foreach', git_path, 'rev-parse', version]
+def get_git_dir(path):
+    '''
+    Returns the git dir of the work tree at path, following the .git file
+    used by submodules, or None if there is none.
+    '''
+    dotgit = os.path.join(path, '.git')
+    if os.path.isdir(dotgit):
+        return dotgit
+    if os.path.isfile(dotgit):
+        try:
+            f = open(dotgit)
+            try:
+                line = f.readline().strip()
+            finally:
+                f.close()
+        except IOError:
+            return None
+        if line.startswith('gitdir:'):
+            gitdir = line[len('gitdir:'):].strip()
+            return os.path.normpath(os.path.join(path, gitdir))
+    return None
+
+def read_ref(gitdir, ref):
+    '''
+    Resolve ref (HEAD or a full ref name) in gitdir by reading the loose
+    ref and packed-refs files, without running git. Returns None if the
+    ref can not be resolved.
+    '''
+    for i in range(10):
+        try:
+            f = open(os.path.join(gitdir, ref))
+            try:
+                value = f.readline().strip()
+            finally:
+                f.close()
+        except IOError:
+            value = None
+        if value is None:
+            break
+        if not value.startswith('ref:'):
+            return value
+        ref = value[len('ref:'):].strip()
+    else:
+        # symbolic ref loop
+        return None
+
+    try:
+        f = open(os.path.join(gitdir, 'packed-refs'))
+    except IOError:
+        return None
+    try:
+        for line in f:
+            if line.startswith('#') or line.startswith('^'):
+                continue
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == ref:
+                return parts[0]
+    finally:
+        f.close()
+    return None
+
+def parse_gitmodules(path):
+    '''
+    Returns the submodules described in a .gitmodules file as a list of
+    dicts with (at least) their name and whatever keys are set, usually
+    path, url and branch.
+    '''
+    submodules = []
+    current = None
+    f = open(path)
+    try:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] in '#;':
+                continue
+            match = re.match(r'^\[\s*submodule\s+"(.*)"\s*\]$', line)
+            if match:
+                current = dict(name=match.group(1))
+                submodules.append(current)
+            elif line.startswith('['):
+                current = None
+            elif current is not None and '=' in line:
+                key, value = line.split('=', 1)
+                current[key.strip().lower()] = value.strip().strip('"')
+    finally:
+        f.close()
+    return [sub for sub in submodules if 'path' in sub]
+
+def get_gitlinks(git_path, module, dest, paths):
+    '''
+    Returns the commits the superproject records for the submodules at
+    paths, read from the index with a single ls-files call.
+    '''
+    cmd = [git_path, 'ls-files', '-z', '--stage', '--'] + paths
     (rc, out, err) = module.run_command(cmd, cwd=dest)
     if rc != 0:
-        module.fail_json(msg='Unable to determine hashes of submodules', stdout=out, stderr=err, rc=rc)
-    submodules = {}
-    subm_name = None
-    for line in out.splitlines():
-        if line.startswith("Entering '"):
-            subm_name = line[10:-1]
-        elif len(line.strip()) == 40:
-            if subm_name is None:
-                module.fail_json()
-            submodules[subm_name] = line.strip()
-            subm_name = None
-        else:
-            module.fail_json(msg='Unable to parse submodule hash line: %s' % line.strip())
-    if subm_name is not None:
-        module.fail_json(msg='Unable to find hash for submodule: %s' % subm_name)
-
-    return submodules
+        module.fail_json(msg='Failed to retrieve submodule commits: %s' % out + err, rc=rc)
+    gitlinks = {}
+    for line in out.split('\0'):
+        if '\t' not in line:
+            continue
+        info, path = line.split('\t', 1)
+        info = info.split()
+        if info[0] == '160000':
+            gitlinks[path] = info[1]
+    return gitlinks
+
+def is_sha(version):
+    return re.match('^[0-9a-f]{40}$', version) is not None
+
+def fetch_sha(git_path, module, dest, remote, version, depth):
+    '''
+    Shallow fetch of a single commit. This needs a server that allows
+    fetching unadvertised objects (protocol v2, or uploadpack.allowAnySHA1InWant
+    and friends), so failure is not fatal: returns True if it worked.
+    '''
+    cmd = [git_path, 'fetch', '--depth', str(depth), remote, version]
+    (rc, out, err) = module.run_command(cmd, cwd=dest)
+    return rc == 0
 
 def clone(git_path, module, repo, dest, remote, depth, version, bare,
-          reference, refspec, verify_commit):
+          reference, refspec, verify_commit, partial_filter=None, sparse=False):
     ''' makes a new git repo if it does not already exist '''
     dest_dirname = os.path.dirname(dest)
     try:
@@ -327,6 +540,7 @@ def clone(git_path, module, repo, dest, remote, depth, version, bare,
 
     branch_or_tag = is_remote_branch(git_path, module, dest, repo, version) \
         or is_remote_tag(git_path, module, dest, repo, version)
+    shallow_sha = depth and not branch_or_tag and not refspec and is_sha(version)
 
     if bare:
         cmd.append('--bare')
@@ -334,17 +548,29 @@ def clone(git_path, module, repo, dest, remote, depth, version, bare,
         cmd.extend([ '--origin', remote ])
         if branch_or_tag:
             cmd.extend([ '--branch', version ])
-    if depth and (branch_or_tag or version == 'HEAD' or refspec):
+        if sparse or shallow_sha:
+            # switch_version does the checkout, once the sparse patterns
+            # are set or the commit has been fetched
+            cmd.append('--no-checkout')
+    if depth and (branch_or_tag or version == 'HEAD' or refspec or shallow_sha):
         # only use depth if the remote opject is branch or tag (i.e. fetchable)
+        # or a sha we can try to fetch directly below
         cmd.extend([ '--depth', str(depth) ])
     if reference:
         cmd.extend([ '--reference', str(reference) ])
+    if partial_filter:
+        cmd.append('--filter=%s' % partial_filter)
     cmd.extend([ repo, dest ])
     module.run_command(cmd, check_rc=True, cwd=dest_dirname)
     if bare:
         if remote != 'origin':
             module.run_command([git_path, 'remote', 'add', remote, repo], check_rc=True, cwd=dest)
 
+    if shallow_sha and not fetch_sha(git_path, module, dest, remote, version, depth):
+        # the server would not hand out the commit directly, get the
+        # whole history so it can be checked out
+        module.run_command([git_path, 'fetch', '--unshallow', remote], check_rc=True, cwd=dest)
+
     if refspec:
         cmd = [git_path, 'fetch']
         if depth:
@@ -375,53 +601,97 @@ def reset(git_path, module, dest):
     cmd = "%s reset --hard HEAD" % (git_path,)
     return module.run_command(cmd, check_rc=True, cwd=dest)
 
+def read_symbolic_ref(gitdir, ref):
+    '''
+    Returns the ref a symbolic ref (like HEAD) points to, or None if it
+    is detached or can not be read.
+    '''
+    try:
+        f = open(os.path.join(gitdir, ref))
+        try:
+            value = f.readline().strip()
+        finally:
+            f.close()
+    except IOError:
+        return None
+    if value.startswith('ref:'):
+        return value[len('ref:'):].strip()
+    return None
+
+class RemoteRefs(object):
+    '''
+    Snapshot of the branches and tags of a remote repository.
+
+    The snapshot is taken with a single ls-remote (HEAD, heads, and tags
+    including the dereferenced ^{} entries of annotated tags) and is used
+    for all branch/tag/HEAD resolution for the rest of the run.
+    '''
+
+    def __init__(self, git_path, module, dest, remote):
+        cmd = [git_path, 'ls-remote', remote, 'HEAD', 'refs/heads/*', 'refs/tags/*']
+        cwd = None
+        if dest and os.path.isdir(dest):
+            cwd = dest
+        (rc, out, err) = module.run_command(cmd, check_rc=True, cwd=cwd)
+        self.time = time.time()
+        self.refs = {}
+        for line in out.splitlines():
+            parts = line.split('\t')
+            if len(parts) == 2:
+                self.refs[parts[1].strip()] = parts[0].strip()
+
+    def is_branch(self, version):
+        return 'refs/heads/%s' % version in self.refs
+
+    def is_tag(self, version):
+        return 'refs/tags/%s' % version in self.refs
+
+    def head(self):
+        return self.refs.get('HEAD')
+
+    def branch(self, version):
+        return self.refs.get('refs/heads/%s' % version)
+
+    def tag(self, version):
+        # Use the dereferenced tag if this is an annotated tag.
+        tag = 'refs/tags/%s' % version
+        return self.refs.get(tag + '^{}', self.refs.get(tag))
+
+# remote url -> RemoteRefs
+_remote_refs = {}
+
+def get_remote_refs(git_path, module, dest, remote):
+    if remote == module.params['remote']:
+        # the remote is always pointed at repo (clone/set_remote_url)
+        # before its name is used, so share the snapshot of repo
+        remote = module.params['repo']
+    if remote not in _remote_refs:
+        _remote_refs[remote] = RemoteRefs(git_path, module, dest, remote)
+    return _remote_refs[remote]
+
 def get_remote_head(git_path, module, dest, version, remote, bare):
-    cloning = False
-    cwd = None
-    tag = False
-    if remote == module.params['repo']:
-        cloning = True
-    else:
-        cwd = dest
+    refs = get_remote_refs(git_path, module, dest, remote)
     if version == 'HEAD':
-        if cloning:
+        if remote == module.params['repo']:
             # cloning the repo, just get the remote's HEAD version
-            cmd = '%s ls-remote %s -h HEAD' % (git_path, remote)
+            rev = refs.head()
         else:
             head_branch = get_head_branch(git_path, module, dest, remote, bare)
-            cmd = '%s ls-remote %s -h refs/heads/%s' % (git_path, remote, head_branch)
-    elif is_remote_branch(git_path, module, dest, remote, version):
-        cmd = '%s ls-remote %s -h refs/heads/%s' % (git_path, remote, version)
-    elif is_remote_tag(git_path, module, dest, remote, version):
-        tag = True
-        cmd = '%s ls-remote %s -t refs/tags/%s*' % (git_path, remote, version)
+            rev = refs.branch(head_branch)
+    elif refs.is_branch(version):
+        rev = refs.branch(version)
+    elif refs.is_tag(version):
+        rev = refs.tag(version)
     else:
         # appears to be a sha1.  return as-is since it appears
         # cannot check for a specific sha1 on remote
         return version
-    (rc, out, err) = module.run_command(cmd, check_rc=True, cwd=cwd)
-    if len(out) < 1:
-        module.fail_json(msg="Could not determine remote revision for %s" % version, stdout=out, stderr=err, rc=rc)
-
-    if tag:
-    # Find the dereferenced tag if this is an annotated tag.
-        for tag in out.split('\n'):
-            if tag.endswith(version + '^{}'):
-                out = tag
-                break
-            elif tag.endswith(version):
-                out = tag
-
-    rev = out.split()[0]
+    if not rev:
+        module.fail_json(msg="Could not determine remote revision for %s" % version)
     return rev
 
 def is_remote_tag(git_path, module, dest, remote, version):
-    cmd = '%s ls-remote %s -t refs/tags/%s' % (git_path, remote, version)
-    (rc, out, err) = module.run_command(cmd, check_rc=True, cwd=dest)
-    if version in out:
-        return True
-    else:
-        return False
+    return get_remote_refs(git_path, module, dest, remote).is_tag(version)
 
 def get_branches(git_path, module, dest):
     branches = []
@@ -444,12 +714,7 @@ def get_tags(git_path, module, dest):
     return tags
 
 def is_remote_branch(git_path, module, dest, remote, version):
-    cmd = '%s ls-remote %s -h refs/heads/%s' % (git_path, remote, version)
-    (rc, out, err) = module.run_command(cmd, check_rc=True, cwd=dest)
-    if version in out:
-        return True
-    else:
-        return False
+    return get_remote_refs(git_path, module, dest, remote).is_branch(version)
 
 def is_local_branch(git_path, module, dest, branch):
     branches = get_branches(git_path, module, dest)
@@ -540,6 +805,9 @@ def fetch(git_path, module, repo, dest, version, remote, depth, bare, refspec):
                 refspecs.append(version)
         elif is_remote_tag(git_path, module, dest, repo, version):
             refspecs.append('+refs/tags/'+version+':refs/tags/'+version)
+        elif is_sha(version) and fetch_sha(git_path, module, dest, remote, version, depth):
+            # got just the commit we need
+            return
         if refspecs:
             # if refspecs is empty, i.e. version is neither heads nor tags
             # assume it is a version hash
@@ -569,6 +837,82 @@ def fetch(git_path, module, repo, dest, version, remote, depth, bare, refspec):
         if rc != 0:
             module.fail_json(msg="Failed to %s: %s %s" % (label, out, err), cmd=command)
 
+def fetch_submodules_parallel(git_path, module, remote, gitdirs, jobs):
+    '''
+    Fetch remote in every submodule git dir, up to jobs at a time.
+
+    The fetches do not go through module.run_command(), which changes
+    os.environ around every call and so can not be used from threads.
+    '''
+    pending = list(gitdirs)
+    lock = threading.Lock()
+    errors = {}
+    env = os.environ.copy()
+    env.update(module.run_command_environ_update or {})
+
+    def worker():
+        while True:
+            lock.acquire()
+            try:
+                if not pending:
+                    return
+                gitdir = pending.pop(0)
+            finally:
+                lock.release()
+            cmd = [git_path, '--git-dir', gitdir, 'fetch', remote]
+            try:
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        env=env, close_fds=True)
+                out = proc.communicate()[0]
+                error = None
+                if proc.returncode != 0:
+                    error = out.decode('utf-8', 'replace').strip() or "rc=%d" % proc.returncode
+            except:
+                # anything escaping here would end the thread silently and
+                # leave the failure unreported
+                error = str(get_exception())
+            if error is not None:
+                lock.acquire()
+                errors[gitdir] = error
+                lock.release()
+
+    workers = [threading.Thread(target=worker) for i in range(max(1, min(jobs, len(pending))))]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    if errors:
+        module.fail_json(msg="Failed to fetch submodules: %s" % ", ".join(sorted(errors)), errors=errors)
+
+def set_sparse_paths(git_path, module, dest, sparse_paths):
+    '''
+    Make the checkout a cone mode sparse checkout of sparse_paths, or a
+    full checkout again if sparse_paths is empty. Returns True if the
+    patterns changed.
+    '''
+    cmd = [git_path, 'sparse-checkout', 'list']
+    (rc, out, err) = module.run_command(cmd, cwd=dest)
+    current = None
+    if rc == 0:
+        current = sorted(line.strip() for line in out.splitlines() if line.strip())
+    wanted = sorted(path.strip('/') for path in sparse_paths)
+
+    if not wanted:
+        if current is None:
+            return False
+        cmds = [[git_path, 'sparse-checkout', 'disable']]
+    elif current == wanted:
+        return False
+    else:
+        cmds = [[git_path, 'sparse-checkout', 'init', '--cone'],
+                [git_path, 'sparse-checkout', 'set'] + wanted]
+    for cmd in cmds:
+        (rc, out, err) = module.run_command(cmd, cwd=dest)
+        if rc != 0:
+            module.fail_json(msg="Failed to configure sparse checkout: %s %s" % (out, err), cmd=cmd, rc=rc)
+    return True
+
 def submodules_fetch(git_path, module, remote, track_submodules, dest):
     changed = False
 
@@ -576,18 +920,18 @@ def submodules_fetch(git_path, module, remote, track_submodules, dest):
         # no submodules
         return changed
 
-    gitmodules_file = open(os.path.join(dest, '.gitmodules'), 'r')
-    for line in gitmodules_file:
+    submodules = parse_gitmodules(os.path.join(dest, '.gitmodules'))
+    gitdirs = {}
+    for sub in submodules:
         # Check for new submodules
-        if not changed and line.strip().startswith('path'):
-            path = line.split('=', 1)[1].strip()
-            # Check that dest/path/.git exists
-            if not os.path.exists(os.path.join(dest, path, '.git')):
-                changed = True
+        gitdir = get_git_dir(os.path.join(dest, sub['path']))
+        if gitdir is None:
+            changed = True
+        gitdirs[sub['path']] = gitdir
 
         # add the submodule repo's hostkey
-        if line.strip().startswith('url'):
-            repo = line.split('=', 1)[1].strip()
+        if 'url' in sub:
+            repo = sub['url']
             if module.params['ssh_opts'] is not None:
                 if not "-o StrictHostKeyChecking=no" in module.params['ssh_opts']:
                     add_git_host_key(module, repo, accept_hostkey=module.params['accept_hostkey'])
@@ -596,34 +940,30 @@ def submodules_fetch(git_path, module, remote, track_submodules, dest):
 
     # Check for updates to existing modules
     if not changed:
-        # Fetch updates
-        begin = get_submodule_versions(git_path, module, dest)
-        cmd = [git_path, 'submodule', 'foreach', git_path, 'fetch']
-        (rc, out, err) = module.run_command(cmd, check_rc=True, cwd=dest)
-        if rc != 0:
-            module.fail_json(msg="Failed to fetch submodules: %s" % out + err)
+        begin = dict((path, read_ref(gitdir, 'HEAD')) for (path, gitdir) in gitdirs.items())
 
         if track_submodules:
-            # Compare against submodule HEAD
-            ### FIXME: determine this from .gitmodules
-            version = 'master'
-            after = get_submodule_versions(git_path, module, dest, '%s/%s'
-                    % (remote, version))
+            # Compare against the submodule's branch on the remote
+            fetch_submodules_parallel(git_path, module, remote, gitdirs.values(),
+                                      module.params['submodule_jobs'])
+            after = {}
+            for sub in submodules:
+                ref = 'refs/remotes/%s/%s' % (remote, sub.get('branch', 'master'))
+                after[sub['path']] = read_ref(gitdirs[sub['path']], ref)
             if begin != after:
                 changed = True
         else:
-            # Compare against the superproject's expectation
-            cmd = [git_path, 'submodule', 'status']
-            (rc, out, err) = module.run_command(cmd, check_rc=True, cwd=dest)
-            if rc != 0:
-                module.fail_json(msg='Failed to retrieve submodule status: %s' % out + err)
-            for line in out.splitlines():
-                if line[0] != ' ':
+            # Compare against the superproject's expectation. Nothing has
+            # to be fetched for that, submodule update gets whatever is
+            # missing when they differ.
+            gitlinks = get_gitlinks(git_path, module, dest, sorted(gitdirs))
+            for path in gitdirs:
+                if gitlinks.get(path) != begin[path]:
                     changed = True
                     break
     return changed
 
-def submodule_update(git_path, module, dest, track_submodules):
+def submodule_update(git_path, module, dest, track_submodules, git_version_used=None):
     ''' init and update any submodules '''
 
     # get the valid submodule params
@@ -638,6 +978,9 @@ def submodule_update(git_path, module, dest, track_submodules):
         cmd = [ git_path, 'submodule', 'update', '--init', '--recursive' ,'--remote' ]
     else:
         cmd = [ git_path, 'submodule', 'update', '--init', '--recursive' ]
+    if git_version_used is not None and git_version_used >= LooseVersion('2.9'):
+        # clone/fetch the submodules in parallel
+        cmd.extend([ '--jobs', str(module.params['submodule_jobs']) ])
     (rc, out, err) = module.run_command(cmd, cwd=dest)
     if rc != 0:
         module.fail_json(msg="Failed to init/update submodules: %s" % out + err)
@@ -718,6 +1061,384 @@ def git_version(git_path, module):
     return LooseVersion(rematch.groups()[0])
 
 
+# written to the git dir after every run when refs_cache_ttl is set
+RUN_STATE_FILE = 'ansible-git-state.json'
+
+def _run_state_params(module):
+    params = module.params
+    return dict((k, params[k]) for k in ('repo', 'version', 'remote', 'refspec', 'depth', 'bare',
+                                         'recursive', 'track_submodules', 'verify_commit',
+                                         'filter', 'sparse_paths'))
+
+def _index_stamp(gitdir, bare):
+    if bare:
+        return None
+    try:
+        st = os.stat(os.path.join(gitdir, 'index'))
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+def _submodule_heads(dest):
+    gitmodules = os.path.join(dest, '.gitmodules')
+    if not os.path.exists(gitmodules):
+        return {}
+    heads = {}
+    for sub in parse_gitmodules(gitmodules):
+        gitdir = get_git_dir(os.path.join(dest, sub['path']))
+        heads[sub['path']] = gitdir and read_ref(gitdir, 'HEAD')
+    return heads
+
+def _wanted_from_refs(refs, gitdir, version, remote):
+    ''' Resolve version the way get_remote_head does, from recorded refs '''
+    if version == 'HEAD':
+        branch_ref = read_symbolic_ref(gitdir, 'HEAD')
+        if branch_ref is None:
+            # detached HEAD, use the branch of the remote HEAD
+            branch_ref = read_symbolic_ref(gitdir, 'refs/remotes/%s/HEAD' % remote)
+            if branch_ref is None:
+                return None
+            branch_ref = 'refs/heads/' + branch_ref.split('/', 3)[-1]
+        return refs.get(branch_ref)
+    if 'refs/heads/%s' % version in refs:
+        return refs['refs/heads/%s' % version]
+    tag = 'refs/tags/%s' % version
+    if tag in refs:
+        return refs.get(tag + '^{}', refs[tag])
+    return version
+
+def check_run_state(module, dest, gitdir, bare):
+    '''
+    Decide, without running git, whether the checkout is still exactly as
+    the previous run left it: same parameters, HEAD, index and submodule
+    HEADs, with HEAD matching version in the remote refs recorded less
+    than refs_cache_ttl seconds ago. Returns HEAD if so, None otherwise.
+    '''
+    try:
+        f = open(os.path.join(gitdir, RUN_STATE_FILE))
+        try:
+            state = json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return None
+
+    if state.get('params') != _run_state_params(module):
+        return None
+    age = time.time() - state.get('refs_time', 0)
+    if age < 0 or age > module.params['refs_cache_ttl']:
+        return None
+    head = read_ref(gitdir, 'HEAD')
+    if not head or head != state.get('head'):
+        return None
+    if _index_stamp(gitdir, bare) != state.get('index'):
+        return None
+    if _wanted_from_refs(state.get('refs', {}), gitdir, module.params['version'], module.params['remote']) != head:
+        return None
+    if module.params['recursive'] and not bare and _submodule_heads(dest) != state.get('submodules'):
+        return None
+    return head
+
+def save_run_state(module, dest, gitdir, bare):
+    ''' Record what check_run_state needs for the next run '''
+    refs = _remote_refs.get(module.params['repo'])
+    if refs is None or gitdir is None:
+        return
+    state = dict(
+        params=_run_state_params(module),
+        head=read_ref(gitdir, 'HEAD'),
+        index=_index_stamp(gitdir, bare),
+        submodules=(not bare and _submodule_heads(dest)) or {},
+        refs=refs.refs,
+        refs_time=refs.time,
+    )
+    try:
+        fd, tmp = tempfile.mkstemp(dir=gitdir, prefix='.ansible-state')
+        f = os.fdopen(fd, 'w')
+        try:
+            json.dump(state, f)
+        finally:
+            f.close()
+        os.rename(tmp, os.path.join(gitdir, RUN_STATE_FILE))
+    except (IOError, OSError):
+        # only an optimisation for the next run
+        pass
+
+class MirrorCache(object):
+    '''
+    Bare mirrors of remote repositories, one per repository URL, that
+    checkouts borrow objects from through their alternates.
+
+    Every mirror <sha1 of url>.git has a <mirror>.lock file that is
+    flock()ed while it is created, fetched, used or removed. Each mirror
+    remembers the git dirs borrowing from it, so they can be repacked
+    before the mirror is garbage collected.
+
+    Objects are never pruned from a mirror: an object that became
+    unreachable there after a force push may still be needed by a borrower.
+    '''
+
+    FETCHED = 'ansible-fetched'
+    USED = 'ansible-used'
+    BORROWERS = 'ansible-borrowers'
+
+    def __init__(self, module, git_path, cache_dir):
+        self.module = module
+        self.git_path = git_path
+        self.cache_dir = cache_dir
+
+    def path(self, repo):
+        return os.path.join(self.cache_dir, sha1(to_bytes(repo)).hexdigest() + '.git')
+
+    def _lock(self, mirror, blocking=True):
+        fd = open(mirror + '.lock', 'w')
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, flags)
+        except IOError:
+            fd.close()
+            return None
+        return fd
+
+    def _touch(self, mirror, name):
+        open(os.path.join(mirror, name), 'w').close()
+
+    def _age(self, mirror, name):
+        try:
+            return time.time() - os.stat(os.path.join(mirror, name)).st_mtime
+        except OSError:
+            return None
+
+    def _configure(self, mirror):
+        '''
+        Disable automatic gc and pruning, a borrower may still need objects
+        that are no longer reachable from any ref of the mirror.
+        '''
+        for name, value in (('gc.auto', '0'), ('gc.pruneExpire', 'never')):
+            cmd = [self.git_path, 'config', name, value]
+            (rc, out, err) = self.module.run_command(cmd, cwd=mirror)
+            if rc != 0:
+                return "Failed to configure mirror %s: %s %s" % (mirror, out, err)
+        return None
+
+    def _has_commit(self, mirror, sha):
+        cmd = [self.git_path, 'cat-file', '-e', '%s^{commit}' % sha]
+        (rc, out, err) = self.module.run_command(cmd, cwd=mirror)
+        return rc == 0
+
+    def update(self, repo, wanted, refresh):
+        '''
+        Create or refresh the mirror of repo. It is fetched when it is older
+        than refresh seconds or does not contain the commit wanted.
+        Returns (path, error).
+        '''
+        mirror = self.path(repo)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        lock = self._lock(mirror)
+        try:
+            if not os.path.exists(os.path.join(mirror, 'config')):
+                if os.path.exists(mirror):
+                    # left over from an interrupted clone
+                    shutil.rmtree(mirror)
+                cmd = [self.git_path, 'clone', '--mirror', repo, mirror]
+                (rc, out, err) = self.module.run_command(cmd, cwd=self.cache_dir)
+                if rc != 0:
+                    return None, "Failed to create mirror of %s: %s %s" % (repo, out, err)
+                error = self._configure(mirror)
+                if error:
+                    shutil.rmtree(mirror, ignore_errors=True)
+                    return None, error
+                self._touch(mirror, self.FETCHED)
+            else:
+                age = self._age(mirror, self.FETCHED)
+                if age is None or age > refresh or (wanted and not self._has_commit(mirror, wanted)):
+                    # the fetch could otherwise trigger an automatic gc
+                    error = self._configure(mirror)
+                    if error:
+                        return None, error
+                    cmd = [self.git_path, 'fetch', '--prune', 'origin']
+                    (rc, out, err) = self.module.run_command(cmd, cwd=mirror)
+                    if rc != 0:
+                        return None, "Failed to fetch mirror of %s: %s %s" % (repo, out, err)
+                    self._touch(mirror, self.FETCHED)
+            self._touch(mirror, self.USED)
+        finally:
+            lock.close()
+        return mirror, None
+
+    def hold(self, mirror):
+        '''
+        Lock mirror so it can not be removed, e.g. while a clone references
+        it. Returns the lock to close, or None if the mirror is gone.
+        '''
+        lock = self._lock(mirror)
+        if not os.path.exists(os.path.join(mirror, 'config')):
+            lock.close()
+            return None
+        return lock
+
+    def borrow(self, mirror, gitdir, locked=False):
+        '''
+        Make gitdir borrow objects from mirror and remember it as a borrower.
+        The borrower is recorded before the alternates line is written, both
+        under the mirror lock (already held if locked), so gc can not remove
+        the mirror without dissociating gitdir. Returns False if the mirror
+        is gone.
+        '''
+        lock = None
+        if not locked:
+            lock = self.hold(mirror)
+            if lock is None:
+                return False
+        try:
+            borrowers = os.path.join(mirror, self.BORROWERS)
+            known = []
+            if os.path.exists(borrowers):
+                known = open(borrowers).read().splitlines()
+            if gitdir not in known:
+                f = open(borrowers, 'a')
+                f.write(gitdir + '\n')
+                f.close()
+
+            objects = os.path.join(mirror, 'objects')
+            alternates = os.path.join(gitdir, 'objects', 'info', 'alternates')
+            lines = []
+            if os.path.exists(alternates):
+                lines = [l.strip() for l in open(alternates).read().splitlines()]
+            if objects not in lines and os.path.isdir(os.path.dirname(alternates)):
+                f = open(alternates, 'a')
+                f.write(objects + '\n')
+                f.close()
+        finally:
+            if lock is not None:
+                lock.close()
+        return True
+
+    def _dissociate(self, mirror):
+        '''
+        Copy the objects borrowed from mirror into every borrower
+        (like git clone --dissociate). Returns False if one of them failed.
+        '''
+        objects = os.path.join(mirror, 'objects')
+        borrowers = os.path.join(mirror, self.BORROWERS)
+        if not os.path.exists(borrowers):
+            return True
+        for gitdir in open(borrowers).read().splitlines():
+            alternates = os.path.join(gitdir, 'objects', 'info', 'alternates')
+            if not os.path.exists(alternates):
+                continue
+            lines = [l.strip() for l in open(alternates).read().splitlines()]
+            if objects not in lines:
+                continue
+            cmd = [self.git_path, 'repack', '-a', '-d', '-q']
+            (rc, out, err) = self.module.run_command(cmd, cwd=gitdir)
+            if rc != 0:
+                return False
+            lines = [l for l in lines if l and l != objects]
+            if lines:
+                f = open(alternates, 'w')
+                f.write('\n'.join(lines) + '\n')
+                f.close()
+            else:
+                os.remove(alternates)
+        return True
+
+    def _size(self, mirror):
+        total = 0
+        for root, dirs, files in os.walk(mirror):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def _remove(self, mirror):
+        lock = self._lock(mirror, blocking=False)
+        if lock is None:
+            # in use by another task
+            return False
+        try:
+            if not self._dissociate(mirror):
+                return False
+            shutil.rmtree(mirror, ignore_errors=True)
+        finally:
+            lock.close()
+        return True
+
+    def gc(self, keep, expire_days, max_size_mb):
+        '''
+        Remove mirrors unused for expire_days and, if the cache is larger
+        than max_size_mb, the least recently used ones. keep is never removed.
+        Returns the removed mirrors.
+        '''
+        removed = []
+        mirrors = []
+        for name in os.listdir(self.cache_dir):
+            mirror = os.path.join(self.cache_dir, name)
+            if not name.endswith('.git') or not os.path.isdir(mirror):
+                continue
+            age = self._age(mirror, self.USED) or 0
+            if mirror != keep and expire_days and age > expire_days * 86400:
+                if self._remove(mirror):
+                    removed.append(mirror)
+                continue
+            mirrors.append((age, mirror))
+
+        if max_size_mb:
+            sizes = dict((mirror, self._size(mirror)) for (age, mirror) in mirrors)
+            total = sum(sizes.values())
+            # oldest first
+            for age, mirror in sorted(mirrors, reverse=True):
+                if total <= max_size_mb * 1024 * 1024:
+                    break
+                if mirror != keep and self._remove(mirror):
+                    removed.append(mirror)
+                    total -= sizes[mirror]
+        return removed
+
+def prepare_mirror(git_path, module, dest, repo, version, bare, return_values):
+    '''
+    Bring the mirror of repo up to date and collect stale mirrors.
+    Returns the mirror path, or None (with a warning) if it can not be used.
+    '''
+    params = module.params
+    cache = MirrorCache(module, git_path, params['mirror_cache_dir'])
+    wanted = get_remote_head(git_path, module, dest, version, repo, bare)
+    try:
+        mirror, error = cache.update(repo, wanted, params['mirror_cache_refresh'])
+        if error:
+            return_values['warnings'].append(error + " Not using the mirror cache.")
+            return None
+        cache.gc(mirror, params['mirror_cache_expire'], params['mirror_cache_max_size'])
+    except (IOError, OSError):
+        e = get_exception()
+        return_values['warnings'].append("Unable to use the mirror cache in %s: %s" % (params['mirror_cache_dir'], str(e)))
+        return None
+    return_values['mirror'] = mirror
+    return mirror
+
+def borrow_from_mirror(git_path, module, dest, bare, mirror, return_values, locked=False):
+    '''
+    Add mirror to the alternates of the checkout at dest. Returns False
+    (with a warning) if the mirror is gone or can not be used.
+    '''
+    if bare:
+        gitdir = dest
+    else:
+        gitdir = os.path.join(dest, '.git')
+    try:
+        if MirrorCache(module, git_path, module.params['mirror_cache_dir']).borrow(mirror, gitdir, locked):
+            return True
+        return_values['warnings'].append("The mirror %s was removed. Not using the mirror cache." % mirror)
+    except (IOError, OSError):
+        e = get_exception()
+        return_values['warnings'].append("Unable to borrow objects from %s: %s" % (mirror, str(e)))
+    return False
+
 # ===========================================
 
 def main():
@@ -741,7 +1462,17 @@ def main():
             bare=dict(default='no', type='bool'),
             recursive=dict(default='yes', type='bool'),
             track_submodules=dict(default='no', type='bool'),
+            submodule_jobs=dict(default=4, type='int'),
+            refs_cache_ttl=dict(default=0, type='int'),
+            filter=dict(default=None),
+            sparse_paths=dict(default=None, type='list'),
+            mirror_cache=dict(default='no', type='bool'),
+            mirror_cache_dir=dict(default='/var/cache/ansible/git', type='path'),
+            mirror_cache_refresh=dict(default=300, type='int'),
+            mirror_cache_expire=dict(default=30, type='int'),
+            mirror_cache_max_size=dict(default=None, type='int'),
         ),
+        mutually_exclusive=[['mirror_cache', 'reference']],
         supports_check_mode=True
     )
 
@@ -778,6 +1509,16 @@ def main():
         else:
             gitconfig = os.path.join(dest, '.git', 'config')
 
+    # the common "already at version" case, decided without running git
+    if dest and update and module.params['refs_cache_ttl'] > 0 and os.path.exists(gitconfig):
+        if bare:
+            gitdir = dest
+        else:
+            gitdir = get_git_dir(dest)
+        head = gitdir and check_run_state(module, dest, gitdir, bare)
+        if head:
+            module.exit_json(changed=False, before=head, after=head, **return_values)
+
     # create a wrapper script and export
     # GIT_SSH=<path> as an environment variable
     # for git to use the wrapper script
@@ -799,6 +1540,18 @@ def main():
         return_values['warnings'].append("Your git version is too old to fully support the depth argument. Falling back to full checkouts.")
         depth = None
 
+    partial_filter = module.params['filter']
+    if partial_filter and git_version_used < LooseVersion('2.19'):
+        return_values['warnings'].append("Your git version is too old to support partial clones (filter). Falling back to full clones.")
+        partial_filter = None
+
+    sparse_paths = module.params['sparse_paths']
+    if sparse_paths is not None:
+        if bare:
+            module.fail_json(msg="sparse_paths can not be used with bare repositories")
+        if git_version_used < LooseVersion('2.25'):
+            module.fail_json(msg="sparse_paths needs git 2.25 or later")
+
     recursive = module.params['recursive']
     track_submodules = module.params['track_submodules']
 
@@ -814,7 +1567,26 @@ def main():
             remote_head = get_remote_head(git_path, module, dest, version, repo, bare)
             module.exit_json(changed=True, before=before, after=remote_head, **return_values)
         # there's no git config, so clone
-        clone(git_path, module, repo, dest, remote, depth, version, bare, reference, refspec, verify_commit)
+        mirror = None
+        hold = None
+        if module.params['mirror_cache']:
+            mirror = prepare_mirror(git_path, module, dest, repo, version, bare, return_values)
+            if mirror:
+                # keep gc from removing the mirror while the clone references it
+                hold = MirrorCache(module, git_path, module.params['mirror_cache_dir']).hold(mirror)
+                if hold is None:
+                    return_values['warnings'].append("The mirror %s was removed. Not using the mirror cache." % mirror)
+                    mirror = None
+                else:
+                    reference = mirror
+        try:
+            clone(git_path, module, repo, dest, remote, depth, version, bare, reference, refspec, verify_commit,
+                  partial_filter, bool(sparse_paths))
+            if mirror:
+                borrow_from_mirror(git_path, module, dest, bare, mirror, return_values, locked=True)
+        finally:
+            if hold is not None:
+                hold.close()
         repo_updated = True
     elif not update:
         # Just return having found a repo already in the dest path
@@ -857,9 +1629,19 @@ def main():
         if repo_updated is None:
             if module.check_mode:
                 module.exit_json(changed=True, before=before, after=remote_head, **return_values)
+            if module.params['mirror_cache']:
+                mirror = prepare_mirror(git_path, module, dest, repo, version, bare, return_values)
+                if mirror:
+                    # objects already in the mirror are not downloaded again
+                    borrow_from_mirror(git_path, module, dest, bare, mirror, return_values)
             fetch(git_path, module, repo, dest, version, remote, depth, bare, refspec)
             repo_updated = True
 
+    # set the sparse checkout patterns before checking anything out
+    sparse_changed = False
+    if sparse_paths is not None and not module.check_mode:
+        sparse_changed = set_sparse_paths(git_path, module, dest, sparse_paths)
+
     # switch to version specified regardless of whether
     # we got new revisions from the repository
     if not bare:
@@ -878,13 +1660,13 @@ def main():
 
         if submodules_updated:
             # Switch to version specified
-            submodule_update(git_path, module, dest, track_submodules)
+            submodule_update(git_path, module, dest, track_submodules, git_version_used)
 
     # determine if we changed anything
     after = get_version(module, git_path, dest)
 
     changed = False
-    if before != after or local_mods or submodules_updated:
+    if before != after or local_mods or submodules_updated or sparse_changed:
         changed = True
 
     # cleanup the wrapper script
@@ -895,6 +1677,12 @@ def main():
             # No need to fail if the file already doesn't exist
             pass
 
+    if module.params['refs_cache_ttl'] > 0 and dest:
+        if bare:
+            save_run_state(module, dest, dest, bare)
+        else:
+            save_run_state(module, dest, get_git_dir(dest), bare)
+
     module.exit_json(changed=changed, before=before, after=after, **return_values)
 
 # import module snippets
@@ -24,6 +24,8 @@
 # along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
 
 import ConfigParser
+import struct
+import subprocess
 
 DOCUMENTATION = '''
 ---
@@ -84,6 +86,9 @@ notes:
       SSH will prompt user to authorize the first contact with a remote host.  To avoid this prompt, 
       one solution is to add the remote host public key in C(/etc/ssh/ssh_known_hosts) before calling 
       the hg module, with the following command: ssh-keyscan remote_host.com >> /etc/ssh/ssh_known_hosts."
+    - "When the repository already exists, all hg commands of a task are run by a single
+      Mercurial command server (C(hg serve --cmdserver pipe)) instead of starting hg for
+      each of them. If the server can not be started the module runs hg directly."
 requirements: [ ]
 '''
 
@@ -92,6 +97,84 @@ EXAMPLES = '''
 - hg: repo=https://bitbucket.org/user/repo1 dest=/home/user/repo1 revision=stable purge=yes
 '''
 
+class HgCommandServerError(Exception):
+    pass
+
+class HgCommandServer(object):
+    """
+    A Mercurial command server (hg serve --cmdserver pipe) for one
+    repository. Commands run through it do not pay for starting hg.
+
+    Messages from the server are a channel byte and a big endian length,
+    followed by that much data, except for the input channels (I and L)
+    where the length is the most the server wants to read.
+    """
+
+    def __init__(self, hg_path, dest):
+        self.devnull = open(os.devnull, 'w')
+        self.proc = subprocess.Popen(
+            [hg_path, 'serve', '--cmdserver', 'pipe', '--config', 'ui.interactive=False', '-R', dest],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self.devnull,
+            cwd=dest, close_fds=True)
+        (channel, hello) = self._read()
+        capabilities = []
+        for line in hello.splitlines():
+            if line.startswith('capabilities:'):
+                capabilities = line.split(':', 1)[1].split()
+        if channel != 'o' or 'runcommand' not in capabilities:
+            self.close()
+            raise HgCommandServerError("unexpected hello from the command server: %r" % hello)
+
+    def _read_exact(self, size):
+        chunks = []
+        while size > 0:
+            data = self.proc.stdout.read(size)
+            if not data:
+                raise HgCommandServerError("command server exited")
+            chunks.append(data)
+            size -= len(data)
+        return ''.join(chunks)
+
+    def _read(self):
+        (channel, length) = struct.unpack('>cI', self._read_exact(5))
+        if channel in ('I', 'L'):
+            return (channel, length)
+        return (channel, self._read_exact(length))
+
+    def _write(self, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def runcommand(self, args):
+        data = '\0'.join(args)
+        self._write('runcommand\n' + struct.pack('>I', len(data)) + data)
+        out = []
+        err = []
+        while True:
+            (channel, data) = self._read()
+            if channel == 'o':
+                out.append(data)
+            elif channel == 'e':
+                err.append(data)
+            elif channel == 'r':
+                rc = struct.unpack('>i', data)[0]
+                return (rc, ''.join(out), ''.join(err))
+            elif channel in ('I', 'L'):
+                # nothing to answer with, this is not an interactive session
+                self._write(struct.pack('>I', 0))
+            elif channel.isupper():
+                raise HgCommandServerError("unsupported required channel %r" % channel)
+            # other lower case channels (like d for debug) are optional
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait()
+        except (IOError, OSError):
+            pass
+        self.devnull.close()
+
+
 class Hg(object):
 
     def __init__(self, module, dest, repo, revision, hg_path):
@@ -100,8 +183,43 @@ class Hg(object):
         self.repo = repo
         self.revision = revision
         self.hg_path = hg_path
+        self.server = None
+
+    def start_server(self):
+        """
+        Start a command server for dest, which must already be a repository.
+        Commands keep being run by forking hg if that does not work.
+        """
+        try:
+            self.server = HgCommandServer(self.hg_path, self.dest)
+        except (IOError, OSError, struct.error, HgCommandServerError):
+            self.server = None
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+    def _server_args(self, args_list):
+        # the server is bound to dest already and refuses -R
+        args = []
+        skip = False
+        for (i, arg) in enumerate(args_list):
+            if skip:
+                skip = False
+            elif arg == '-R' and i + 1 < len(args_list) and args_list[i + 1] == self.dest:
+                skip = True
+            else:
+                args.append(arg)
+        return args
 
     def _command(self, args_list):
+        if self.server is not None:
+            try:
+                return self.server.runcommand(self._server_args(args_list))
+            except (IOError, OSError, struct.error, HgCommandServerError):
+                # the server went away, carry on without it
+                self.stop_server()
         (rc, out, err) = self.module.run_command([self.hg_path] + args_list)
         return (rc, out, err)
 
@@ -234,6 +352,8 @@ def main():
     cleaned = False
 
     hg = Hg(module, dest, repo, revision, hg_path)
+    if os.path.exists(hgrc):
+        hg.start_server()
 
     # If there is no hgrc file, then assume repo is absent
     # and perform clone. Otherwise, perform pull and update.
@@ -266,6 +386,7 @@ def main():
             module.fail_json(msg=err)
 
     after = hg.get_revision()
+    hg.stop_server()
     if before != after or cleaned:
         changed = True
     module.exit_json(before=before, after=after, changed=changed, cleaned=cleaned)
@@ -29,6 +29,9 @@ author: "Dane Summers (@dsummersl) <njharman@gmail.com>"
 notes:
    - Requires I(svn) to be installed on the client.
    - This module does not handle externals
+   - An existing working copy is first compared with the repository using a single
+     C(svn info -r <revision>). When it is already at the requested revision, URL and
+     depth and has no local modifications, no switch or update is run.
 requirements: []
 options:
   repo:
@@ -86,6 +89,14 @@ options:
     version_added: "2.0"
     description:
       - If C(no), do not call svn switch before update.
+  depth:
+    required: false
+    default: null
+    choices: [ "empty", "files", "immediates", "infinity" ]
+    version_added: "2.2"
+    description:
+      - Sparse checkout depth, passed as C(--depth) to checkout and export.
+        An existing working copy with a different depth is updated with C(--set-depth).
 '''
 
 EXAMPLES = '''
@@ -97,12 +108,34 @@ EXAMPLES = '''
 '''
 
 import re
+import signal
+import subprocess
 import tempfile
 
+try:
+    from xml.etree import ElementTree
+    HAS_ETREE = True
+except ImportError:
+    HAS_ETREE = False
+
+
+# wc-status item values that are not local modifications
+UNMODIFIED_ITEMS = frozenset(['normal', 'unversioned', 'external', 'ignored', 'none'])
+
+
+class _PipeReader(object):
+    ''' file-like wrapper returning whatever a pipe has, for iterparse '''
+
+    def __init__(self, f):
+        self.fd = f.fileno()
+
+    def read(self, size):
+        return os.read(self.fd, size)
+
 
 class Subversion(object):
     def __init__(
-            self, module, dest, repo, revision, username, password, svn_path):
+            self, module, dest, repo, revision, username, password, svn_path, depth=None):
         self.module = module
         self.dest = dest
         self.repo = repo
@@ -110,9 +143,9 @@ class Subversion(object):
         self.username = username
         self.password = password
         self.svn_path = svn_path
+        self.depth = depth
 
-    def _exec(self, args, check_rc=True):
-        '''Execute a subversion command, and return output. If check_rc is False, returns the return code instead of the output.'''
+    def _command(self, args):
         bits = [
             self.svn_path,
             '--non-interactive',
@@ -124,12 +157,91 @@ class Subversion(object):
         if self.password:
             bits.extend(["--password", self.password])
         bits.extend(args)
-        rc, out, err = self.module.run_command(bits, check_rc)
+        return bits
+
+    def _exec(self, args, check_rc=True):
+        '''Execute a subversion command, and return output. If check_rc is False, returns the return code instead of the output.'''
+        rc, out, err = self.module.run_command(self._command(args), check_rc)
         if check_rc:
             return out.splitlines()
         else:
             return rc
 
+    def _scan_xml(self, args, tag, visit):
+        '''
+        Run a subversion command with --xml and call visit() with each of its
+        tag elements as they are parsed from the output. As soon as visit()
+        returns something other than None svn is terminated and that value is
+        returned.
+        '''
+        env = os.environ.copy()
+        env.update(self.module.run_command_environ_update or {})
+        cmd = self._command(args + ['--xml'])
+        errfile = tempfile.TemporaryFile()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errfile, env=env, close_fds=True)
+        result = None
+        finished = False
+        try:
+            try:
+                for event, elem in ElementTree.iterparse(_PipeReader(proc.stdout), events=('end',)):
+                    if elem.tag == tag:
+                        result = visit(elem)
+                        elem.clear()
+                        if result is not None:
+                            break
+                else:
+                    finished = True
+            except SyntaxError:
+                # svn failed before completing the document, reported below
+                finished = True
+        finally:
+            if not finished and proc.poll() is None:
+                os.kill(proc.pid, signal.SIGTERM)
+            proc.stdout.close()
+            rc = proc.wait()
+            errfile.seek(0)
+            err = errfile.read()
+            errfile.close()
+        if finished and rc != 0:
+            self.module.fail_json(msg="svn %s failed: %s" % (args[0], err), rc=rc)
+        return result
+
+    def _info(self, target, revision=None):
+        '''Revision, URL and depth of target, from svn info.'''
+        args = ["info"]
+        if revision is not None:
+            args.extend(["-r", revision])
+        args.append(target)
+        if not HAS_ETREE:
+            return self._info_text(args)
+
+        def visit(entry):
+            depth = entry.find('wc-info/depth')
+            return dict(
+                revision=entry.get('revision'),
+                url=entry.findtext('url'),
+                depth=depth is not None and depth.text or None,
+            )
+        info = self._scan_xml(args, 'entry', visit)
+        if info is None:
+            self.module.fail_json(msg="Unable to get svn info for %s" % target)
+        return info
+
+    def _info_text(self, args):
+        '''_info() for hosts without ElementTree, parsing the plain output'''
+        text = '\n'.join(self._exec(args))
+        info = dict(revision=None, url=None, depth=None)
+        for key, field in (('revision', 'Revision'), ('url', 'URL'), ('depth', 'Depth')):
+            match = re.search(r'^%s: (.*)$' % field, text, re.MULTILINE)
+            if match:
+                info[key] = match.group(1).strip()
+        # svn info only prints the depth of a working copy when it is not infinity
+        if info['depth'] is None and re.search(r'^Working Copy Root Path:', text, re.MULTILINE):
+            info['depth'] = 'infinity'
+        if info['revision'] is None or info['url'] is None:
+            self.module.fail_json(msg="Unable to get svn info for %s" % args[-1])
+        return info
+
     def is_svn_repo(self):
         '''Checks if path is a SVN Repo.'''
         rc = self._exec(["info", self.dest], check_rc=False)
@@ -137,13 +249,18 @@ class Subversion(object):
 
     def checkout(self):
         '''Creates new svn working directory if it does not already exist.'''
-        self._exec(["checkout", "-r", self.revision, self.repo, self.dest])
+        cmd = ["checkout", "-r", self.revision]
+        if self.depth:
+            cmd.extend(["--depth", self.depth])
+        self._exec(cmd + [self.repo, self.dest])
 
     def export(self, force=False):
         '''Export svn repo to directory'''
         cmd = ["export"]
         if force:
             cmd.append("--force")
+        if self.depth:
+            cmd.extend(["--depth", self.depth])
         cmd.extend(["-r", self.revision, self.repo, self.dest])
 
         self._exec(cmd)
@@ -155,7 +272,10 @@ class Subversion(object):
 
     def update(self):
         '''Update existing svn working directory.'''
-        self._exec(["update", "-r", self.revision, self.dest])
+        cmd = ["update", "-r", self.revision]
+        if self.depth:
+            cmd.extend(["--set-depth", self.depth])
+        self._exec(cmd + [self.dest])
 
     def revert(self):
         '''Revert svn working directory.'''
@@ -163,24 +283,32 @@ class Subversion(object):
 
     def get_revision(self):
         '''Revision and URL of subversion working directory.'''
-        text = '\n'.join(self._exec(["info", self.dest]))
-        rev = re.search(r'^Revision:.*$', text, re.MULTILINE).group(0)
-        url = re.search(r'^URL:.*$', text, re.MULTILINE).group(0)
-        return rev, url
+        info = self._info(self.dest)
+        return 'Revision: %s' % info['revision'], 'URL: %s' % info['url']
 
     def has_local_mods(self):
         '''True if revisioned files have been added or modified. Unrevisioned files are ignored.'''
-        lines = self._exec(["status", "--quiet", "--ignore-externals",  self.dest])
-        # The --quiet option will return only modified files.
-        # Match only revisioned files, i.e. ignore status '?'.
-        regex = re.compile(r'^[^?X]')
-        # Has local mods if more than 0 modifed revisioned files.
-        return len(filter(regex.match, lines)) > 0
+        args = ["status", "--quiet", "--ignore-externals", self.dest]
+        if not HAS_ETREE:
+            lines = self._exec(args)
+            # The --quiet option will return only modified files.
+            # Match only revisioned files, i.e. ignore status '?'.
+            regex = re.compile(r'^[^?X]')
+            # Has local mods if more than 0 modifed revisioned files.
+            return len([line for line in lines if regex.match(line)]) > 0
+
+        def visit(entry):
+            status = entry.find('wc-status')
+            if status is not None and (status.get('item') not in UNMODIFIED_ITEMS or
+                                       status.get('props') in ('modified', 'conflicted')):
+                return True
+            return None
+        # Stops at the first modified revisioned file instead of listing them all.
+        return self._scan_xml(args, 'entry', visit) is not None
 
     def needs_update(self):
         curr, url = self.get_revision()
-        out2 = '\n'.join(self._exec(["info", "-r", "HEAD", self.dest]))
-        head = re.search(r'^Revision:.*$', out2, re.MULTILINE).group(0)
+        head = 'Revision: %s' % self._info(self.dest, "HEAD")['revision']
         rev1 = int(curr.split(':')[1].strip())
         rev2 = int(head.split(':')[1].strip())
         change = False
@@ -188,6 +316,21 @@ class Subversion(object):
             change = True
         return change, curr, head
 
+    def is_current(self):
+        '''
+        True if the working copy is already at the requested revision of
+        repo (with the requested depth), using a single remote svn info.
+        Returns (current, before).
+        '''
+        local = self._info(self.dest)
+        before = ('Revision: %s' % local['revision'], 'URL: %s' % local['url'])
+        if self.depth and local['depth'] != self.depth:
+            return False, before
+        remote = self._info(self.repo, self.revision)
+        if remote['url'] != local['url'] or remote['revision'] != local['revision']:
+            return False, before
+        return True, before
+
 
 # ===========================================
 
@@ -203,6 +346,7 @@ def main():
             executable=dict(default=None, type='path'),
             export=dict(default=False, required=False, type='bool'),
             switch=dict(default=True, required=False, type='bool'),
+            depth=dict(default=None, choices=['empty', 'files', 'immediates', 'infinity']),
         ),
         supports_check_mode=True
     )
@@ -221,7 +365,8 @@ def main():
     # call run_command()
     module.run_command_environ_update = dict(LANG='C', LC_ALL='C', LC_MESSAGES='C', LC_CTYPE='C')
 
-    svn = Subversion(module, dest, repo, revision, username, password, svn_path)
+    svn = Subversion(module, dest, repo, revision, username, password, svn_path,
+                     module.params['depth'])
 
     if export or not os.path.exists(dest):
         before = None
@@ -239,8 +384,11 @@ def main():
         if module.check_mode:
             check, before, after = svn.needs_update()
             module.exit_json(changed=check, before=before, after=after)
-        before = svn.get_revision()
+        current, before = svn.is_current()
         local_mods = svn.has_local_mods()
+        if current and not local_mods:
+            # nothing moved and nothing to revert
+            module.exit_json(changed=False, before=before, after=before)
         if switch:
             svn.switch()
         if local_mods:
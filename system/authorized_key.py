@@ -32,11 +32,30 @@ options:
   user:
     description:
       - The username on the remote host whose authorized_keys file will be modified
-    required: true
+      - Required unless C(users) is given.
+    required: false
   key:
     description:
       - The SSH public key(s), as a string or (since 1.9) url (https://github.com/username.keys)
-    required: true
+      - Required together with C(user).
+    required: false
+  users:
+    description:
+      - A mapping of user names to their SSH public key(s), each value being a string
+        (or url) as accepted by C(key), or a list of such strings.
+      - Manages the authorized_keys files of all listed users in a single task. C(state),
+        C(key_options), C(exclusive) and C(manage_dir) apply to every user. Cannot be
+        combined with C(user), C(key) or C(path).
+    required: false
+    default: null
+    version_added: "2.2"
+  parallel:
+    description:
+      - Maximum number of users whose authorized_keys files are processed concurrently
+        when C(users) is given.
+    required: false
+    default: 4
+    version_added: "2.2"
   path:
     description:
       - Alternate path to the authorized_keys file
@@ -125,6 +144,16 @@ EXAMPLES = '''
   with_file:
     - public_keys/doe-jane
 
+# Manage the keys of many users in one task
+- authorized_key:
+    users:
+      charlie: "{{ lookup('file', 'public_keys/charlie') }}"
+      deploy:
+        - "{{ lookup('file', 'public_keys/doe-jane') }}"
+        - "{{ lookup('file', 'public_keys/doe-john') }}"
+    exclusive: yes
+    parallel: 8
+
 # Copies the key from the user who is running ansible to the remote machine user ubuntu
 - authorized_key: user=ubuntu key="{{ lookup('file', lookup('env','HOME') + "/.ssh/id_rsa.pub") }}"
   become: yes
@@ -140,6 +169,7 @@ EXAMPLES = '''
 #    path = path to the user's authorized_keys file (default: ~/.ssh/authorized_keys)
 #    manage_dir = whether to create, and control ownership of the directory (default: true)
 #    state = absent|present (default: present)
+#    users = mapping of user name to key(s), processed as a batch
 #
 # see example in examples/playbooks
 
@@ -149,7 +179,34 @@ import pwd
 import os.path
 import tempfile
 import re
-import shlex
+import threading
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
+
+VALID_SSH2_KEY_TYPES = frozenset([
+    'ssh-ed25519',
+    'ecdsa-sha2-nistp256',
+    'ecdsa-sha2-nistp384',
+    'ecdsa-sha2-nistp521',
+    'ssh-dss',
+    'ssh-rsa',
+])
+
+# splits a key line on whitespace, keeping quotes and comment hashes intact
+# (the same tokens a non-posix shlex with no quotes/commenters would yield)
+KEY_TOKEN_RE = re.compile(r'[^ \t\r\n]+')
+
+# splits an option string on commas while ignoring those commas that
+# fall within quotes
+OPTIONS_SPLIT_RE = re.compile(r'''((?:[^,"']|"[^"]*"|'[^']*')+)''')
+
+
+class AuthorizedKeyError(Exception):
+    pass
+
 
 class keydict(dict):
 
@@ -193,8 +250,8 @@ def keyfile(module, user, write=False, path=None, manage_dir=True):
     except KeyError:
         e = get_exception()
         if module.check_mode and path is None:
-            module.fail_json(msg="Either user must exist or you must provide full path to key file in check mode")
-        module.fail_json(msg="Failed to lookup user %s: %s" % (user, str(e)))
+            raise AuthorizedKeyError("Either user must exist or you must provide full path to key file in check mode")
+        raise AuthorizedKeyError("Failed to lookup user %s: %s" % (user, str(e)))
     if path is None:
         homedir    = user_entry.pw_dir
         sshdir     = os.path.join(homedir, ".ssh")
@@ -244,10 +301,7 @@ def parseoptions(module, options):
     options_dict = keydict() #ordered dict
     if options:
         try:
-            # the following regex will split on commas while
-            # ignoring those commas that fall within quotes
-            regex = re.compile(r'''((?:[^,"']|"[^"]*"|'[^']*')+)''')
-            parts = regex.split(options)[1:-1]
+            parts = OPTIONS_SPLIT_RE.split(options)[1:-1]
             for part in parts:
                 if "=" in part:
                     (key, value) = part.split("=", 1)
@@ -261,7 +315,7 @@ def parseoptions(module, options):
                 elif part != ",":
                     options_dict[part] = None
         except:
-            module.fail_json(msg="invalid option string: %s" % options)
+            raise AuthorizedKeyError("invalid option string: %s" % options)
 
     return options_dict
 
@@ -271,15 +325,6 @@ def parsekey(module, raw_key):
     of ssh-key options at the beginning
     '''
 
-    VALID_SSH2_KEY_TYPES = [
-        'ssh-ed25519',
-        'ecdsa-sha2-nistp256',
-        'ecdsa-sha2-nistp384',
-        'ecdsa-sha2-nistp521',
-        'ssh-dss',
-        'ssh-rsa',
-    ]
-
     options    = None   # connection options
     key        = None   # encrypted key string
     key_type   = None   # type of ssh key
@@ -289,11 +334,7 @@ def parsekey(module, raw_key):
     raw_key = raw_key.replace('\#', '#')
 
     # split key safely
-    lex = shlex.shlex(raw_key)
-    lex.quotes = []
-    lex.commenters = '' #keep comment hashes
-    lex.whitespace_split = True
-    key_parts = list(lex)
+    key_parts = KEY_TOKEN_RE.findall(raw_key)
 
     for i in range(0, len(key_parts)):
         if key_parts[i] in VALID_SSH2_KEY_TYPES:
@@ -319,14 +360,31 @@ def parsekey(module, raw_key):
 
     return (key, key_type, options, comment)
 
+def digest(content):
+    """ sha1 of the text content of an authorized_keys file """
+
+    if sys.version_info[0] >= 3:
+        content = content.encode('utf-8', 'surrogateescape')
+    return sha1(content).hexdigest()
+
 def readkeys(module, filename):
+    """
+    Parse an authorized_keys file.
+
+    :return: tuple of the keys indexed by key data and the digest of the
+             file content (None if the file does not exist)
+    """
 
     if not os.path.isfile(filename):
-        return {}
+        return {}, None
 
     keys = {}
     f = open(filename)
-    for line in f.readlines():
+    try:
+        content = f.read()
+    finally:
+        f.close()
+    for line in content.splitlines(True):
         key_data = parsekey(module, line)
         if key_data:
             # use key as identifier
@@ -335,38 +393,49 @@ def readkeys(module, filename):
             # for an invalid line, just append the line
             # to the array so it will be re-output later
             keys[line] = line
-    f.close()
-    return keys
+    return keys, digest(content)
 
-def writekeys(module, filename, keys):
+def serializekeys(keys):
+    """ render the keys as the content of an authorized_keys file """
+
+    lines = []
+    for index, key in keys.items():
+        try:
+            (keyhash,type,options,comment) = key
+            option_str = ""
+            if options:
+                option_strings = []
+                seen = set()
+                for option_key in options:
+                    if option_key in seen:
+                        continue
+                    seen.add(option_key)
+                    if options[option_key]:
+                        if isinstance(options[option_key], list):
+                            for value in options[option_key]:
+                                option_strings.append("%s=%s" % (option_key, value))
+                        else:
+                            option_strings.append("%s=%s" % (option_key, options[option_key]))
+                    else:
+                        option_strings.append("%s" % option_key)
+                option_str = ",".join(option_strings)
+                option_str += " "
+            key_line = "%s%s %s %s\n" % (option_str, type, keyhash, comment)
+        except:
+            key_line = key
+        lines.append(key_line)
+    return "".join(lines)
+
+def writekeys(module, filename, content):
 
     fd, tmp_path = tempfile.mkstemp('', 'tmp', os.path.dirname(filename))
-    f = open(tmp_path,"w")
+    f = os.fdopen(fd, "w")
     try:
-        for index, key in keys.items():
-            try:
-                (keyhash,type,options,comment) = key
-                option_str = ""
-                if options:
-                    option_strings = []
-                    for option_key in options.keys():
-                        if options[option_key]:
-                            if isinstance(options[option_key], list):
-                                for value in options[option_key]:
-                                    option_strings.append("%s=%s" % (option_key, value))
-                            else:
-                                option_strings.append("%s=%s" % (option_key, options[option_key]))
-                        else:
-                            option_strings.append("%s" % option_key)
-                    option_str = ",".join(option_strings)
-                    option_str += " "
-                key_line = "%s%s %s %s\n" % (option_str, type, keyhash, comment)
-            except:
-                key_line = key
-            f.writelines(key_line)
+        f.write(content)
     except IOError:
         e = get_exception()
-        module.fail_json(msg="Failed to write to file %s: %s" % (tmp_path, str(e)))
+        f.close()
+        raise AuthorizedKeyError("Failed to write to file %s: %s" % (tmp_path, str(e)))
     f.close()
     module.atomic_move(tmp_path, filename)
 
@@ -390,11 +459,11 @@ def enforce_state(module, params):
         try:
             resp, info = fetch_url(module, key)
             if info['status'] != 200:
-                module.fail_json(msg=error_msg % key)
+                raise AuthorizedKeyError(error_msg % key)
             else:
                 key = resp.read()
         except Exception:
-            module.fail_json(msg=error_msg % key)
+            raise AuthorizedKeyError(error_msg % key)
 
     # extract individual keys into an array, skipping blank lines and comments
     key = [s for s in key.splitlines() if s and not s.startswith('#')]
@@ -402,7 +471,7 @@ def enforce_state(module, params):
     # check current state -- just get the filename, don't create file
     do_write = False
     params["keyfile"] = keyfile(module, user, do_write, path, manage_dir)
-    existing_keys = readkeys(module, params["keyfile"])
+    existing_keys, existing_digest = readkeys(module, params["keyfile"])
 
     # Add a place holder for keys that should exist in the state=present and
     # exclusive=true case
@@ -413,7 +482,7 @@ def enforce_state(module, params):
         parsed_new_key = parsekey(module, new_key)
 
         if not parsed_new_key:
-            module.fail_json(msg="invalid key specified: %s" % new_key)
+            raise AuthorizedKeyError("invalid key specified: %s" % new_key)
 
         if key_options is not None:
             parsed_options = parseoptions(module, key_options)
@@ -463,22 +532,94 @@ def enforce_state(module, params):
             do_write = True
 
     if do_write:
-        if module.check_mode:
-            module.exit_json(changed=True)
-        writekeys(module, keyfile(module, user, do_write, path, manage_dir), existing_keys)
-        params['changed'] = True
-    else:
-        if module.check_mode:
-            module.exit_json(changed=False)
+        # skip the rewrite if the rendered file would be identical
+        content = serializekeys(existing_keys)
+        if existing_digest is not None and digest(content) == existing_digest:
+            do_write = False
+
+    if do_write and not module.check_mode:
+        # the path was resolved above, only create the directory and file
+        writekeys(module, keyfile(module, user, do_write, params["keyfile"], manage_dir), content)
 
+    params['changed'] = do_write
     return params
 
+def enforce_users(module, params):
+    """
+    Add or remove the keys of every user in params['users'], processing
+    up to params['parallel'] users concurrently.
+
+    While the workers run, module.fail_json() (also reached through
+    atomic_move(), fetch_url() and the selinux helpers) raises an
+    AuthorizedKeyError for the user at hand instead of exiting.
+    """
+
+    users = params["users"]
+    pending = sorted(users)
+    lock = threading.Lock()
+    results = {}
+    errors = {}
+
+    def worker():
+        while True:
+            lock.acquire()
+            try:
+                if not pending:
+                    return
+                user = pending.pop(0)
+            finally:
+                lock.release()
+
+            keys = users[user]
+            if isinstance(keys, list):
+                keys = "\n".join(keys)
+            user_params = dict(params, user=user, key=keys or "", path=None, users=None)
+            try:
+                user_result = enforce_state(module, user_params)
+            except:
+                # anything escaping here would end the thread silently and
+                # leave the user out of both results and errors
+                e = get_exception()
+                lock.acquire()
+                errors[user] = str(e)
+                lock.release()
+                continue
+            lock.acquire()
+            results[user] = dict(keyfile=user_result["keyfile"], changed=user_result["changed"])
+            lock.release()
+
+    def fail_in_worker(msg=None, **kwargs):
+        raise AuthorizedKeyError(msg or "unknown error")
+
+    workers = [threading.Thread(target=worker) for i in range(max(1, min(params["parallel"], len(pending))))]
+    module.fail_json = fail_in_worker
+    try:
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+    finally:
+        del module.fail_json
+
+    for user in users:
+        if user not in results and user not in errors:
+            errors[user] = "not processed"
+
+    changed = any(r["changed"] for r in results.values())
+    if errors:
+        module.fail_json(msg="Failed to manage keys for user(s): %s" % ", ".join(sorted(errors)),
+                         errors=errors, users=results, changed=changed)
+
+    return dict(changed=changed, users=results)
+
 def main():
 
     module = AnsibleModule(
         argument_spec = dict(
-           user        = dict(required=True, type='str'),
-           key         = dict(required=True, type='str'),
+           user        = dict(required=False, type='str'),
+           key         = dict(required=False, type='str'),
+           users       = dict(required=False, type='dict'),
+           parallel    = dict(default=4, type='int'),
            path        = dict(required=False, type='str'),
            manage_dir  = dict(required=False, type='bool', default=True),
            state       = dict(default='present', choices=['absent','present']),
@@ -487,10 +628,23 @@ def main():
            exclusive   = dict(default=False, type='bool'),
            validate_certs = dict(default=True, type='bool'),
         ),
+        required_one_of = [['user', 'users']],
+        required_together = [['user', 'key']],
+        mutually_exclusive = [['user', 'users'], ['key', 'users'], ['path', 'users']],
         supports_check_mode=True
     )
 
-    results = enforce_state(module, module.params)
+    if module.params['parallel'] < 1:
+        module.fail_json(msg="parallel must be at least 1")
+
+    try:
+        if module.params['users'] is not None:
+            results = enforce_users(module, module.params)
+        else:
+            results = enforce_state(module, module.params)
+    except AuthorizedKeyError:
+        e = get_exception()
+        module.fail_json(msg=str(e))
     module.exit_json(**results)
 
 # import module snippets
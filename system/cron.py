@@ -158,6 +158,26 @@ options:
     version_added: "2.1"
     required: false
     default: null
+  jobs:
+    description:
+      - A list of named jobs to manage in a single task. Each item is a dictionary accepting
+        the C(name), C(job), C(state), C(minute), C(hour), C(day), C(month), C(weekday),
+        C(special_time) and C(disabled) keys with the same meaning and defaults as the
+        corresponding module options; C(name) is required.
+      - The crontab is read once, all entries are applied in one pass and the result is
+        written back at most once. Cannot be combined with C(name), C(job) or C(env).
+    version_added: "2.2"
+    required: false
+    default: null
+  use_spool:
+    description:
+      - Read and write the user's crontab directly in the cron spool directory instead of
+        calling the C(crontab) command. Only used on Linux when running as root and no
+        C(cron_file) is given; otherwise the C(crontab) command is used.
+    version_added: "2.2"
+    required: false
+    default: "no"
+    choices: [ "yes", "no" ]
 requirements:
   - cron
 author:
@@ -197,16 +217,57 @@ EXAMPLES = '''
 
 # Removes "APP_HOME" environment variable from crontab
 - cron: name=APP_HOME env=yes state=absent
+
+# Manages several jobs with a single read and write of the crontab
+- cron:
+    user: app
+    use_spool: yes
+    jobs:
+      - name: "rotate logs"
+        hour: 3
+        minute: 0
+        job: "/srv/app/bin/rotate"
+      - name: "refresh cache"
+        minute: "*/5"
+        job: "/srv/app/bin/refresh"
+      - name: "an old job"
+        state: absent
 '''
 
 import os
 import re
+import sys
+import pwd
+import fcntl
 import tempfile
 import platform
 import pipes
 
 CRONCMD = "/usr/bin/crontab"
 
+# per-user crontab spool directories, in order of preference
+SPOOL_DIRS = ['/var/spool/cron/crontabs', '/var/spool/cron/tabs', '/var/spool/cron']
+
+# header lines added by crontab(1), stripped when reading a user crontab
+CRONTAB_HEADER_RES = [
+    re.compile(r'# DO NOT EDIT THIS FILE - edit the master and reinstall.'),
+    re.compile(r'# \(/tmp/.*installed on.*\)'),
+    re.compile(r'# \(.*version.*\)'),
+]
+
+JOB_OPTIONS = dict(
+    name=None,
+    job=None,
+    state='present',
+    minute='*',
+    hour='*',
+    day='*',
+    month='*',
+    weekday='*',
+    special_time=None,
+    disabled=False,
+)
+
 class CronTabError(Exception):
     pass
 
@@ -216,13 +277,16 @@ class CronTab(object):
 
         user      - the user of the crontab (defaults to root)
         cron_file - a cron file under /etc/cron.d, or an absolute path
+        use_spool - access the user's spool file directly instead of
+                    running crontab (only as root on Linux)
     """
-    def __init__(self, module, user=None, cron_file=None):
+    def __init__(self, module, user=None, cron_file=None, use_spool=False):
         self.module    = module
         self.user      = user
         self.root      = (os.getuid() == 0)
         self.lines     = None
         self.ansible   = "#Ansible: "
+        self.spool_file = None
 
         if cron_file:
             if os.path.isabs(cron_file):
@@ -232,6 +296,9 @@ class CronTab(object):
         else:
             self.cron_file = None
 
+        if use_spool and not self.cron_file and self.root and platform.system() == 'Linux':
+            self.spool_file = self._find_spool_file()
+
         self.read()
 
     def read(self):
@@ -248,6 +315,15 @@ class CronTab(object):
                 return
             except:
                 raise CronTabError("Unexpected error:", sys.exc_info()[0])
+        elif self.spool_file:
+            try:
+                f = open(self.spool_file, 'r')
+                lines = f.read().splitlines()
+                f.close()
+            except IOError:
+                # user has no crontab yet
+                return
+            self.lines = self._strip_header(lines)
         else:
             # using safely quoted shell for now, but this really should be two non-shell calls instead.  FIXME
             (rc, out, err) = self.module.run_command(self._read_user_execute(), use_unsafe_shell=True)
@@ -255,14 +331,14 @@ class CronTab(object):
             if rc != 0 and rc != 1: # 1 can mean that there are no jobs.
                 raise CronTabError("Unable to read crontab")
 
-            lines = out.splitlines()
-            count = 0
-            for l in lines:
-                if count > 2 or (not re.match( r'# DO NOT EDIT THIS FILE - edit the master and reinstall.', l) and
-                                 not re.match( r'# \(/tmp/.*installed on.*\)', l) and
-                                 not re.match( r'# \(.*version.*\)', l)):
-                    self.lines.append(l)
-                count += 1
+            self.lines = self._strip_header(out.splitlines())
+
+    def _strip_header(self, lines):
+        stripped = []
+        for count, l in enumerate(lines):
+            if count > 2 or not [r for r in CRONTAB_HEADER_RES if r.match(l)]:
+                stripped.append(l)
+        return stripped
 
     def is_empty(self):
         if len(self.lines) == 0:
@@ -276,6 +352,8 @@ class CronTab(object):
         """
         if backup_file:
             fileh = open(backup_file, 'w')
+        elif self.spool_file:
+            return self._write_spool()
         elif self.cron_file:
             fileh = open(self.cron_file, 'w')
         else:
@@ -299,6 +377,55 @@ class CronTab(object):
             if rc != 0:
                 self.module.fail_json(msg=err)
 
+    def _find_spool_file(self):
+        """
+        Return the path of the user's crontab in the spool directory, or None
+        if no known spool directory exists
+        """
+        user = self.user or pwd.getpwuid(os.getuid())[0]
+        for spool_dir in SPOOL_DIRS:
+            if os.path.isdir(spool_dir):
+                return os.path.join(spool_dir, user)
+        return None
+
+    def _write_spool(self):
+        """
+        Atomically replace the user's spool file, holding an exclusive lock on
+        the spool directory so concurrent writers are serialized, and touch the
+        directory so the cron daemon notices the change.
+        """
+        spool_dir = os.path.dirname(self.spool_file)
+        try:
+            st = os.stat(self.spool_file)
+            uid, gid, mode = st.st_uid, st.st_gid, st.st_mode & int('07777', 8)
+        except OSError:
+            try:
+                uid = pwd.getpwnam(self.user or pwd.getpwuid(os.getuid())[0]).pw_uid
+            except KeyError:
+                self.module.fail_json(msg="Unable to find user '%s'" % self.user)
+            gid = os.stat(spool_dir).st_gid
+            mode = int('0600', 8)
+
+        lockfd = os.open(spool_dir, os.O_RDONLY)
+        try:
+            fcntl.flock(lockfd, fcntl.LOCK_EX)
+            filed, path = tempfile.mkstemp(prefix='.crontab', dir=spool_dir)
+            try:
+                fileh = os.fdopen(filed, 'w')
+                fileh.write(self.render())
+                fileh.close()
+                os.chown(path, uid, gid)
+                os.chmod(path, mode)
+                os.rename(path, self.spool_file)
+            except (IOError, OSError):
+                e = get_exception()
+                if os.path.exists(path):
+                    os.unlink(path)
+                self.module.fail_json(msg="Unable to write %s: %s" % (self.spool_file, str(e)))
+            os.utime(spool_dir, None)
+        finally:
+            os.close(lockfd)
+
     def add_job(self, name, job):
         # Add the comment
         self.lines.append("%s%s" % (self.ansible, name))
@@ -363,17 +490,72 @@ class CronTab(object):
             raise CronTabError("Unexpected error:", sys.exc_info()[0])
 
     def find_job(self, name):
-        comment = None
+        index = self._job_index().get(name)
+        if index is None:
+            return []
+        return [name, self.lines[index + 1]]
+
+    def _job_index(self):
+        """
+        Map each job name to the index of its "#Ansible: " comment line; only
+        comments followed by a job line are indexed, the first one wins.
+        """
+        index = {}
+        prefix_len = len(self.ansible)
+        for i in range(len(self.lines) - 1):
+            l = self.lines[i]
+            if l.startswith(self.ansible):
+                index.setdefault(l[prefix_len:], i)
+        return index
+
+    def apply_jobs(self, jobs):
+        """
+        Add, update or remove a batch of named jobs in one pass over the crontab.
+
+        jobs - list of (name, job) tuples, job being None to remove the entry
+
+        Returns the names of the jobs that were changed.
+        """
+        index = self._job_index()
+        wanted = dict(jobs)
+        changed = []
+        for name, job in jobs:
+            i = index.get(name)
+            if job is None:
+                if i is not None:
+                    changed.append(name)
+            elif i is None or self.lines[i + 1] != job:
+                changed.append(name)
+
+        if not changed:
+            return changed
+
+        pending = set(changed)
+        newlines = []
+        skip = False
         for l in self.lines:
-            if comment is not None:
-                if comment == name:
-                    return [comment, l]
-                else:
-                    comment = None
-            elif re.match( r'%s' % self.ansible, l):
-                comment = re.sub( r'%s' % self.ansible, '', l)
+            if skip:
+                skip = False
+                continue
+            if l.startswith(self.ansible) and l[len(self.ansible):] in pending:
+                # drop the comment and the job line that follows it; updated
+                # entries are re-added in place
+                name = l[len(self.ansible):]
+                skip = True
+                if wanted[name] is not None:
+                    newlines.append(l)
+                    newlines.append(wanted[name])
+                    wanted[name] = None
+                continue
+            newlines.append(l)
+
+        for name in changed:
+            if wanted[name] is not None:
+                newlines.append("%s%s" % (self.ansible, name))
+                newlines.append(wanted[name])
 
-        return []
+        self.lines = newlines
+        return changed
 
     def find_env(self, name):
         for index, l in enumerate(self.lines):
@@ -539,11 +721,16 @@ def main():
             env=dict(required=False, type='bool'),
             insertafter=dict(required=False),
             insertbefore=dict(required=False),
+            jobs=dict(required=False, type='list'),
+            use_spool=dict(default=False, type='bool'),
         ),
         supports_check_mode = True,
         mutually_exclusive=[
                 ['reboot', 'special_time'],
                 ['insertafter', 'insertbefore'],
+                ['jobs', 'name'],
+                ['jobs', 'job'],
+                ['jobs', 'env'],
             ]
     )
 
@@ -564,6 +751,8 @@ def main():
     env          = module.params['env']
     insertafter  = module.params['insertafter']
     insertbefore = module.params['insertbefore']
+    jobs         = module.params['jobs']
+    use_spool    = module.params['use_spool']
     do_install   = state == 'present'
 
     changed      = False
@@ -571,7 +760,7 @@ def main():
 
     # Ensure all files generated are only writable by the owning user.  Primarily relevant for the cron_file option.
     os.umask(int('022', 8))
-    crontab = CronTab(module, user, cron_file)
+    crontab = CronTab(module, user, cron_file, use_spool)
 
     module.debug('cron instantiated - name: "%s"' % name)
 
@@ -592,11 +781,41 @@ def main():
        (True in [(x != '*') for x in [minute, hour, day, month, weekday]]):
         module.fail_json(msg="You must specify time and date fields or special time.")
 
+    if jobs is not None:
+        batch = []
+        for entry in jobs:
+            if not isinstance(entry, dict):
+                module.fail_json(msg="Each item of 'jobs' must be a dictionary")
+            unknown = set(entry).difference(JOB_OPTIONS)
+            if unknown:
+                module.fail_json(msg="Unsupported keys in 'jobs' item: %s" % ", ".join(sorted(unknown)))
+            entry = dict(JOB_OPTIONS, **entry)
+            if not entry['name']:
+                module.fail_json(msg="Each item of 'jobs' must have a name")
+            if entry['name'] in [b[0] for b in batch]:
+                module.fail_json(msg="Job '%s' is listed more than once" % entry['name'])
+            if entry['state'] not in ('present', 'absent'):
+                module.fail_json(msg="Invalid state '%s' for job '%s'" % (entry['state'], entry['name']))
+            if entry['state'] == 'absent':
+                batch.append((entry['name'], None))
+                continue
+            if entry['job'] is None:
+                module.fail_json(msg="You must specify 'job' to install cron job '%s'" % entry['name'])
+            if entry['special_time'] and \
+               (True in [(str(entry[x]) != '*') for x in ['minute', 'hour', 'day', 'month', 'weekday']]):
+                module.fail_json(msg="You must specify time and date fields or special time for job '%s'" % entry['name'])
+            if cron_file and not user:
+                module.fail_json(msg="To use cron_file=... parameter you must specify user=... as well")
+            batch.append((entry['name'], crontab.get_cron_job(entry['minute'], entry['hour'], entry['day'],
+                                                               entry['month'], entry['weekday'], entry['job'],
+                                                               entry['special_time'],
+                                                               module.boolean(entry['disabled']))))
+
     if cron_file and do_install:
         if not user:
             module.fail_json(msg="To use cron_file=... parameter you must specify user=... as well")
 
-    if job is None and do_install:
+    if job is None and do_install and jobs is None:
         module.fail_json(msg="You must specify 'job' to install a new cron job or variable")
 
     if (insertafter or insertbefore) and not env and do_install:
@@ -611,7 +830,7 @@ def main():
         crontab.write(backup_file)
 
 
-    if crontab.cron_file and not name and not do_install:
+    if crontab.cron_file and not name and not do_install and jobs is None:
         if module._diff:
             diff['after'] = ''
             diff['after_header'] = '/dev/null'
@@ -623,7 +842,10 @@ def main():
             changed = crontab.remove_job_file()
         module.exit_json(changed=changed,cron_file=cron_file,state=state,diff=diff)
 
-    if env:
+    if jobs is not None:
+        changed_jobs = crontab.apply_jobs(batch)
+        changed = len(changed_jobs) > 0
+    elif env:
         if ' ' in name:
             module.fail_json(msg="Invalid name for environment variable")
         decl = '%s="%s"' % (name, job)
@@ -661,6 +883,8 @@ def main():
         envs = crontab.get_envnames(),
         changed = changed
     )
+    if jobs is not None:
+        res_args['changed_jobs'] = changed_jobs
 
     if changed:
         if not module.check_mode:
@@ -46,6 +46,11 @@ EXAMPLES = '''
 import socket
 from distutils.version import LooseVersion
 
+# ohai and facter report the hostname; setup with fact_cache=yes may hold
+# a copy of their facts here
+CACHED_HOSTNAME_FACTS = ['/var/cache/ansible/facts/ohai.json',
+                         '/var/cache/ansible/facts/facter.json']
+
 # import module snippets
 from ansible.module_utils.basic import *
 
@@ -655,6 +660,13 @@ class FreeBSDHostname(Hostname):
 
 # ===========================================
 
+def forget_cached_hostname_facts():
+    for path in CACHED_HOSTNAME_FACTS:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
 def main():
     module = AnsibleModule(
         argument_spec = dict(
@@ -676,6 +688,9 @@ def main():
         hostname.set_permanent_hostname(name)
         changed = True
 
+    if changed:
+        forget_cached_hostname_facts()
+
     module.exit_json(changed=changed, name=name,
                      ansible_facts=dict(ansible_hostname=name.split('.')[0],
                                         ansible_nodename=name,
@@ -31,7 +31,8 @@ options:
   name:
     description:
       - "path to the mount point, eg: C(/mnt/files)"
-    required: true
+      - Required unless C(mounts) is given.
+    required: false
   src:
     description:
         - device to be mounted on I(name). Required when C(state=present) or C(state=mounted)
@@ -63,7 +64,8 @@ options:
       - C(absent) and C(present) only deal with I(fstab) but will not affect current mounting.
       - If specifying C(mounted) and the mount point is not present, the mount point will be created. Similarly.
       - Specifying C(absent) will remove the mount point directory.
-    required: true
+      - Required unless C(mounts) is given.
+    required: false
     choices: [ "present", "absent", "mounted", "unmounted" ]
   fstab:
     description:
@@ -72,6 +74,20 @@ options:
         you need to configure mountpoints in a chroot environment.
     required: false
     default: /etc/fstab
+  mounts:
+    description:
+      - A list of mount points to manage in a single task. Each item is a dictionary
+        accepting the C(name), C(src), C(fstype), C(opts), C(dump), C(passno) and C(state)
+        keys with the same meaning as the module options; C(name) and C(state) are required.
+      - The fstab file is parsed once and written at most once for the whole list.
+        Cannot be combined with C(name) or C(state).
+    required: false
+    default: null
+    version_added: "2.2"
+notes:
+  - On Linux the live mount state is read from C(/proc/self/mountinfo). A mount point
+    that is already mounted with the requested source, file-system type and options is
+    not remounted when its fstab entry changes.
 
 author:
     - Ansible Core Team
@@ -86,17 +102,40 @@ EXAMPLES = '''
 
 # Mount up device by UUID
 - mount: name=/home src='UUID=b3e48f45-f933-4c8e-a700-22a159ec9077' fstype=xfs opts=noatime state=present
+
+# Manage several mount points with a single fstab update
+- mount:
+    mounts:
+      - { name: /srv/disk1, src: 'LABEL=disk1', fstype: xfs, opts: noatime, state: mounted }
+      - { name: /srv/disk2, src: 'LABEL=disk2', fstype: xfs, opts: noatime, state: mounted }
+      - { name: /srv/old, state: absent }
 '''
 
+import re
+import tempfile
+
 
-def write_fstab(lines, dest):
+# mounts are hardware facts, which setup with fact_cache=yes may have cached
+CACHED_HARDWARE_FACTS = '/var/cache/ansible/facts/hardware.json'
 
-    fs_w = open(dest, 'w')
-    for l in lines:
-        fs_w.write(l)
+MOUNT_OPTIONS = ('name', 'src', 'fstype', 'opts', 'dump', 'passno', 'state')
+
+# options that only have a meaning in fstab and never show up in the live
+# mount options
+FSTAB_ONLY_OPTS = frozenset(['defaults', 'auto', 'noauto', 'user', 'users', 'nouser',
+                             'owner', 'group', 'nofail', '_netdev'])
+
+# per mount options the kernel shows even when they were not requested
+KERNEL_DEFAULT_MOUNT_OPTS = frozenset(['rw', 'relatime'])
+
+# fstab source prefixes resolvable through /dev/disk
+DISK_LINK_DIRS = {
+    'UUID': '/dev/disk/by-uuid',
+    'LABEL': '/dev/disk/by-label',
+    'PARTUUID': '/dev/disk/by-partuuid',
+    'PARTLABEL': '/dev/disk/by-partlabel',
+}
 
-    fs_w.flush()
-    fs_w.close()
 
 def _escape_fstab(v):
     """ escape space (040), ampersand (046) and backslash (134) which are invalid in fstab fields """
@@ -105,109 +144,184 @@ def _escape_fstab(v):
     else:
         return v.replace('\\', '\\134').replace(' ', '\\040').replace('&', '\\046')
 
-def set_mount(module, **kwargs):
-    """ set/change a mount point location in fstab """
+def _unescape_octal(v):
+    """ undo the octal escaping used in fstab and mountinfo fields """
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), v)
 
-    # kwargs: name, src, fstype, opts, dump, passno, state, fstab=/etc/fstab
-    args = dict(
-        opts   = 'defaults',
-        dump   = '0',
-        passno = '0',
-        fstab  = '/etc/fstab'
-    )
-    args.update(kwargs)
+
+class Fstab(object):
+    """
+    fstab file parsed once, with its entries indexed by mount point so that
+    any number of entries can be set or removed before a single write.
+    """
 
     new_line = '%(src)s %(name)s %(fstype)s %(opts)s %(dump)s %(passno)s\n'
 
-    to_write = []
-    exists = False
-    changed = False
-    escaped_args = dict([(k, _escape_fstab(v)) for k, v in args.iteritems()])
-    for line in open(args['fstab'], 'r').readlines():
-        if not line.strip():
-            to_write.append(line)
-            continue
-        if line.strip().startswith('#'):
-            to_write.append(line)
-            continue
-        if len(line.split()) != 6:
+    def __init__(self, module, path):
+        self.module = module
+        self.path = path
+        self.changed = False
+        # mount point -> opts of its entry before set_mount changed them
+        self.previous_opts = {}
+        self.lines = open(path, 'r').readlines()
+        # escaped mount point -> indexes of the lines defining it
+        self.index = {}
+        for i, line in enumerate(self.lines):
+            fields = self._parse(line)
+            if fields is not None:
+                self.index.setdefault(fields['name'], []).append(i)
+
+    def _parse(self, line):
+        if not line.strip() or line.strip().startswith('#'):
+            return None
+        fields = line.split()
+        if len(fields) != 6:
             # not sure what this is or why it is here
             # but it is not our fault so leave it be
-            to_write.append(line)
-            continue
-
-        ld = {}
-        ld['src'], ld['name'], ld['fstype'], ld['opts'], ld['dump'], ld['passno']  = line.split()
-
-        if ld['name'] != escaped_args['name']:
-            to_write.append(line)
-            continue
+            return None
+        return dict(zip(('src', 'name', 'fstype', 'opts', 'dump', 'passno'), fields))
 
-        # it exists - now see if what we have is different
-        exists = True
-        for t in ('src', 'fstype','opts', 'dump', 'passno'):
-            if ld[t] != escaped_args[t]:
-                changed = True
-                ld[t] = escaped_args[t]
+    def set_mount(self, **kwargs):
+        """ set/change a mount point location, return True if changed """
 
-        if changed:
-            to_write.append(new_line % ld)
+        # kwargs: name, src, fstype, opts, dump, passno
+        args = dict(
+            opts   = 'defaults',
+            dump   = '0',
+            passno = '0',
+        )
+        args.update(kwargs)
+        escaped_args = dict([(k, _escape_fstab(v)) for k, v in args.items()])
+
+        changed = False
+        indexes = self.index.get(escaped_args['name'])
+        if not indexes:
+            self.index[escaped_args['name']] = [len(self.lines)]
+            self.lines.append(self.new_line % escaped_args)
+            changed = True
         else:
-            to_write.append(line)
-
-    if not exists:
-        to_write.append(new_line % escaped_args)
-        changed = True
-
-    if changed and not module.check_mode:
-        write_fstab(to_write, args['fstab'])
-
-    return (args['name'], changed)
-
-
-def unset_mount(module, **kwargs):
-    """ remove a mount point from fstab """
-
-    # kwargs: name, src, fstype, opts, dump, passno, state, fstab=/etc/fstab
-    args = dict(
-        opts   = 'default',
-        dump   = '0',
-        passno = '0',
-        fstab  = '/etc/fstab'
-    )
-    args.update(kwargs)
-
-    to_write = []
-    changed = False
-    escaped_name = _escape_fstab(args['name'])
-    for line in open(args['fstab'], 'r').readlines():
-        if not line.strip():
-            to_write.append(line)
-            continue
-        if line.strip().startswith('#'):
-            to_write.append(line)
-            continue
-        if len(line.split()) != 6:
-            # not sure what this is or why it is here
-            # but it is not our fault so leave it be
-            to_write.append(line)
-            continue
-
-        ld = {}
-        ld['src'], ld['name'], ld['fstype'], ld['opts'], ld['dump'], ld['passno']  = line.split()
-
-        if ld['name'] != escaped_name:
-            to_write.append(line)
-            continue
-
-        # if we got here we found a match - continue and mark changed
-        changed = True
-
-    if changed and not module.check_mode:
-        write_fstab(to_write, args['fstab'])
-
-    return (args['name'], changed)
-
+            for i in indexes:
+                # it exists - now see if what we have is different
+                ld = self._parse(self.lines[i])
+                if ld['opts'] != escaped_args['opts']:
+                    self.previous_opts.setdefault(args['name'], _unescape_octal(ld['opts']))
+                for t in ('src', 'fstype', 'opts', 'dump', 'passno'):
+                    if ld[t] != escaped_args[t]:
+                        changed = True
+                        ld[t] = escaped_args[t]
+                if changed:
+                    self.lines[i] = self.new_line % ld
+
+        self.changed = self.changed or changed
+        return changed
+
+    def unset_mount(self, name):
+        """ remove a mount point, return True if changed """
+
+        indexes = self.index.pop(_escape_fstab(name), None)
+        if not indexes:
+            return False
+        for i in indexes:
+            self.lines[i] = None
+        self.changed = True
+        return True
+
+    def write(self):
+        """ atomically replace the fstab file with the current entries """
+
+        fd, tmp_path = tempfile.mkstemp(prefix='.fstab', dir=os.path.dirname(os.path.abspath(self.path)))
+        fs_w = os.fdopen(fd, 'w')
+        try:
+            for l in self.lines:
+                if l is not None:
+                    fs_w.write(l)
+            fs_w.flush()
+        finally:
+            fs_w.close()
+        self.module.atomic_move(tmp_path, self.path)
+
+
+def get_mountinfo(path='/proc/self/mountinfo'):
+    """
+    Return the live mounts from mountinfo as a dict of mount point -> dict of
+    src, fstype, opts (per mount and superblock options) and mount_opts (per
+    mount options only), or None if mountinfo is not available.
+    """
+    try:
+        f = open(path, 'r')
+    except IOError:
+        return None
+
+    mounts = {}
+    try:
+        for line in f:
+            fields = line.split()
+            try:
+                sep = fields.index('-', 6)
+            except ValueError:
+                continue
+            mount_opts = set(fields[5].split(','))
+            opts = set(mount_opts)
+            if len(fields) > sep + 3:
+                opts.update(fields[sep + 3].split(','))
+            # later entries are mounted on top of earlier ones
+            mounts[_unescape_octal(fields[4])] = dict(
+                fstype = fields[sep + 1],
+                src    = _unescape_octal(fields[sep + 2]),
+                opts   = opts,
+                mount_opts = mount_opts,
+            )
+    finally:
+        f.close()
+    return mounts
+
+def _resolve_src(src):
+    """ resolve an fstab/mountinfo source to a canonical device path if possible """
+    if '=' in src:
+        tag, value = src.split('=', 1)
+        if tag in DISK_LINK_DIRS:
+            src = os.path.join(DISK_LINK_DIRS[tag], value.strip('"'))
+    if src.startswith('/'):
+        return os.path.realpath(src)
+    return src
+
+def is_mounted(name, mountinfo):
+    if mountinfo is None:
+        return ismount(name)
+    return os.path.realpath(name) in mountinfo
+
+def _live_opts(opts):
+    """ the options of an fstab opts field that can show up in mountinfo """
+    opts = set(opts.split(','))
+    return set([o for o in opts if o not in FSTAB_ONLY_OPTS and not o.startswith('x-') and not o.startswith('comment=')])
+
+def is_current(args, mountinfo, previous_opts=None):
+    """
+    check whether the live mount already matches src, fstype and opts.
+    previous_opts are the fstab opts before they were changed, if they were.
+    """
+    if mountinfo is None:
+        return False
+    live = mountinfo.get(os.path.realpath(args['name']))
+    if live is None:
+        return False
+    if args['fstype'] != live['fstype']:
+        return False
+    if _resolve_src(args['src']) != _resolve_src(live['src']):
+        return False
+    opts = _live_opts(args.get('opts', 'defaults'))
+    if not opts.issubset(live['opts']):
+        return False
+    # an option dropped from opts must also be gone from the live mount,
+    # e.g. ro,noexec -> defaults still needs a remount
+    if not live['mount_opts'].difference(KERNEL_DEFAULT_MOUNT_OPTS).issubset(opts):
+        return False
+    if previous_opts is not None:
+        # superblock options include fs specific defaults, so only those
+        # removed from the fstab entry can be checked
+        if _live_opts(previous_opts).difference(opts).intersection(live['opts']):
+            return False
+    return True
 
 def mount(module, **kwargs):
     """ mount up a path or remount if needed """
@@ -254,61 +368,23 @@ def umount(module, **kwargs):
     else:
         return rc, out+err
 
-def main():
-
-    module = AnsibleModule(
-        argument_spec = dict(
-            state  = dict(required=True, choices=['present', 'absent', 'mounted', 'unmounted']),
-            name   = dict(required=True),
-            opts   = dict(default=None),
-            passno = dict(default=None, type='str'),
-            dump   = dict(default=None),
-            src    = dict(required=False),
-            fstype = dict(required=False),
-            fstab  = dict(default='/etc/fstab')
-        ),
-        supports_check_mode=True,
-        required_if = (
-            ['state', 'mounted', ['src', 'fstype']],
-            ['state', 'present', ['src', 'fstype']]
-        )
-    )
-
-
-    changed = False
-    rc = 0
-    args = {'name': module.params['name']}
-    if module.params['src'] is not None:
-        args['src'] = module.params['src']
-    if module.params['fstype'] is not None:
-        args['fstype'] = module.params['fstype']
-    if module.params['passno'] is not None:
-        args['passno'] = module.params['passno']
-    if module.params['opts'] is not None:
-        args['opts'] = module.params['opts']
-    if module.params['dump'] is not None:
-        args['dump'] = module.params['dump']
-    if module.params['fstab'] is not None:
-        args['fstab'] = module.params['fstab']
-
-    # if fstab file does not exist, we first need to create it. This mainly
-    # happens when fstab optin is passed to the module.
-    if not os.path.exists(args['fstab']):
-        if not os.path.exists(os.path.dirname(args['fstab'])):
-            os.makedirs(os.path.dirname(args['fstab']))
-        open(args['fstab'],'a').close()
+def forget_cached_hardware_facts():
+    try:
+        os.unlink(CACHED_HARDWARE_FACTS)
+    except OSError:
+        pass
 
-    # absent == remove from fstab and unmounted
-    # unmounted == do not change fstab state, but unmount
-    # present == add to fstab, do not change mount state
-    # mounted == add to fstab if not there and make sure it is mounted, if it has changed in fstab then remount it
+def apply_state(module, args, state, changed, mountinfo, previous_opts=None):
+    """
+    Bring the live mount state of args['name'] in line with state, changed
+    telling whether its fstab entry was modified and previous_opts holding
+    its opts before the modification. Returns the new changed.
+    """
 
-    state = module.params['state']
-    name  = module.params['name']
+    name = args['name']
     if state == 'absent':
-        name, changed = unset_mount(module, **args)
         if changed and not module.check_mode:
-            if ismount(name):
+            if is_mounted(name, mountinfo):
                 res,msg  = umount(module, **args)
                 if res:
                     module.fail_json(msg="Error unmounting %s: %s" % (name, msg))
@@ -320,57 +396,137 @@ def main():
                     e = get_exception()
                     module.fail_json(msg="Error rmdir %s: %s" % (name, str(e)))
 
-        module.exit_json(changed=changed, **args)
-
-    if state == 'unmounted':
-        if ismount(name):
+    elif state == 'unmounted':
+        if is_mounted(name, mountinfo):
             if not module.check_mode:
                 res,msg  = umount(module, **args)
                 if res:
                     module.fail_json(msg="Error unmounting %s: %s" % (name, msg))
             changed = True
 
-        module.exit_json(changed=changed, **args)
+    elif state == 'mounted':
+        res = 0
+        if is_mounted(name, mountinfo):
+            if changed and not module.check_mode and not is_current(args, mountinfo, previous_opts):
+                res,msg = mount(module, **args)
+        elif 'bind' in args.get('opts', []):
+            changed = True
+            cmd = 'mount -l'
+            rc, out, err = module.run_command(cmd)
+            allmounts = out.split('\n')
+            for mounts in allmounts[:-1]:
+                arguments = mounts.split()
+                if arguments[0] == args['src'] and arguments[2] == args['name'] and arguments[4] == args['fstype']:
+                    changed = False
+            if changed:
+                res,msg = mount(module, **args)
+        else:
+            changed = True
+            if not module.check_mode:
+                res,msg = mount(module, **args)
 
-    if state in ['mounted', 'present']:
-        if state == 'mounted':
-            if not os.path.exists(name) and not module.check_mode:
-                try:
-                    os.makedirs(name)
-                except (OSError, IOError):
-                    e = get_exception()
-                    module.fail_json(msg="Error making dir %s: %s" % (name, str(e)))
-
-        name, changed = set_mount(module, **args)
-        if state == 'mounted':
-            res = 0
-            if ismount(name):
-                if changed and not module.check_mode:
-                    res,msg = mount(module, **args)
-            elif 'bind' in args.get('opts', []):
-                changed = True
-                cmd = 'mount -l'
-                rc, out, err = module.run_command(cmd)
-                allmounts = out.split('\n')
-                for mounts in allmounts[:-1]:
-                    arguments = mounts.split()
-                    if arguments[0] == args['src'] and arguments[2] == args['name'] and arguments[4] == args['fstype']:
-                        changed = False
-                if changed:
-                    res,msg = mount(module, **args)
-            else:
-                changed = True
-                if not module.check_mode:
-                    res,msg = mount(module, **args)
+        if res:
+            module.fail_json(msg="Error mounting %s: %s" % (name, msg))
 
+    return changed
+
+def main():
+
+    module = AnsibleModule(
+        argument_spec = dict(
+            state  = dict(required=False, choices=['present', 'absent', 'mounted', 'unmounted']),
+            name   = dict(required=False),
+            opts   = dict(default=None),
+            passno = dict(default=None, type='str'),
+            dump   = dict(default=None),
+            src    = dict(required=False),
+            fstype = dict(required=False),
+            fstab  = dict(default='/etc/fstab'),
+            mounts = dict(required=False, type='list'),
+        ),
+        supports_check_mode=True,
+        required_if = (
+            ['state', 'mounted', ['src', 'fstype']],
+            ['state', 'present', ['src', 'fstype']]
+        ),
+        required_together = [['name', 'state']],
+        required_one_of = [['name', 'mounts']],
+        mutually_exclusive = [['name', 'mounts'], ['state', 'mounts']],
+    )
 
-            if res:
-                module.fail_json(msg="Error mounting %s: %s" % (name, msg))
+    # absent == remove from fstab and unmounted
+    # unmounted == do not change fstab state, but unmount
+    # present == add to fstab, do not change mount state
+    # mounted == add to fstab if not there and make sure it is mounted, if it has changed in fstab then remount it
 
+    if module.params['mounts'] is not None:
+        items = []
+        for item in module.params['mounts']:
+            if not isinstance(item, dict):
+                module.fail_json(msg="Each item of 'mounts' must be a dictionary")
+            unknown = set(item).difference(MOUNT_OPTIONS)
+            if unknown:
+                module.fail_json(msg="Unsupported keys in 'mounts' item: %s" % ", ".join(sorted(unknown)))
+            if not item.get('name') or item.get('state') not in ('present', 'absent', 'mounted', 'unmounted'):
+                module.fail_json(msg="Each item of 'mounts' needs a name and a valid state: %s" % item)
+            if item['state'] in ('present', 'mounted') and not (item.get('src') and item.get('fstype')):
+                module.fail_json(msg="src and fstype are required for %s with state=%s" % (item['name'], item['state']))
+            args = dict([(k, str(v)) for k, v in item.items() if k != 'state' and v is not None])
+            items.append((args, item['state']))
+    else:
+        args = {'name': module.params['name']}
+        for option in ('src', 'fstype', 'passno', 'opts', 'dump'):
+            if module.params[option] is not None:
+                args[option] = module.params[option]
+        items = [(args, module.params['state'])]
 
-        module.exit_json(changed=changed, **args)
+    fstab_path = module.params['fstab']
 
-    module.fail_json(msg='Unexpected position reached')
+    # if fstab file does not exist, we first need to create it. This mainly
+    # happens when fstab optin is passed to the module.
+    if not os.path.exists(fstab_path):
+        if not os.path.exists(os.path.dirname(fstab_path)):
+            os.makedirs(os.path.dirname(fstab_path))
+        open(fstab_path,'a').close()
+
+    fstab = Fstab(module, fstab_path)
+    results = []
+    for args, state in items:
+        changed = False
+        name = args['name']
+        if state == 'absent':
+            changed = fstab.unset_mount(name)
+        elif state in ['mounted', 'present']:
+            if state == 'mounted':
+                if not os.path.exists(name) and not module.check_mode:
+                    try:
+                        os.makedirs(name)
+                    except (OSError, IOError):
+                        e = get_exception()
+                        module.fail_json(msg="Error making dir %s: %s" % (name, str(e)))
+            changed = fstab.set_mount(**args)
+        results.append(changed)
+
+    if fstab.changed and not module.check_mode:
+        fstab.write()
+
+    mountinfo = None
+    if get_platform() == 'Linux':
+        mountinfo = get_mountinfo()
+
+    for i, (args, state) in enumerate(items):
+        args['fstab'] = fstab_path
+        results[i] = apply_state(module, args, state, results[i], mountinfo,
+                                 fstab.previous_opts.get(args['name']))
+
+    if True in results and not module.check_mode:
+        forget_cached_hardware_facts()
+
+    if module.params['mounts'] is not None:
+        mounts = [dict(name=args['name'], state=state, changed=results[i]) for i, (args, state) in enumerate(items)]
+        module.exit_json(changed=True in results, mounts=mounts, fstab=fstab_path)
+
+    module.exit_json(changed=results[0], **items[0][0])
 
 # import module snippets
 from ansible.module_utils.basic import *
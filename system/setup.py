@@ -43,6 +43,19 @@ options:
             - "Set the default timeout in seconds for individual fact gathering"
         required: false
         default: 10
+    gather_workers:
+        version_added: "2.2"
+        description:
+            - "If greater than 0, collect the hardware, network, virtual, ohai and
+              facter subsets in separate processes, at most this many at once, after
+              collecting the minimal facts once. A collector still running after twice
+              C(gather_timeout) seconds is stopped and its facts are left out with a
+              warning; the facts of the collectors that finished are still returned.
+              The time taken by each collector is returned in the
+              C(ansible_facts_timings) fact."
+            - "With the default of C(0) all facts are gathered in the module process."
+        required: false
+        default: 0
     filter:
         version_added: "1.1"
         description:
@@ -58,6 +71,34 @@ options:
               File/results format can be json or ini-format
         required: false
         default: '/etc/ansible/facts.d'
+    fact_cache:
+        version_added: "2.2"
+        description:
+            - "If C(yes), keep the facts of the hardware, network, virtual, ohai and
+              facter subsets in an on-host cache and only collect a subset again when
+              its cached copy is older than its TTL (see C(fact_cache_ttl)) or was
+              collected before the last reboot. The minimal facts (date, environment,
+              local facts, ...) are always collected."
+        required: false
+        default: "no"
+        choices: [ "yes", "no" ]
+    fact_cache_dir:
+        version_added: "2.2"
+        description:
+            - "Directory holding the fact cache. M(hostname), M(mount) and M(sysctl)
+              (for C(net.*) keys) remove the subsets they affect from the default
+              directory when they change the host."
+        required: false
+        default: '/var/cache/ansible/facts'
+    fact_cache_ttl:
+        version_added: "2.2"
+        description:
+            - "A dictionary of subset name to the number of seconds its cached facts
+              stay valid, overriding the defaults of C(hardware=86400), C(virtual=86400),
+              C(network=60), C(ohai=3600) and C(facter=3600). A TTL of 0 disables
+              caching for that subset."
+        required: false
+        default: null
 description:
      - This module is automatically called by playbooks to gather useful
        variables about remote hosts that can be used in playbooks. It can also be
@@ -108,22 +149,318 @@ ansible all -m setup -a 'gather_subset=!facter,!ohai'
 # Only collect the minimum amount of facts:
 ansible all -m setup -a 'gather_subset=!all'
 
+# Reuse hardware facts for a day and network facts for a minute
+ansible all -m setup -a 'fact_cache=yes fact_cache_ttl={"network": 60, "hardware": 86400}'
+
 # Display facts from Windows hosts with custom facts stored in C(C:\\custom_facts).
 ansible windows -m setup -a "fact_path='c:\\custom_facts'"
 """
 
+import fnmatch
+import os
+import select
+import signal
+import sys
+import tempfile
+import time
+
+CACHED_SUBSETS = ('hardware', 'network', 'virtual', 'ohai', 'facter')
+
+FACT_CACHE_TTLS = dict(
+    hardware=86400,
+    virtual=86400,
+    network=60,
+    ohai=3600,
+    facter=3600,
+)
+
+BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+
+# a collector is stopped after this many times gather_timeout, which only
+# bounds the individual lookups inside it
+COLLECTOR_TIMEOUT_FACTOR = 2
+
+
+class FactCache(object):
+    """
+    On-host cache of fact subsets, one JSON file per subset. An entry is only
+    valid for the boot it was collected in and for the TTL of its subset.
+    """
+
+    def __init__(self, module, path, ttls):
+        self.module = module
+        self.path = path
+        self.ttls = ttls
+        self.boot_id = self._read_boot_id()
+
+    def _read_boot_id(self):
+        try:
+            f = open(BOOT_ID_PATH, 'r')
+            try:
+                return f.read().strip()
+            finally:
+                f.close()
+        except IOError:
+            return None
+
+    def _subset_path(self, subset):
+        return os.path.join(self.path, '%s.json' % subset)
+
+    def get(self, subset):
+        """ return the cached facts of subset, or None if missing or stale """
+        ttl = self.ttls.get(subset, 0)
+        if ttl <= 0:
+            return None
+        try:
+            f = open(self._subset_path(subset), 'r')
+            try:
+                entry = json.loads(f.read())
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+        if entry.get('boot_id') != self.boot_id:
+            return None
+        if not 0 <= time.time() - entry.get('collected', 0) < ttl:
+            return None
+        return entry.get('facts')
+
+    def set(self, subset, facts):
+        if self.ttls.get(subset, 0) <= 0:
+            return
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path, int('0700', 8))
+            fd, tmp_path = tempfile.mkstemp(prefix='.%s' % subset, dir=self.path)
+            f = os.fdopen(fd, 'w')
+            try:
+                f.write(json.dumps(dict(boot_id=self.boot_id, collected=time.time(), facts=facts)))
+            finally:
+                f.close()
+            os.rename(tmp_path, self._subset_path(subset))
+        except (IOError, OSError):
+            # the cache is an optimization only, never fail fact gathering
+            e = get_exception()
+            self.module.debug('unable to cache %s facts: %s' % (subset, str(e)))
+
+
+def get_subsets(module):
+    """ resolve gather_subset into the set of subsets to collect """
+    additional_subsets = set()
+    exclude_subsets = set()
+    for subset in module.params['gather_subset']:
+        exclude = subset.startswith('!')
+        if exclude:
+            subset = subset[1:]
+        if subset == 'all':
+            subsets = CACHED_SUBSETS
+        elif subset in CACHED_SUBSETS:
+            subsets = (subset,)
+        else:
+            module.fail_json(msg='Bad subset \'%s\' given to Ansible. gather_subset options allowed: all, %s' %
+                             (subset, ", ".join(CACHED_SUBSETS)))
+        if exclude:
+            exclude_subsets.update(subsets)
+        else:
+            additional_subsets.update(subsets)
+    if not additional_subsets:
+        additional_subsets.update(CACHED_SUBSETS)
+    return additional_subsets.difference(exclude_subsets)
+
+def _prefixed(prefix, facts):
+    return dict([('%s_%s' % (prefix, k.replace('-', '_')), v) for (k, v) in facts.items()])
+
+def collect_minimal(module):
+    """
+    Collect the facts that are always gathered, the way get_all_facts does.
+    Returns them unprefixed, as the subset collectors start from them, and
+    prefixed, as they are returned.
+    """
+    # get_all_facts sets the timeout of the individual lookups, do the same
+    # for the collectors we run ourselves
+    sys.modules[get_all_facts.__module__].GATHER_TIMEOUT = module.params['gather_timeout']
+    raw = ansible_facts(module, [])
+    facts = _prefixed('ansible', raw)
+    facts['module_setup'] = True
+    return raw, facts
+
+def collect_subset(module, subset, raw):
+    """ collect the facts subset adds to the minimal facts raw """
+    if subset in ('facter', 'ohai'):
+        # facter and ohai are given a different prefix than other subsets
+        return _prefixed(subset, FACT_SUBSETS[subset](module, load_on_init=False).populate() or {})
+    facts = FACT_SUBSETS[subset](module, load_on_init=False, cached_facts=dict(raw)).populate()
+    return _prefixed('ansible', dict([(k, v) for (k, v) in facts.items() if k not in raw or raw[k] != v]))
+
+def _collector_child(module, subset, raw, w):
+    """ collect subset in a forked child and send the facts as JSON through w """
+    devnull = os.open(os.devnull, os.O_RDWR)
+    # anything printed by the child, e.g. fail_json, would corrupt our output
+    os.dup2(devnull, 1)
+    code = 0
+    try:
+        data = json.dumps(collect_subset(module, subset, raw))
+    except:
+        data = ''
+        code = 1
+    # json.dumps only outputs ASCII
+    data = data.encode('ascii')
+    while data:
+        data = data[os.write(w, data):]
+    os._exit(code)
+
+def run_collectors(module, subsets, raw, workers, timeout):
+    """
+    Collect each subset in a forked child, at most workers at once,
+    stopping any collector still running after timeout seconds.
+
+    Returns dicts of subset -> facts and subset -> seconds taken, and the
+    subsets whose collector failed or timed out.
+    """
+    pending = list(subsets)
+    running = {}  # read fd -> [subset, pid, start, chunks]
+    results = {}
+    timings = {}
+    failed = []
+
+    while pending or running:
+        while pending and len(running) < workers:
+            subset = pending.pop(0)
+            r, w = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(r)
+                _collector_child(module, subset, raw, w)
+            os.close(w)
+            running[r] = [subset, pid, time.time(), []]
+
+        now = time.time()
+        wait = max(0, min([c[2] + timeout for c in running.values()]) - now)
+        readable = select.select(list(running), [], [], wait)[0]
+
+        for fd in readable:
+            subset, pid, start, chunks = running[fd]
+            data = os.read(fd, 65536)
+            if data:
+                # the child only writes ASCII, so chunks decode on their own
+                chunks.append(data.decode('ascii'))
+                continue
+            # the child closed its end, it is done
+            os.close(fd)
+            del running[fd]
+            timings[subset] = round(time.time() - start, 3)
+            status = os.waitpid(pid, 0)[1]
+            try:
+                if status != 0:
+                    raise ValueError
+                results[subset] = json.loads(''.join(chunks))
+            except ValueError:
+                failed.append(subset)
+
+        now = time.time()
+        for fd, (subset, pid, start, chunks) in list(running.items()):
+            if now - start >= timeout:
+                os.close(fd)
+                del running[fd]
+                timings[subset] = round(now - start, 3)
+                failed.append(subset)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                    # do not block on a child stuck in uninterruptible IO
+                    os.waitpid(pid, os.WNOHANG)
+                except OSError:
+                    pass
+
+    return results, timings, failed
+
+def gather_facts(module):
+    """
+    Gather the minimal facts once, then each requested subset, reusing the
+    cached facts of subsets that are still valid when fact_cache is set and
+    collecting the others concurrently when gather_workers is set.
+    """
+    cache = None
+    if module.params['fact_cache']:
+        ttls = dict(FACT_CACHE_TTLS)
+        for subset, ttl in (module.params['fact_cache_ttl'] or {}).items():
+            if subset not in CACHED_SUBSETS:
+                module.fail_json(msg="Unknown subset '%s' in fact_cache_ttl" % subset)
+            try:
+                ttls[subset] = int(ttl)
+            except ValueError:
+                module.fail_json(msg="Invalid TTL '%s' for subset '%s'" % (ttl, subset))
+        cache = FactCache(module, module.params['fact_cache_dir'], ttls)
+
+    workers = module.params['gather_workers']
+    if workers < 0:
+        module.fail_json(msg="gather_workers must not be negative")
+
+    subsets = get_subsets(module)
+    raw, facts = collect_minimal(module)
+
+    cached = {}
+    to_collect = []
+    for subset in sorted(subsets):
+        if cache is not None:
+            cached[subset] = cache.get(subset)
+        if cached.get(subset) is None:
+            to_collect.append(subset)
+
+    timings = {}
+    failed = []
+    timeout = module.params['gather_timeout'] * COLLECTOR_TIMEOUT_FACTOR
+    if workers:
+        results, timings, failed = run_collectors(module, to_collect, raw, workers, timeout)
+    else:
+        results = {}
+        for subset in to_collect:
+            results[subset] = collect_subset(module, subset, raw)
+
+    for subset in sorted(subsets):
+        subset_facts = cached.get(subset)
+        if subset_facts is None:
+            if subset not in results:
+                continue
+            subset_facts = results[subset]
+            if cache is not None:
+                cache.set(subset, subset_facts)
+        facts.update(subset_facts)
+    # as get_all_facts, which leaves out facter and ohai
+    facts['ansible_gather_subset'] = sorted(subsets.difference(('facter', 'ohai')))
+    if workers:
+        facts['ansible_facts_timings'] = timings
+
+    setup_result = { 'ansible_facts': {} }
+    for (k, v) in facts.items():
+        if module.params['filter'] == '*' or fnmatch.fnmatch(k, module.params['filter']):
+            setup_result['ansible_facts'][k] = v
+
+    if failed:
+        setup_result['warnings'] = ['Fact collector %s failed or did not finish within %s seconds, '
+                                    'its facts are missing' % (subset, timeout) for subset in sorted(failed)]
+
+    # hack to keep --verbose from showing all the setup module results
+    setup_result['_ansible_verbose_override'] = True
+    return setup_result
 
 def main():
     module = AnsibleModule(
         argument_spec = dict(
             gather_subset=dict(default=["all"], required=False, type='list'),
             gather_timeout=dict(default=10, required=False, type='int'),
+            gather_workers=dict(default=0, required=False, type='int'),
             filter=dict(default="*", required=False),
             fact_path=dict(default='/etc/ansible/facts.d', required=False),
+            fact_cache=dict(default=False, required=False, type='bool'),
+            fact_cache_dir=dict(default='/var/cache/ansible/facts', required=False, type='path'),
+            fact_cache_ttl=dict(default=None, required=False, type='dict'),
         ),
         supports_check_mode = True,
     )
-    data = get_all_facts(module)
+    if module.params['fact_cache'] or module.params['gather_workers']:
+        data = gather_facts(module)
+    else:
+        data = get_all_facts(module)
     module.exit_json(**data)
 
 # import module snippets
@@ -31,7 +31,8 @@ options:
     name:
         description:
             - The dot-separated path (aka I(key)) specifying the sysctl variable.
-        required: true
+            - Required unless C(entries) is given.
+        required: false
         default: null
         aliases: [ 'key' ]
     value:
@@ -69,7 +70,19 @@ options:
         required: false
         version_added: 1.5
         default: False
-notes: []
+    entries:
+        description:
+            - A dictionary of sysctl keys to their desired values, managed together in a
+              single task. C(state), C(reload), C(sysctl_set) and C(ignoreerrors) apply to
+              every key. Cannot be combined with C(name) or C(value).
+            - The sysctl file is written once, and instead of reloading the whole file only
+              the keys that changed in it are applied.
+        required: false
+        default: null
+        version_added: "2.2"
+notes:
+    - On Linux, values are read from and written to C(/proc/sys) directly, falling back
+      to the sysctl command if that fails.
 requirements: []
 author: "David CHANIAL (@davixx) <david.chanial@gmail.com>"
 '''
@@ -95,6 +108,14 @@ EXAMPLES = '''
 
 # Set ip forwarding on in /proc and in the sysctl file and reload if necessary
 - sysctl: name="net.ipv4.ip_forward" value=1 sysctl_set=yes state=present reload=yes
+
+# Set several values at once, applying only those that changed
+- sysctl:
+    entries:
+      vm.swappiness: 10
+      net.core.somaxconn: 4096
+      net.ipv4.tcp_rmem: "4096 87380 6291456"
+    sysctl_set: yes
 '''
 
 # ==============================================================
@@ -103,6 +124,12 @@ import os
 import tempfile
 import re
 
+# net.* keys can change interfaces and addresses, reported by the network,
+# ohai and facter facts that setup with fact_cache=yes may have cached
+CACHED_NETWORK_FACTS = ['/var/cache/ansible/facts/network.json',
+                        '/var/cache/ansible/facts/ohai.json',
+                        '/var/cache/ansible/facts/facter.json']
+
 class SysctlModule(object):
 
     def __init__(self, module):
@@ -120,6 +147,7 @@ class SysctlModule(object):
         self.changed = False    # will change occur
         self.set_proc = False   # does sysctl need to set value
         self.write_file = False # does the sysctl file need to be reloaded
+        self.changed_keys = []  # tokens whose file or proc value changes
 
         self.process()
 
@@ -132,48 +160,80 @@ class SysctlModule(object):
         self.platform = get_platform().lower()
 
         # Whitespace is bad
-        self.args['name'] = self.args['name'].strip()
-        self.args['value'] = self._parse_value(self.args['value'])
-
-        thisname = self.args['name']
-
-        # get the current proc fs value
-        self.proc_value = self.get_token_curr_value(thisname)
+        if self.args['entries'] is not None:
+            tokens = [(str(k).strip(), self._parse_value(v)) for k, v in sorted(self.args['entries'].items())]
+        else:
+            self.args['name'] = self.args['name'].strip()
+            self.args['value'] = self._parse_value(self.args['value'])
+            tokens = [(self.args['name'], self.args['value'])]
 
-        # get the currect sysctl file value
+        # get the currect sysctl file values
         self.read_sysctl_file()
-        if thisname not in self.file_values:
-            self.file_values[thisname] = None
 
         # update file contents with desired token/value
-        self.fix_lines()
-
-        # what do we need to do now?
-        if self.file_values[thisname] is None and self.args['state'] == "present":
-            self.changed = True
-            self.write_file = True
-        elif self.file_values[thisname] is None and self.args['state'] == "absent":
-            self.changed = False
-        elif self.file_values[thisname] != self.args['value']:
-            self.changed = True
-            self.write_file = True
-
-        # use the sysctl command or not?
-        if self.args['sysctl_set']:            
-            if self.proc_value is None:
-                self.changed = True
-            elif not self._values_is_equal(self.proc_value, self.args['value']):
-                self.changed = True 
-                self.set_proc = True
+        self.fix_lines(tokens)
+
+        file_tokens = []  # tokens changed in the file
+        proc_tokens = []  # tokens to set with sysctl
+        for thisname, thisvalue in tokens:
+            file_value = self.file_values.get(thisname)
+            token_changed = False
+
+            # what do we need to do now?
+            if file_value is None and self.args['state'] == "present":
+                token_changed = True
+                file_tokens.append((thisname, thisvalue))
+            elif file_value is None and self.args['state'] == "absent":
+                pass
+            elif file_value != thisvalue:
+                token_changed = True
+                file_tokens.append((thisname, thisvalue))
+
+            # use the sysctl command or not?
+            if self.args['sysctl_set']:
+                # get the current proc fs value
+                self.proc_value = self.get_token_curr_value(thisname)
+                if self.proc_value is None:
+                    token_changed = True
+                elif not self._values_is_equal(self.proc_value, thisvalue):
+                    token_changed = True
+                    proc_tokens.append((thisname, thisvalue))
+
+            if token_changed:
+                self.changed_keys.append(thisname)
+
+        self.changed = len(self.changed_keys) > 0
+        self.write_file = len(file_tokens) > 0
+        self.set_proc = len(proc_tokens) > 0
 
         # Do the work
         if not self.module.check_mode:
             if self.write_file:
                 self.write_sysctl()
             if self.write_file and self.args['reload']:
-                self.reload_sysctl()
-            if self.set_proc:
-                self.set_token_value(self.args['name'], self.args['value'])
+                if self.args['entries'] is not None:
+                    # only apply what changed rather than reloading the whole file
+                    if self.args['state'] == "present":
+                        for thisname, thisvalue in file_tokens:
+                            if (thisname, thisvalue) not in proc_tokens:
+                                self.set_token_value(thisname, thisvalue, self.args['ignoreerrors'])
+                else:
+                    self.reload_sysctl()
+            for thisname, thisvalue in proc_tokens:
+                self.set_token_value(thisname, thisvalue)
+
+            applied = [t[0] for t in proc_tokens]
+            if self.write_file and self.args['reload']:
+                applied.extend([t[0] for t in file_tokens])
+            if [t for t in applied if t.startswith('net.') or t.startswith('net/')]:
+                self.forget_cached_network_facts()
+
+    def forget_cached_network_facts(self):
+        for path in CACHED_NETWORK_FACTS:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
 
     def _values_is_equal(self, a, b):
         """Expects two string values. It will split the string by whitespace
@@ -206,14 +266,28 @@ class SysctlModule(object):
             else:
                 return value.strip()
         else:
-            return value
+            return str(value)
 
     # ==============================================================
     #   SYSCTL COMMAND MANAGEMENT
     # ==============================================================
 
-    # Use the sysctl command to find the current value 
+    # Path of the token in /proc/sys; dots and slashes swap places, as done by
+    # sysctl for keys such as net.ipv4.conf.eth0/100.rp_filter
+    def _proc_path(self, token):
+        return os.path.join('/proc/sys', *[part.replace('/', '.') for part in token.split('.')])
+
+    # Use /proc/sys or the sysctl command to find the current value
     def get_token_curr_value(self, token):
+        if self.platform == 'linux':
+            try:
+                f = open(self._proc_path(token), 'r')
+                try:
+                    return f.read()
+                finally:
+                    f.close()
+            except IOError:
+                pass
         if self.platform == 'openbsd':
             # openbsd doesn't support -e, just drop it
             thiscmd = "%s -n %s" % (self.sysctl_cmd, token)
@@ -225,8 +299,18 @@ class SysctlModule(object):
         else:
             return out
 
-    # Use the sysctl command to set the current value
-    def set_token_value(self, token, value):
+    # Use /proc/sys or the sysctl command to set the current value
+    def set_token_value(self, token, value, ignoreerrors=False):
+        if self.platform == 'linux':
+            try:
+                f = open(self._proc_path(token), 'w')
+                try:
+                    f.write(value)
+                finally:
+                    f.close()
+                return 0
+            except IOError:
+                pass
         if len(value.split()) > 0:
             value = '"' + value + '"'
         if self.platform == 'openbsd':
@@ -235,7 +319,7 @@ class SysctlModule(object):
         else:
             thiscmd = "%s -w %s=%s" % (self.sysctl_cmd, token, value)
         rc,out,err = self.module.run_command(thiscmd)
-        if rc != 0:
+        if rc != 0 and not ignoreerrors:
             self.module.fail_json(msg='setting %s failed: %s' % (token, out + err))
         else:
             return rc
@@ -298,31 +382,33 @@ class SysctlModule(object):
             v = v.strip()
             self.file_values[k] = v.strip()
 
-    # Fix the value in the sysctl file content
-    def fix_lines(self):
-        checked = []
+    # Fix the values in the sysctl file content
+    def fix_lines(self, tokens):
+        desired = dict(tokens)
+        checked = set()
         self.fixed_lines = []
         for line in self.file_lines:
             if not line.strip() or line.strip().startswith("#"):
                 self.fixed_lines.append(line)
                 continue
-            tmpline = line.strip()            
+            tmpline = line.strip()
             k, v = line.split('=',1)
             k = k.strip()
             v = v.strip()
             if k not in checked:
-                checked.append(k)
-                if k == self.args['name']:
+                checked.add(k)
+                if k in desired:
                     if self.args['state'] == "present":
-                        new_line = "%s=%s\n" % (k, self.args['value'])
-                        self.fixed_lines.append(new_line)                    
+                        new_line = "%s=%s\n" % (k, desired[k])
+                        self.fixed_lines.append(new_line)
                 else:
                     new_line = "%s=%s\n" % (k, v)
-                    self.fixed_lines.append(new_line)                    
+                    self.fixed_lines.append(new_line)
 
-        if self.args['name'] not in checked and self.args['state'] == "present":
-            new_line = "%s=%s\n" % (self.args['name'], self.args['value'])
-            self.fixed_lines.append(new_line)                    
+        for name, value in tokens:
+            if name not in checked and self.args['state'] == "present":
+                new_line = "%s=%s\n" % (name, value)
+                self.fixed_lines.append(new_line)
 
     # Completely rewrite the sysctl file
     def write_sysctl(self):
@@ -350,19 +436,24 @@ def main():
     # defining module
     module = AnsibleModule(
         argument_spec = dict(
-            name = dict(aliases=['key'], required=True),
+            name = dict(aliases=['key'], required=False),
             value = dict(aliases=['val'], required=False, type='str'),
             state = dict(default='present', choices=['present', 'absent']),
             reload = dict(default=True, type='bool'),
             sysctl_set = dict(default=False, type='bool'),
             ignoreerrors = dict(default=False, type='bool'),
-            sysctl_file = dict(default='/etc/sysctl.conf', type='path')
+            sysctl_file = dict(default='/etc/sysctl.conf', type='path'),
+            entries = dict(required=False, type='dict'),
         ),
-        supports_check_mode=True
+        supports_check_mode=True,
+        required_one_of=[['name', 'entries']],
+        mutually_exclusive=[['name', 'entries'], ['value', 'entries']],
     )
 
     result = SysctlModule(module)
 
+    if module.params['entries'] is not None:
+        module.exit_json(changed=result.changed, changed_keys=result.changed_keys)
     module.exit_json(changed=result.changed)
 
 # import module snippets
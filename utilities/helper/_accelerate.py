@@ -62,8 +62,27 @@ options:
     required: false
     default: no
     version_added: "1.6"
+  plaintext_fetch:
+    description:
+      - Allow controllers using transfer protocol 2 to ask for fetched files to be sent
+        unencrypted, which lets the daemon hand the file to the kernel with C(sendfile)
+        on Linux and with python 3.3 or later. Commands, puts and all other traffic stay
+        encrypted. Only enable this on trusted networks.
+    required: false
+    default: no
+    version_added: "2.2"
+  max_commands:
+    description:
+      - Maximum number of commands the daemon runs at the same time. Further commands
+        wait until a running one finishes.
+    required: false
+    default: 64
+    version_added: "2.2"
 notes:
     - See the advanced playbooks chapter for more about using accelerated mode.
+    - Controllers that negotiate transfer protocol 2 with a C(hello) request stream file
+      chunks without waiting for an acknowledgement of each one; other controllers keep
+      using the original protocol.
 requirements:
     - "python >= 2.4"
     - "python-keyczar"
@@ -88,9 +107,12 @@ import json
 import os
 import os.path
 import pwd
+import select
+import shlex
 import signal
 import socket
 import struct
+import subprocess
 import sys
 import syslog
 import tempfile
@@ -98,9 +120,15 @@ import time
 import traceback
 
 import SocketServer
+from Queue import Queue
 
 import datetime
-from threading import Thread, Lock
+from threading import Thread, Lock, activeCount
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
 
 # import module snippets
 # we must import this here at the top so we can use get_module_path()
@@ -112,6 +140,76 @@ from ansible.module_utils.basic import *
 # which leaves room for the TCP/IP header
 CHUNK_SIZE=10240
 
+# transfer protocols, the highest one both sides support is negotiated by
+# a 'hello' request at the start of a connection:
+#  1 - stop-and-wait: each chunk is base64 encoded and wrapped in JSON, and
+#      the sender waits for an encrypted JSON ack before sending the next one
+#  2 - streaming: file data is sent as raw encrypted chunks of up to
+#      STREAM_CHUNK_SIZE bytes, terminated by an empty chunk, followed by a
+#      single response carrying the sha1 digest of the data. When fetching
+#      with a non-zero window, the controller acks every `window` chunks with
+#      {"ack": <chunks received>} and the daemon never has more than two
+#      windows of chunks unacknowledged. If the daemon allows it, a
+#      controller may negotiate plaintext fetches, in which case the file is
+#      sent as a single unencrypted frame (using sendfile where available)
+#      and the response carries its size only. Command requests with
+#      "stream": true get their output as {"stream": "stdout"|"stderr",
+#      "data": ...} messages while running, and a final response without it.
+#
+# A 'stats' request returns the daemon's counters and latency histograms.
+PROTOCOL_VERSION=2
+STREAM_CHUNK_SIZE=262144
+
+# receive buffers up to this size are kept for the next frame of the same
+# connection, larger ones are released once the frame is handled
+RECV_BUFFER_KEEP=4194304
+
+# seconds between keepalive messages sent while commands run
+KEEPALIVE_INTERVAL=15
+
+# keyczar ciphertexts start with a version byte and the 4 byte hash of the
+# key, which identifies the key a connection uses without trial decryption
+KEY_ID_LEN=5
+
+try:
+    memoryview
+    HAS_MEMORYVIEW = True
+except NameError:
+    HAS_MEMORYVIEW = False
+
+def _libc_sendfile():
+    """
+    os.sendfile only exists on python 3.3+, elsewhere call sendfile(2)
+    from the C library. Returns None where neither can be used.
+    """
+    if hasattr(os, 'sendfile'):
+        return os.sendfile
+    # the BSD and OS X sendfile take different arguments
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        # sendfile64 takes a 64 bit offset on 32 bit systems too
+        c_sendfile = libc.sendfile64
+    except:
+        # no ctypes (python < 2.5), no use_errno (python < 2.6) or no libc
+        return None
+    c_sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    c_sendfile.restype = ctypes.c_long
+
+    def sendfile(out_fd, in_fd, offset, count):
+        offset = ctypes.c_int64(offset)
+        n = c_sendfile(out_fd, in_fd, ctypes.byref(offset), count)
+        if n < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return n
+    return sendfile
+
+SENDFILE = _libc_sendfile()
+
 # FIXME: this all should be moved to module_common, as it's 
 #        pretty much a copy from the callbacks/util code
 DEBUG_LEVEL=0
@@ -238,17 +336,9 @@ class LocalSocketThread(Thread):
                 try:
                     try:
                         new_key = AesKey.Read(data.strip())
-                        found = False
-                        for key in self.server.key_list:
-                            try:
-                                new_key.Decrypt(key.Encrypt("foo"))
-                                found = True
-                                break
-                            except:
-                                pass
-                        if not found:
+                        if new_key.Header() not in self.server.key_index:
                             vv("adding new key to the key list")
-                            self.server.key_list.append(new_key)
+                            self.server.add_key(new_key)
                             conn.sendall("OK\n")
                         else:
                             vv("key already exists in the key list, ignoring")
@@ -279,29 +369,209 @@ class LocalSocketThread(Thread):
         self.s.shutdown(socket.SHUT_RDWR)
         self.s.close()
 
-class ThreadWithReturnValue(Thread):
-    def __init__(self, group=None, target=None, name=None, args=(), kwargs={}, Verbose=None):
-        Thread.__init__(self, group, target, name, args, kwargs, Verbose)
-        self._return = None
+class CommandExecutor(Thread):
+    """
+    Runs the commands of all connections from a single thread, multiplexing
+    the output pipes of the children with select(). Each submitted command
+    gets a queue of events:
+
+        ('output', 'stdout'|'stderr', data)  - when streaming output
+        ('keepalive',)                       - every KEEPALIVE_INTERVAL seconds
+        ('exit', rc, stdout, stderr)         - once, when the command is done
+    """
+
+    def __init__(self, max_commands):
+        Thread.__init__(self)
+        self.daemon = True
+        self.max_commands = max_commands
+        self.lock = Lock()
+        self.pending = []   # jobs waiting for a free slot
+        self.jobs = []      # all unfinished jobs, for keepalives
+        self.pipes = {}     # fd -> (job, stream name)
+        self.reaping = []   # jobs whose output is closed, waiting for exit
+        self.running = 0
+        self.wakeup_r, self.wakeup_w = os.pipe()
+
+    def submit(self, cmd, executable=None, stream=False):
+        job = dict(cmd=cmd, executable=executable, stream=stream, events=Queue(),
+                   stdout=[], stderr=[], open=0, proc=None)
+        self.lock.acquire()
+        try:
+            self.pending.append(job)
+            self.jobs.append(job)
+        finally:
+            self.lock.release()
+        os.write(self.wakeup_w, 'x')
+        return job['events']
+
+    def _start(self, job):
+        vvvv("executing: %s" % job['cmd'])
+        try:
+            if job['executable']:
+                args = job['cmd']
+            else:
+                # expand things like $HOME and ~, as module.run_command() does
+                args = [os.path.expanduser(os.path.expandvars(x)) for x in shlex.split(job['cmd'])]
+            devnull = open(os.devnull, 'r')
+            try:
+                proc = subprocess.Popen(args, shell=bool(job['executable']), executable=job['executable'],
+                                        stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        close_fds=True)
+            finally:
+                devnull.close()
+        except (OSError, ValueError):
+            e = get_exception()
+            self._finish(job, getattr(e, 'errno', None) or 1, '', str(e))
+            return
+        job['proc'] = proc
+        job['open'] = 2
+        self.running += 1
+        self.pipes[proc.stdout.fileno()] = (job, 'stdout')
+        self.pipes[proc.stderr.fileno()] = (job, 'stderr')
+
+    def _finish(self, job, rc, stdout, stderr):
+        self.lock.acquire()
+        try:
+            self.jobs.remove(job)
+        finally:
+            self.lock.release()
+        job['events'].put(('exit', rc, stdout, stderr))
+
+    def _read(self, fd):
+        job, name = self.pipes[fd]
+        data = os.read(fd, 65536)
+        if data:
+            if job['stream']:
+                job['events'].put(('output', name, data))
+            else:
+                job[name].append(data)
+            return
+        del self.pipes[fd]
+        getattr(job['proc'], name).close()
+        job['open'] -= 1
+        if job['open'] == 0:
+            self.reaping.append(job)
+
+    def _reap(self):
+        for job in list(self.reaping):
+            rc = job['proc'].poll()
+            if rc is None:
+                continue
+            self.reaping.remove(job)
+            self.running -= 1
+            self._finish(job, rc, ''.join(job['stdout']), ''.join(job['stderr']))
 
     def run(self):
-        if self._Thread__target is not None:
-            self._return = self._Thread__target(*self._Thread__args,
-                                                **self._Thread__kwargs)
+        next_keepalive = time.time() + KEEPALIVE_INTERVAL
+        while True:
+            try:
+                self.lock.acquire()
+                try:
+                    starting = []
+                    while self.pending and self.running + len(starting) < self.max_commands:
+                        starting.append(self.pending.pop(0))
+                finally:
+                    self.lock.release()
+                for job in starting:
+                    self._start(job)
+
+                self._reap()
+                timeout = max(0, next_keepalive - time.time())
+                if self.reaping:
+                    # children that closed their output but have not exited yet
+                    timeout = min(timeout, 0.1)
+
+                readable = select.select([self.wakeup_r] + list(self.pipes), [], [], timeout)[0]
+                for fd in readable:
+                    if fd == self.wakeup_r:
+                        os.read(fd, 4096)
+                    else:
+                        self._read(fd)
+                self._reap()
+
+                if time.time() >= next_keepalive:
+                    next_keepalive = time.time() + KEEPALIVE_INTERVAL
+                    self.lock.acquire()
+                    try:
+                        for job in self.jobs:
+                            job['events'].put(('keepalive',))
+                    finally:
+                        self.lock.release()
+            except Exception:
+                tb = traceback.format_exc()
+                log("unhandled exception in the command executor:\n%s" % tb)
+
+class DaemonStats(object):
+    """
+    Thread safe counters and latency histograms, returned by 'stats' requests
+    """
 
-    def join(self,timeout=None):
-        Thread.join(self, timeout=timeout)
-        return self._return
+    # upper bounds of the histogram buckets, in milliseconds
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.lock = Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.timings = {}
+
+    def incr(self, name, value=1):
+        self.lock.acquire()
+        try:
+            self.counters[name] = self.counters.get(name, 0) + value
+        finally:
+            self.lock.release()
+
+    def timing(self, phase, seconds):
+        ms = seconds * 1000
+        bucket = len(self.BUCKETS_MS)
+        for i, bound in enumerate(self.BUCKETS_MS):
+            if ms <= bound:
+                bucket = i
+                break
+        self.lock.acquire()
+        try:
+            entry = self.timings.get(phase)
+            if entry is None:
+                entry = self.timings[phase] = dict(count=0, total_ms=0.0, max_ms=0.0,
+                                                   buckets=[0] * (len(self.BUCKETS_MS) + 1))
+            entry['count'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            entry['buckets'][bucket] += 1
+        finally:
+            self.lock.release()
+
+    def snapshot(self):
+        labels = ['<=%dms' % b for b in self.BUCKETS_MS] + ['>%dms' % self.BUCKETS_MS[-1]]
+        self.lock.acquire()
+        try:
+            timings = {}
+            for phase, entry in self.timings.items():
+                timings[phase] = dict(
+                    count=entry['count'],
+                    total_ms=round(entry['total_ms'], 3),
+                    max_ms=round(entry['max_ms'], 3),
+                    histogram=dict(zip(labels, entry['buckets'])),
+                )
+            return dict(uptime=round(time.time() - self.started, 3), counters=dict(self.counters), timings=timings)
+        finally:
+            self.lock.release()
 
 class ThreadedTCPServer(SocketServer.ThreadingTCPServer):
     key_list = []
+    key_index = {}
     last_event = datetime.datetime.now()
     last_event_lock = Lock()
     def __init__(self, server_address, RequestHandlerClass, module, password, timeout, use_ipv6=False):
         self.module = module
-        self.key_list.append(AesKey.Read(password))
+        self.stats = DaemonStats()
+        self.add_key(AesKey.Read(password))
         self.allow_reuse_address = True
         self.timeout = timeout
+        self.plaintext_fetch = self.module.params.get('plaintext_fetch', False)
+        self.executor = CommandExecutor(int(self.module.params.get('max_commands', 64)))
+        self.executor.start()
 
         if use_ipv6:
             self.address_family = socket.AF_INET6
@@ -313,6 +583,10 @@ class ThreadedTCPServer(SocketServer.ThreadingTCPServer):
 
         SocketServer.ThreadingTCPServer.__init__(self, server_address, RequestHandlerClass)
 
+    def add_key(self, key):
+        self.key_list.append(key)
+        self.key_index[key.Header()] = key
+
     def shutdown(self):
         self.running = False
         SocketServer.ThreadingTCPServer.shutdown(self)
@@ -320,6 +594,13 @@ class ThreadedTCPServer(SocketServer.ThreadingTCPServer):
 class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
     # the key to use for this connection
     active_key = None
+    # the transfer protocol and fetch window negotiated for this connection,
+    # controllers that do not send a 'hello' request speak version 1
+    protocol = 1
+    window = 0
+    plaintext = False
+    # reusable buffer for incoming frames
+    recv_buffer = None
 
     def send_data(self, data):
         try:
@@ -328,41 +609,88 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
         finally:
             self.server.last_event_lock.release()
 
+        # send the header separately rather than copying the payload to prepend it
+        start = time.time()
         packed_len = struct.pack('!Q', len(data))
-        return self.request.sendall(packed_len + data)
+        self.request.sendall(packed_len)
+        result = self.request.sendall(data)
+        self.server.stats.timing('send', time.time() - start)
+        self.server.stats.incr('bytes_sent', len(data) + 8)
+        return result
+
+    def encrypt(self, data):
+        start = time.time()
+        data = self.active_key.Encrypt(data)
+        self.server.stats.timing('encrypt', time.time() - start)
+        return data
 
-    def recv_data(self):
-        header_len = 8 # size of a packed unsigned long long
-        data = ""
-        vvvv("in recv_data(), waiting for the header")
-        while len(data) < header_len:
-            try:
-                d = self.request.recv(header_len - len(data))
-                if not d:
-                    vvv("received nothing, bailing out")
+    def decrypt(self, data, key=None):
+        start = time.time()
+        data = (key or self.active_key).Decrypt(data)
+        self.server.stats.timing('decrypt', time.time() - start)
+        return data
+
+    def recv_exact(self, size):
+        """
+        Receive exactly size bytes, or return None if the connection was
+        closed or reset. The bytes are read straight into a buffer kept for
+        the connection, so large frames are not built by repeated copies.
+        """
+        if not HAS_MEMORYVIEW:
+            chunks = []
+            received = 0
+            while received < size:
+                try:
+                    d = self.request.recv(min(size - received, 1048576))
+                except:
+                    # probably got a connection reset
+                    vvvv("exception received while waiting for recv(), returning None")
                     return None
-                data += d
-            except:
-                # probably got a connection reset
-                vvvv("exception received while waiting for recv(), returning None")
-                return None
-        vvvv("in recv_data(), got the header, unpacking")
-        data_len = struct.unpack('!Q',data[:header_len])[0]
-        data = data[header_len:]
-        vvvv("data received so far (expecting %d): %d" % (data_len,len(data)))
-        while len(data) < data_len:
-            try:
-                d = self.request.recv(data_len - len(data))
                 if not d:
                     vvv("received nothing, bailing out")
                     return None
-                data += d
-                vvvv("data received so far (expecting %d): %d" % (data_len,len(data)))
+                chunks.append(d)
+                received += len(d)
+            return ''.join(chunks)
+
+        if self.recv_buffer is None or len(self.recv_buffer) < size:
+            buf = bytearray(max(size, 8))
+            if size <= RECV_BUFFER_KEEP:
+                self.recv_buffer = buf
+        else:
+            buf = self.recv_buffer
+        view = memoryview(buf)
+        received = 0
+        while received < size:
+            try:
+                n = self.request.recv_into(view[received:size], size - received)
             except:
                 # probably got a connection reset
                 vvvv("exception received while waiting for recv(), returning None")
                 return None
+            if not n:
+                vvv("received nothing, bailing out")
+                return None
+            received += n
+            vvvv("data received so far (expecting %d): %d" % (size, received))
+        return view[:size].tobytes()
+
+    def recv_data(self):
+        header_len = 8 # size of a packed unsigned long long
+        vvvv("in recv_data(), waiting for the header")
+        header = self.recv_exact(header_len)
+        if header is None:
+            return None
+        vvvv("in recv_data(), got the header, unpacking")
+        data_len = struct.unpack('!Q', header)[0]
+        start = time.time()
+        data = self.recv_exact(data_len)
+        if data is None:
+            return None
         vvvv("received all of the data, returning")
+        # only the payload is timed, waiting for the header is idle time
+        self.server.stats.timing('recv', time.time() - start)
+        self.server.stats.incr('bytes_received', data_len + 8)
 
         try:
             self.server.last_event_lock.acquire()
@@ -372,7 +700,32 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
 
         return data
 
+    def find_key(self, data):
+        """
+        Decrypt the first request of a connection, picking the key by the key
+        hash in the ciphertext header and only trying every key if that fails
+        """
+        key = self.server.key_index.get(data[:KEY_ID_LEN])
+        if key is not None:
+            try:
+                data = self.decrypt(data, key)
+                self.active_key = key
+                return data
+            except:
+                pass
+
+        self.server.stats.incr('key_trial_decryptions')
+        for key in self.server.key_list:
+            try:
+                data = self.decrypt(data, key)
+                self.active_key = key
+                return data
+            except:
+                pass
+        return None
+
     def handle(self):
+        self.server.stats.incr('connections')
         try:
             while True:
                 vvvv("waiting for data")
@@ -380,46 +733,34 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
                 if not data:
                     vvvv("received nothing back from recv_data(), breaking out")
                     break
+                request_start = time.time()
                 vvvv("got data, decrypting")
                 if not self.active_key:
-                    for key in self.server.key_list:
-                        try:
-                            data = key.Decrypt(data)
-                            self.active_key = key
-                            break
-                        except:
-                            pass
-                    else:
+                    data = self.find_key(data)
+                    if data is None:
                         vv("bad decrypt, exiting the connection handler")
+                        self.server.stats.incr('bad_decrypts')
                         return
                 else:
                     try:
-                        data = self.active_key.Decrypt(data)
+                        data = self.decrypt(data)
                     except:
                         vv("bad decrypt, exiting the connection handler")
+                        self.server.stats.incr('bad_decrypts')
                         return
 
                 vvvv("decryption done, loading json from the data")
+                start = time.time()
                 data = json.loads(data)
+                self.server.stats.timing('json', time.time() - start)
 
                 mode = data['mode']
+                self.server.stats.incr('requests')
+                self.server.stats.incr('requests.%s' % mode)
                 response = {}
-                last_pong = datetime.datetime.now()
                 if mode == 'command':
                     vvvv("received a command request, running it")
-                    twrv = ThreadWithReturnValue(target=self.command, args=(data,))
-                    twrv.start()
-                    response = None
-                    while twrv.is_alive():
-                        if (datetime.datetime.now() - last_pong).seconds >= 15:
-                            last_pong = datetime.datetime.now()
-                            vvvv("command still running, sending keepalive packet")
-                            data2 = json.dumps(dict(pong=True))
-                            data2 = self.active_key.Encrypt(data2)
-                            self.send_data(data2)
-                        time.sleep(0.1)
-                    response = twrv._return
-                    vvvv("thread is done, response from join was %s" % response)
+                    response = self.command(data)
                 elif mode == 'put':
                     vvvv("received a put request, putting it")
                     response = self.put(data)
@@ -429,14 +770,23 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
                 elif mode == 'validate_user':
                     vvvv("received a request to validate the user id")
                     response = self.validate_user(data)
+                elif mode == 'hello':
+                    vvvv("received a protocol negotiation request")
+                    response = self.hello(data)
+                elif mode == 'stats':
+                    vvvv("received a request for the daemon statistics")
+                    response = self.stats()
 
                 vvvv("response result is %s" % str(response))
+                start = time.time()
                 json_response = json.dumps(response)
+                self.server.stats.timing('json', time.time() - start)
                 vvvv("dumped json is %s" % json_response)
-                data2 = self.active_key.Encrypt(json_response)
+                data2 = self.encrypt(json_response)
                 vvvv("sending the response back to the controller")
                 self.send_data(data2)
                 vvvv("done sending the response")
+                self.server.stats.timing('request.%s' % mode, time.time() - request_start)
 
                 if mode == 'validate_user' and response.get('rc') == 1:
                     vvvv("detected a uid mismatch, shutting down")
@@ -447,9 +797,35 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
             log("error was:\n%s" % tb)
             if self.active_key:
                 data2 = json.dumps(dict(rc=1, failed=True, msg="unhandled error in the handle() function"))
-                data2 = self.active_key.Encrypt(data2)
+                data2 = self.encrypt(data2)
                 self.send_data(data2)
 
+    def hello(self, data):
+        try:
+            protocols = [int(p) for p in data.get('protocols', [1])]
+            window = max(0, int(data.get('window', 0)))
+            plaintext = bool(data.get('plaintext', False))
+        except (TypeError, ValueError):
+            return dict(failed=True, msg='invalid protocol negotiation request')
+
+        supported = [p for p in protocols if 1 <= p <= PROTOCOL_VERSION]
+        if not supported:
+            return dict(failed=True, msg='no common protocol version, this daemon supports up to %d' % PROTOCOL_VERSION)
+
+        self.protocol = max(supported)
+        self.window = window
+        self.plaintext = self.protocol >= 2 and plaintext and self.server.plaintext_fetch
+        vvv("negotiated protocol version %d with a window of %d chunks" % (self.protocol, self.window))
+        return dict(protocol=self.protocol, window=self.window, chunk_size=STREAM_CHUNK_SIZE, plaintext=self.plaintext)
+
+    def stats(self):
+        return dict(
+            stats=self.server.stats.snapshot(),
+            active_threads=activeCount(),
+            running_commands=self.server.executor.running,
+            keys=len(self.server.key_list),
+        )
+
     def validate_user(self, data):
         if 'username' not in data:
             return dict(failed=True, msg='No username specified')
@@ -475,18 +851,19 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
         if 'cmd' not in data:
             return dict(failed=True, msg='internal error: cmd is required')
 
-        vvvv("executing: %s" % data['cmd'])
-
-        use_unsafe_shell = False
-        executable = data.get('executable')
-        if executable:
-            use_unsafe_shell = True
+        stream = self.protocol >= 2 and data.get('stream', False)
+        events = self.server.executor.submit(data['cmd'], data.get('executable'), stream)
+        while True:
+            event = events.get()
+            if event[0] == 'keepalive':
+                vvvv("command still running, sending keepalive packet")
+                self.send_data(self.encrypt(json.dumps(dict(pong=True))))
+            elif event[0] == 'output':
+                self.send_data(self.encrypt(json.dumps(dict(stream=event[1], data=event[2]))))
+            else:
+                rc, stdout, stderr = event[1:]
+                break
 
-        rc, stdout, stderr = self.server.module.run_command(data['cmd'], executable=executable, use_unsafe_shell=use_unsafe_shell, close_fds=True)
-        if stdout is None:
-            stdout = ''
-        if stderr is None:
-            stderr = ''
         vvvv("got stdout: %s" % stdout)
         vvvv("got stderr: %s" % stderr)
 
@@ -496,6 +873,11 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
         if 'in_path' not in data:
             return dict(failed=True, msg='internal error: in_path is required')
 
+        if self.plaintext:
+            return self.fetch_plain(data)
+        if self.protocol >= 2:
+            return self.fetch_stream(data)
+
         try:
             fd = file(data['in_path'], 'rb')
             fstat = os.stat(data['in_path'])
@@ -507,7 +889,7 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
                     last = True
                 data = dict(data=base64.b64encode(data), last=last)
                 data = json.dumps(data)
-                data = self.active_key.Encrypt(data)
+                data = self.encrypt(data)
 
                 if self.send_data(data):
                     return dict(failed=True, stderr="failed to send data")
@@ -516,7 +898,7 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
                 if not response:
                     log("failed to get a response, aborting")
                     return dict(failed=True, stderr="Failed to get a response from %s" % self.host)
-                response = self.active_key.Decrypt(response)
+                response = self.decrypt(response)
                 response = json.loads(response)
 
                 if response.get('failed',False):
@@ -532,12 +914,125 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
         fd.close()
         return dict()
 
-    def put(self, data):
-        if 'data' not in data:
-            return dict(failed=True, msg='internal error: data is required')
-        if 'out_path' not in data:
-            return dict(failed=True, msg='internal error: out_path is required')
+    def fetch_stream(self, data):
+        """
+        Send a file as raw encrypted chunks followed by an empty chunk, only
+        waiting for the controller when two windows of chunks are unacked.
+        """
+        digest = sha1()
+        bytes = 0
+        sent = 0
+        acked = 0
+        fd = None
+        try:
+            try:
+                fd = open(data['in_path'], 'rb')
+                while True:
+                    chunk = fd.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    bytes += len(chunk)
+                    self.send_data(self.encrypt(chunk))
+                    sent += 1
+                    if self.window and sent - acked >= 2 * self.window:
+                        acked = self.recv_ack()
+                        if acked is None:
+                            return dict(failed=True, stderr="Master reported failure, aborting transfer")
+            except (IOError, OSError):
+                e = get_exception()
+                tb = traceback.format_exc()
+                log("failed to fetch the file: %s" % tb)
+                # end the stream so the controller gets the error response
+                self.send_data(self.encrypt(''))
+                return dict(failed=True, stderr="Could not fetch the file: %s" % str(e))
+        finally:
+            if fd:
+                fd.close()
+
+        self.send_data(self.encrypt(''))
+
+        # read the acks still owed for complete windows, so they are not
+        # mistaken for the next request
+        if self.window:
+            while acked < sent - sent % self.window:
+                acked = self.recv_ack()
+                if acked is None:
+                    return dict(failed=True, stderr="Master reported failure, aborting transfer")
+
+        vvv("FETCH sent %d bytes in %d chunks" % (bytes, sent))
+        return dict(checksum=digest.hexdigest(), bytes=bytes)
+
+    def fetch_plain(self, data):
+        """
+        Send a file unencrypted as a single frame, letting the kernel copy it
+        to the socket with sendfile when possible.
+        """
+        try:
+            fd = open(data['in_path'], 'rb')
+        except IOError:
+            e = get_exception()
+            # an empty frame ends the transfer, the response carries the error
+            self.send_data('')
+            return dict(failed=True, stderr="Could not fetch the file: %s" % str(e))
+
+        try:
+            size = os.fstat(fd.fileno()).st_size
+            self.request.sendall(struct.pack('!Q', size))
+            sent = 0
+            sendfile = SENDFILE
+            while sent < size:
+                if sendfile:
+                    try:
+                        n = sendfile(self.request.fileno(), fd.fileno(), sent, size - sent)
+                    except OSError:
+                        e = get_exception()
+                        if e.errno == errno.EINTR:
+                            continue
+                        if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                            raise
+                        # the file can not be sent with sendfile, copy the rest
+                        sendfile = None
+                        fd.seek(sent)
+                        continue
+                else:
+                    chunk = fd.read(min(STREAM_CHUNK_SIZE, size - sent))
+                    self.request.sendall(chunk)
+                    n = len(chunk)
+                if not n:
+                    # the file shrank while sending it, the frame cannot be completed
+                    raise IOError("%s was truncated while being sent" % data['in_path'])
+                sent += n
+        finally:
+            fd.close()
+
+        try:
+            self.server.last_event_lock.acquire()
+            self.server.last_event = datetime.datetime.now()
+        finally:
+            self.server.last_event_lock.release()
 
+        vvv("FETCH sent %d bytes unencrypted" % sent)
+        return dict(bytes=sent)
+
+    def recv_ack(self):
+        """ return the number of chunks acked by the controller, or None on failure """
+        response = self.recv_data()
+        if not response:
+            log("failed to get a response, aborting")
+            return None
+        response = json.loads(self.decrypt(response))
+        if response.get('failed', False) or 'ack' not in response:
+            log("got a failed response from the master")
+            return None
+        return int(response['ack'])
+
+    def open_out_file(self, data):
+        """
+        Open the destination of a put request, returning the file object,
+        the path written to, the path to move it to afterwards (if any) and
+        an error response (if any).
+        """
         final_path = None
         if 'user' in data and data.get('user') != getpass.getuser():
             vvv("the target user doesn't match this user, we'll move the file into place via sudo")
@@ -546,13 +1041,72 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
                 try:
                     os.makedirs(tmp_path, int('O700', 8))
                 except:
-                    return dict(failed=True, msg='could not create a temporary directory at %s' % tmp_path)
+                    return None, None, None, dict(failed=True, msg='could not create a temporary directory at %s' % tmp_path)
             (fd,out_path) = tempfile.mkstemp(prefix='ansible.', dir=tmp_path)
             out_fd = os.fdopen(fd, 'w', 0)
             final_path = data['out_path']
         else:
             out_path = data['out_path']
             out_fd = open(out_path, 'w')
+        return out_fd, out_path, final_path, None
+
+    def put_stream(self, data):
+        """
+        Receive a file as raw encrypted chunks ended by an empty chunk,
+        answering once with the digest of what was written.
+        """
+        try:
+            out_fd, out_path, final_path, failed = self.open_out_file(data)
+        except (IOError, OSError):
+            out_fd = None
+            failed = dict(failed=True, stdout="Could not write the file")
+
+        digest = sha1()
+        bytes = 0
+        while True:
+            chunk = self.recv_data()
+            if chunk is None:
+                if out_fd:
+                    out_fd.close()
+                return dict(failed=True, stdout="Connection lost while receiving the file")
+            chunk = self.decrypt(chunk)
+            if not chunk:
+                break
+            if failed:
+                # keep draining the stream so the connection stays usable
+                continue
+            try:
+                out_fd.write(chunk)
+            except (IOError, OSError):
+                tb = traceback.format_exc()
+                log("failed to put the file: %s" % tb)
+                failed = dict(failed=True, stdout="Could not write the file")
+                continue
+            digest.update(chunk)
+            bytes += len(chunk)
+
+        if out_fd:
+            out_fd.close()
+        if failed:
+            return failed
+
+        vvvv("wrote %d bytes" % bytes)
+        if final_path:
+            vvv("moving %s to %s" % (out_path, final_path))
+            self.server.module.atomic_move(out_path, final_path)
+        return dict(checksum=digest.hexdigest(), bytes=bytes)
+
+    def put(self, data):
+        if 'out_path' not in data:
+            return dict(failed=True, msg='internal error: out_path is required')
+        if self.protocol >= 2:
+            return self.put_stream(data)
+        if 'data' not in data:
+            return dict(failed=True, msg='internal error: data is required')
+
+        out_fd, out_path, final_path, failed = self.open_out_file(data)
+        if failed:
+            return failed
 
         try:
             bytes=0
@@ -561,14 +1115,14 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
                 bytes += len(out)
                 out_fd.write(out)
                 response = json.dumps(dict())
-                response = self.active_key.Encrypt(response)
+                response = self.encrypt(response)
                 self.send_data(response)
                 if data['last']:
                     break
                 data = self.recv_data()
                 if not data:
                     raise ""
-                data = self.active_key.Decrypt(data)
+                data = self.decrypt(data)
                 data = json.loads(data)
         except:
             out_fd.close()
@@ -658,6 +1212,8 @@ def main():
             port=dict(required=False, default=5099),
             ipv6=dict(required=False, default=False, type='bool'),
             multi_key=dict(required=False, default=False, type='bool'),
+            plaintext_fetch=dict(required=False, default=False, type='bool'),
+            max_commands=dict(required=False, default=64, type='int'),
             timeout=dict(required=False, default=300),
             password=dict(required=True),
             minutes=dict(required=False, default=30),
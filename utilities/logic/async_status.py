@@ -30,18 +30,36 @@ options:
   jid:
     description:
       - Job or task identifier
-    required: true
+      - One of C(jid), C(jids) or C(all) is required.
+    required: false
     default: null
     aliases: []
+  jids:
+    description:
+      - A list of job identifiers. Returns the status (started, finished, failed and rc,
+        but not the results) of every job in C(jobs), read from the job index kept by
+        the async wrapper.
+    required: false
+    default: null
+    version_added: "2.2"
+  all:
+    description:
+      - If C(yes), act on every job in the job index, like C(jids) does.
+    required: false
+    choices: [ "yes", "no" ]
+    default: "no"
+    version_added: "2.2"
   mode:
     description:
       - if C(status), obtain the status; if C(cleanup), clean up the async job cache
-        located in C(~/.ansible_async/) for the specified job I(jid).
+        located in C(~/.ansible_async/) for the specified job I(jid) (or jobs).
     required: false
     choices: [ "status", "cleanup" ]
     default: "status"
 notes:
     - See also U(http://docs.ansible.com/playbooks_async.html)
+    - While a job is running, the result includes its last C(heartbeat) (elapsed time and
+      output size so far) and C(alive), which is false if no heartbeat was written recently.
 requirements: []
 author: 
     - "Ansible Core Team"
@@ -49,20 +67,126 @@ author:
 '''
 
 import datetime
+import fcntl
+import time
 import traceback
 
+# kept up to date by async_wrapper, see INDEX_FILE there
+INDEX_FILE = '.index'
+
+# a running job whose heartbeat is older than this many seconds is reported
+# as not alive (async_wrapper writes one every 5 seconds)
+HEARTBEAT_STALE = 15
+
+def read_heartbeat(log_path):
+    try:
+        return json.loads(open(log_path + ".heartbeat").read())
+    except (IOError, ValueError):
+        return None
+
+def read_index(logdir):
+    try:
+        return json.loads(open(os.path.join(logdir, INDEX_FILE)).read())
+    except (IOError, ValueError):
+        return {}
+
+def remove_from_index(logdir, jids):
+    index_path = os.path.join(logdir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return
+    lock = open(index_path + ".lock", "a")
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        index = read_index(logdir)
+        for jid in jids:
+            index.pop(jid, None)
+        tmp_path = index_path + ".tmp"
+        f = open(tmp_path, "w")
+        try:
+            f.write(json.dumps(index))
+        finally:
+            f.close()
+        os.rename(tmp_path, index_path)
+    finally:
+        lock.close()
+
+def job_summary(logdir, jid, index):
+    """
+    Status of a job from the index, or from its job file for jobs started
+    by an async wrapper that did not maintain the index
+    """
+    if jid in index:
+        summary = dict(index[jid])
+    else:
+        log_path = os.path.join(logdir, jid)
+        if not os.path.exists(log_path):
+            return dict(ansible_job_id=jid, started=1, finished=1, failed=True, msg="could not find job")
+        try:
+            data = json.loads(open(log_path).read())
+        except (IOError, ValueError):
+            data = dict(started=1, finished=0)
+        if 'started' in data:
+            summary = dict(started=1, finished=data.get('finished', 0))
+        else:
+            summary = dict(started=1, finished=1, failed=bool(data.get('failed', False)), rc=data.get('rc'))
+    summary['ansible_job_id'] = jid
+    return summary
+
+def batch(module, logdir):
+    """ status or cleanup of several jobs, answered from the job index """
+    index = read_index(logdir)
+    if module.params['all']:
+        jids = sorted(index)
+    else:
+        jids = module.params['jids']
+
+    if module.params['mode'] == 'cleanup':
+        erased = []
+        for jid in jids:
+            for path in [os.path.join(logdir, jid), os.path.join(logdir, jid + ".heartbeat")]:
+                if os.path.exists(path):
+                    os.unlink(path)
+                    erased.append(path)
+        remove_from_index(logdir, jids)
+        module.exit_json(erased=erased, ansible_job_ids=jids)
+
+    jobs = dict([(jid, job_summary(logdir, jid, index)) for jid in jids])
+    finished = len([j for j in jobs.values() if j.get('finished')])
+    module.exit_json(jobs=jobs, finished=finished, pending=len(jobs) - finished)
+
+def liveness(log_path):
+    """ report the last heartbeat of a running job and whether it is recent """
+    heartbeat = read_heartbeat(log_path)
+    if heartbeat is None:
+        return {}
+    return dict(heartbeat=heartbeat, alive=time.time() - heartbeat.get('heartbeat', 0) < HEARTBEAT_STALE)
+
 def main():
 
     module = AnsibleModule(argument_spec=dict(
-        jid=dict(required=True),
+        jid=dict(required=False),
+        jids=dict(required=False, type='list'),
+        all=dict(required=False, default=False, type='bool'),
         mode=dict(default='status', choices=['status','cleanup']),
-    ))
+    ),
+        mutually_exclusive=[['jid', 'jids']],
+    )
 
     mode = module.params['mode']
     jid  = module.params['jid']
 
+    # all is a bool and always set, so it can not be part of mutually_exclusive
+    if module.params['all'] and (jid is not None or module.params['jids'] is not None):
+        module.fail_json(msg="parameters are mutually exclusive: jid|jids|all")
+
     # setup logging directory
     logdir = os.path.expanduser("~/.ansible_async")
+
+    if module.params['jids'] is not None or module.params['all']:
+        batch(module, logdir)
+    if jid is None:
+        module.fail_json(msg="one of the following is required: jid, jids, all")
+
     log_path = os.path.join(logdir, jid)
 
     if not os.path.exists(log_path):
@@ -70,6 +194,9 @@ def main():
 
     if mode == 'cleanup':
         os.unlink(log_path)
+        if os.path.exists(log_path + ".heartbeat"):
+            os.unlink(log_path + ".heartbeat")
+        remove_from_index(logdir, [jid])
         module.exit_json(ansible_job_id=jid, erased=log_path)
 
     # NOT in cleanup mode, assume regular status mode
@@ -83,7 +210,8 @@ def main():
     except Exception:
         if not data:
             # file not written yet?  That means it is running
-            module.exit_json(results_file=log_path, ansible_job_id=jid, started=1, finished=0)
+            module.exit_json(results_file=log_path, ansible_job_id=jid, started=1, finished=0,
+                             **liveness(log_path))
         else:
             module.fail_json(ansible_job_id=jid, results_file=log_path,
                 msg="Could not parse job output: %s" % data, started=1, finished=1)
@@ -94,6 +222,9 @@ def main():
     elif 'finished' not in data:
         data['finished'] = 0
 
+    if not data['finished']:
+        data.update(liveness(log_path))
+
     # Fix error: TypeError: exit_json() keywords must be strings
     data = dict([(str(k), v) for k, v in data.iteritems()])
 
@@ -25,6 +25,9 @@ except ImportError:
     import simplejson as json
 import shlex
 import os
+import errno
+import fcntl
+import select
 import subprocess
 import sys
 import traceback
@@ -32,6 +35,28 @@ import signal
 import time
 import syslog
 
+# seconds between the heartbeats written while the job runs
+HEARTBEAT_INTERVAL = 5
+
+# index of the jobs in the job directory, mapping each jid to its started,
+# finished, failed and rc status so async_status can answer for many jobs
+# without parsing their results
+INDEX_FILE = '.index'
+
+# maximum number of bytes of module output kept in the job result, can be
+# changed with ANSIBLE_ASYNC_OUTPUT_LIMIT where 0 means no limit; the output
+# itself is spooled to disk while the module runs
+DEFAULT_OUTPUT_LIMIT = 16 * 1024 * 1024
+try:
+    OUTPUT_LIMIT = int(os.environ.get('ANSIBLE_ASYNC_OUTPUT_LIMIT', DEFAULT_OUTPUT_LIMIT))
+except ValueError:
+    OUTPUT_LIMIT = DEFAULT_OUTPUT_LIMIT
+# module output up to this size is parsed and checked before it is written
+# to the job file, larger output is copied there without reading it whole
+PARSE_LIMIT = 1024 * 1024
+# spooled output is copied in chunks of this size
+READ_SIZE = 64 * 1024
+
 syslog.openlog('ansible-%s' % os.path.basename(__file__))
 syslog.syslog(syslog.LOG_NOTICE, 'Invoked with %s' % " ".join(sys.argv[1:]))
 
@@ -70,25 +95,116 @@ def daemonize_self():
     os.dup2(dev_null.fileno(), sys.stderr.fileno())
 
 
+def _write_json(path, data):
+    """ atomically replace path with data as JSON """
+    tmp_path = path + ".tmp"
+    f = open(tmp_path, "w")
+    try:
+        f.write(json.dumps(data))
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+
+def _update_index(job_path, jid, **fields):
+    """ atomically update the index entry of jid, serialized with a lock file """
+    index_path = os.path.join(os.path.dirname(job_path), INDEX_FILE)
+    try:
+        lock = open(index_path + ".lock", "a")
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                index = json.loads(open(index_path).read())
+            except (IOError, ValueError):
+                index = {}
+            index.setdefault(jid, {}).update(fields)
+            _write_json(index_path, index)
+        finally:
+            lock.close()
+    except (IOError, OSError):
+        e = sys.exc_info()[1]
+        notice("could not update the job index: %s" % e)
+
+def _read_spool(f, limit):
+    """ return the content of the spool file f, keeping its last limit bytes if set """
+    size = os.fstat(f.fileno()).st_size
+    if limit and size > limit:
+        f.seek(size - limit)
+    else:
+        f.seek(0)
+    return f.read()
+
+def _copy_result(path, f, stderr):
+    """
+    atomically replace path with the JSON object spooled in f, adding
+    stderr to it, copying the object in chunks instead of reading it whole
+    """
+    size = os.fstat(f.fileno()).st_size
+    f.seek(max(0, size - READ_SIZE))
+    tail = f.read().rstrip()
+    f.seek(0)
+    head = f.read(READ_SIZE).lstrip()
+    if not head.startswith('{') or not tail.endswith('}'):
+        raise ValueError("module output is not a JSON object")
+    # copy everything up to the closing brace, so stderr can be added
+    remaining = max(0, size - READ_SIZE) + len(tail) - 1
+    tmp_path = path + ".tmp"
+    out = open(tmp_path, "w")
+    try:
+        f.seek(0)
+        while remaining > 0:
+            data = f.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            out.write(data)
+            remaining -= len(data)
+        if stderr:
+            out.write(', "stderr": %s' % json.dumps(stderr))
+        out.write('}')
+    finally:
+        out.close()
+    os.rename(tmp_path, path)
+
 def _run_module(wrapped_cmd, jid, job_path):
 
-    tmp_job_path = job_path + ".tmp"
-    jobfile = open(tmp_job_path, "w")
-    jobfile.write(json.dumps({ "started" : 1, "finished" : 0, "ansible_job_id" : jid }))
-    jobfile.close()
-    os.rename(tmp_job_path, job_path)
-    jobfile = open(tmp_job_path, "w")
+    _write_json(job_path, { "started" : 1, "finished" : 0, "ansible_job_id" : jid })
+    _update_index(job_path, jid, started=1, finished=0, pid=os.getpid(), start_time=time.time())
     result = {}
 
     outdata = ''
+    copied = False
     try:
         cmd = shlex.split(wrapped_cmd)
-        script = subprocess.Popen(cmd, shell=False, stdin=None, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (outdata, stderr) = script.communicate()
-        result = json.loads(outdata)
-        if stderr:
+        # spool the output to disk rather than holding it in memory
+        stdout_spool = open(job_path + ".stdout", "w+")
+        stderr_spool = open(job_path + ".stderr", "w+")
+        try:
+            script = subprocess.Popen(cmd, shell=False, stdin=None, stdout=stdout_spool, stderr=stderr_spool)
+            script.wait()
+            stderr = _read_spool(stderr_spool, OUTPUT_LIMIT)
+            size = os.fstat(stdout_spool.fileno()).st_size
+            if OUTPUT_LIMIT and size > OUTPUT_LIMIT:
+                result = {
+                    "failed": 1,
+                    "cmd" : wrapped_cmd,
+                    "msg": "module output exceeds the limit of %d bytes set by ANSIBLE_ASYNC_OUTPUT_LIMIT" % OUTPUT_LIMIT,
+                    "ansible_job_id": jid,
+                }
+            elif size > PARSE_LIMIT:
+                _copy_result(job_path, stdout_spool, stderr)
+                copied = True
+                # modules exit non-zero when they fail
+                result = {"failed": script.returncode != 0}
+            else:
+                stdout_spool.seek(0)
+                outdata = stdout_spool.read()
+                result = json.loads(outdata)
+        finally:
+            stdout_spool.close()
+            stderr_spool.close()
+            os.unlink(job_path + ".stdout")
+            os.unlink(job_path + ".stderr")
+        if stderr and not copied:
             result['stderr'] = stderr
-        jobfile.write(json.dumps(result))
 
     except (OSError, IOError):
         e = sys.exc_info()[1]
@@ -98,7 +214,6 @@ def _run_module(wrapped_cmd, jid, job_path):
             "msg": str(e),
         }
         result['ansible_job_id'] = jid
-        jobfile.write(json.dumps(result))
 
     except:
         result = {
@@ -108,11 +223,91 @@ def _run_module(wrapped_cmd, jid, job_path):
             "msg" : traceback.format_exc()
         }
         result['ansible_job_id'] = jid
-        jobfile.write(json.dumps(result))
 
-    jobfile.close()
-    os.rename(tmp_job_path, job_path)
+    if not copied:
+        _write_json(job_path, result)
+    _update_index(job_path, jid, finished=1, failed=bool(result.get('failed', False)),
+                  rc=result.get('rc'), end_time=time.time())
 
+def _write_heartbeat(job_path, pid, started, time_limit):
+    heartbeat = dict(pid=pid, heartbeat=time.time(), elapsed=round(time.time() - started, 3), time_limit=time_limit)
+    for stream in ('stdout', 'stderr'):
+        try:
+            heartbeat['%s_bytes' % stream] = os.path.getsize("%s.%s" % (job_path, stream))
+        except OSError:
+            pass
+    try:
+        _write_json(job_path + ".heartbeat", heartbeat)
+    except (OSError, IOError):
+        e = sys.exc_info()[1]
+        notice("could not write heartbeat: %s" % e)
+
+def _watch(sub_pid, jid, job_path, time_limit):
+    """
+    Wait for the module process to exit, waking up on SIGCHLD instead of
+    polling, writing a heartbeat every HEARTBEAT_INTERVAL seconds and killing
+    the process group exactly when the time limit is reached.
+    """
+    started = time.time()
+    deadline = started + time_limit
+
+    # SIGCHLD wakes up select() through this pipe
+    wakeup_r, wakeup_w = os.pipe()
+    fcntl.fcntl(wakeup_w, fcntl.F_SETFL, fcntl.fcntl(wakeup_w, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def sigchld_handler(signum, frame):
+        try:
+            os.write(wakeup_w, 'x'.encode('ascii'))
+        except OSError:
+            pass
+    signal.signal(signal.SIGCHLD, sigchld_handler)
+
+    next_heartbeat = started
+    while True:
+        # checked after installing the handler, so an exit cannot be missed
+        if os.waitpid(sub_pid, os.WNOHANG) != (0, 0):
+            notice("Done in kid B.")
+            break
+
+        now = time.time()
+        if now >= deadline:
+            notice("Now killing %s"%(sub_pid))
+            os.killpg(sub_pid, signal.SIGKILL)
+            notice("Sent kill to group %s"%sub_pid)
+            try:
+                finished = json.loads(open(job_path).read()).get('finished', 1)
+            except (IOError, ValueError):
+                finished = 0
+            if not finished:
+                _write_json(job_path, {
+                    "failed" : 1,
+                    "msg" : "Job reached maximum time limit of %d seconds." % time_limit,
+                    "ansible_job_id" : jid,
+                })
+                _update_index(job_path, jid, finished=1, failed=True, rc=None, end_time=time.time())
+            for suffix in (".stdout", ".stderr"):
+                try:
+                    os.unlink(job_path + suffix)
+                except OSError:
+                    pass
+            break
+
+        if now >= next_heartbeat:
+            _write_heartbeat(job_path, sub_pid, started, time_limit)
+            next_heartbeat = now + HEARTBEAT_INTERVAL
+
+        try:
+            if select.select([wakeup_r], [], [], min(deadline, next_heartbeat) - now)[0]:
+                os.read(wakeup_r, 4096)
+        except select.error:
+            e = sys.exc_info()[1]
+            if e.args[0] != errno.EINTR:
+                raise
+
+    try:
+        os.unlink(job_path + ".heartbeat")
+    except OSError:
+        pass
 
 ####################
 ##      main      ##
@@ -134,7 +329,6 @@ if __name__ == '__main__':
         cmd = "%s %s" % (wrapped_module, argsfile)
     else:
         cmd = wrapped_module
-    step = 5
 
     # setup job output directory
     jobdir = os.path.expanduser("~/.ansible_async")
@@ -177,24 +371,12 @@ if __name__ == '__main__':
             sub_pid = os.fork()
             if sub_pid:
                 # the parent stops the process after the time limit
-                remaining = int(time_limit)
 
                 # set the child process group id to kill all children
                 os.setpgid(sub_pid, sub_pid)
 
-                notice("Start watching %s (%s)"%(sub_pid, remaining))
-                time.sleep(step)
-                while os.waitpid(sub_pid, os.WNOHANG) == (0, 0):
-                    notice("%s still running (%s)"%(sub_pid, remaining))
-                    time.sleep(step)
-                    remaining = remaining - step
-                    if remaining <= 0:
-                        notice("Now killing %s"%(sub_pid))
-                        os.killpg(sub_pid, signal.SIGKILL)
-                        notice("Sent kill to group %s"%sub_pid)
-                        time.sleep(1)
-                        sys.exit(0)
-                notice("Done in kid B.")
+                notice("Start watching %s (%s)"%(sub_pid, time_limit))
+                _watch(sub_pid, jid, job_path, int(time_limit))
                 sys.exit(0)
             else:
                 # the child process runs the actual module
@@ -20,11 +20,16 @@
 
 import binascii
 import datetime
+import errno
 import math
+import os
+import random
 import re
 import select
 import socket
+import struct
 import sys
+import threading
 import time
 
 HAS_PSUTIL = False
@@ -35,6 +40,52 @@ try:
 except ImportError:
     pass
 
+HAS_INOTIFY = False
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    _inotify_init = _libc.inotify_init
+    _inotify_add_watch = _libc.inotify_add_watch
+    _inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    HAS_INOTIFY = True
+except (ImportError, OSError, AttributeError):
+    pass
+
+# IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+# IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+INOTIFY_MASK = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800
+
+# Without inotify (or on filesystems that do not emit events, like procfs
+# or NFS) paths are re-checked this often
+POLL_INTERVAL = 0.25
+# Even with inotify, look again at least this often in case an event was missed
+WATCH_RESCAN_INTERVAL = 1.0
+
+# Socket checks back off exponentially (with jitter) between these bounds
+BACKOFF_INITIAL = 0.05
+BACKOFF_MAX = 2.0
+# Host names of targets are resolved in a thread, checked for completion this often
+RESOLVE_POLL_INTERVAL = 0.05
+
+# Files are searched incrementally; this much of the already scanned data is
+# kept so that a match spanning two reads is still found
+SCAN_CHUNK_SIZE = 1024 * 1024
+SCAN_OVERLAP = 64 * 1024
+
+# sock_diag netlink constants (linux/netlink.h, linux/sock_diag.h,
+# linux/inet_diag.h) used to count connections for state=drained
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_REQ_BYTECODE = 1
+INET_DIAG_BC_S_GE = 2
+INET_DIAG_BC_S_LE = 3
+NETLINK_RECV_SIZE = 256 * 1024
+
 DOCUMENTATION = '''
 ---
 module: wait_for
@@ -100,8 +151,41 @@ options:
     required: false
     description:
       - list of hosts or IPs to ignore when looking for active TCP connections for C(drained) state
+  targets:
+    version_added: "2.2"
+    required: false
+    default: null
+    description:
+      - List of things to wait for at the same time, instead of a single C(port) or C(path).
+      - Each entry is either a string, C(host:port), a bare port on C(host) or an absolute path,
+        or a dict with the keys C(host), C(port), C(path), C(search_regex) and C(state).
+      - Entries without a C(state) use the module's C(state). C(drained) is not supported.
+      - All targets are checked concurrently and the result lists, for every target,
+        whether it was met and how many seconds that took.
+  condition:
+    version_added: "2.2"
+    required: false
+    default: all
+    choices: [ "all", "any", "quorum" ]
+    description:
+      - How many of the C(targets) have to be met for the module to succeed.
+  quorum:
+    version_added: "2.2"
+    required: false
+    default: null
+    description:
+      - Number of C(targets) that have to be met when C(condition=quorum).
+        Defaults to a majority of the targets.
 notes:
   - The ability to use search_regex with a port connection was added in 1.7.
+  - On Linux, paths are watched with inotify so the module reacts as soon as a file
+    is created, removed or appended to. Only newly appended data is searched for
+    C(search_regex). Elsewhere paths are polled several times a second.
+  - Port checks are retried with an exponential backoff (with jitter) starting at
+    50 milliseconds and capped at 2 seconds.
+  - On Linux, C(drained) asks the kernel for the matching connections over a
+    sock_diag netlink socket and falls back to reading /proc/net/tcp and
+    /proc/net/tcp6 when that is not available.
 requirements: []
 author:
     - "Jeroen Hoekx (@jhoekx)"
@@ -136,6 +220,19 @@ EXAMPLES = '''
 # and don't start checking for 10 seconds
 - local_action: wait_for port=22 host="{{ ansible_ssh_host | default(inventory_hostname) }}" search_regex=OpenSSH delay=10
 
+# wait for a majority of the cluster nodes to accept connections on port 5701
+- local_action:
+    module: wait_for
+    targets: "{{ groups['cluster'] | map('regex_replace', '$', ':5701') | list }}"
+    condition: quorum
+
+# wait for the database port and for the application to log that it is ready
+- wait_for:
+    targets:
+      - 5432
+      - path: /var/log/app/app.log
+        search_regex: "Started in [0-9.]+ seconds"
+
 '''
 
 class TCPConnectionInfo(object):
@@ -245,6 +342,16 @@ class LinuxTCPConnectionInfo(TCPConnectionInfo):
         self.ips = _convert_host_to_hex(module.params['host'])
         self.port = "%0.4X" % int(module.params['port'])
         self.exclude_ips = self._get_exclude_ips()
+        self.use_netlink = hasattr(socket, 'AF_NETLINK')
+        if self.use_netlink:
+            self.port_number = int(module.params['port'])
+            self.raw_ips = set(_convert_host_to_raw(module.params['host']))
+            self.raw_exclude_ips = set()
+            for host in module.params['exclude_hosts'] or []:
+                self.raw_exclude_ips.update(_convert_host_to_raw(host))
+            self.states_mask = 0
+            for state in self.connection_states:
+                self.states_mask |= 1 << int(state, 16)
 
     def _get_exclude_ips(self):
         exclude_hosts = self.module.params['exclude_hosts']
@@ -255,29 +362,106 @@ class LinuxTCPConnectionInfo(TCPConnectionInfo):
         return exclude_ips
 
     def get_active_connections_count(self):
+        if self.use_netlink:
+            try:
+                return self._sock_diag_count()
+            except (socket.error, OSError, struct.error):
+                # sock_diag is missing or not permitted (old kernels,
+                # containers), keep using procfs from now on
+                self.use_netlink = False
+        return self._procfs_count()
+
+    def _sock_diag_request(self, family):
+        """
+        Build a SOCK_DIAG_BY_FAMILY dump request for TCP sockets in one of
+        connection_states whose local port is self.port. The port is matched
+        by the kernel with a small inet_diag bytecode program:
+        sport >= port && sport <= port.
+        """
+        op = struct.Struct('=BBH')
+        bytecode = (op.pack(INET_DIAG_BC_S_GE, 8, 20) + op.pack(0, 0, self.port_number) +
+                    op.pack(INET_DIAG_BC_S_LE, 8, 12) + op.pack(0, 0, self.port_number))
+        attr = struct.pack('=HH', 4 + len(bytecode), INET_DIAG_REQ_BYTECODE) + bytecode
+        # struct inet_diag_req_v2 followed by an all-zero inet_diag_sockid
+        req = struct.pack('=BBBBI48x', family, socket.IPPROTO_TCP, 0, 0, self.states_mask)
+        header = struct.pack('=IHHII', 16 + len(req) + len(attr), SOCK_DIAG_BY_FAMILY,
+                             NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+        return header + req + attr
+
+    def _sock_diag_count(self):
+        active_connections = 0
+        for family in self.source_file.keys():
+            addr_len = family == socket.AF_INET and 4 or 16
+            nl = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG)
+            try:
+                nl.sendto(self._sock_diag_request(family), (0, 0))
+                done = False
+                while not done:
+                    data = nl.recv(NETLINK_RECV_SIZE)
+                    if not data:
+                        raise socket.error(errno.EIO, "short read from sock_diag")
+                    offset = 0
+                    while offset + 16 <= len(data):
+                        (length, msg_type) = struct.unpack_from('=IH', data, offset)
+                        if length < 16:
+                            raise socket.error(errno.EIO, "malformed sock_diag message")
+                        if msg_type == NLMSG_DONE:
+                            done = True
+                            break
+                        if msg_type == NLMSG_ERROR:
+                            error = -struct.unpack_from('=i', data, offset + 16)[0]
+                            raise socket.error(error, os.strerror(error))
+                        # struct inet_diag_msg: family, state, timer, retrans,
+                        # sport, dport, src[16], dst[16], ...
+                        local_ip = data[offset + 24:offset + 24 + addr_len]
+                        remote_ip = data[offset + 40:offset + 40 + addr_len]
+                        if self._raw_match(family, local_ip, remote_ip):
+                            active_connections += 1
+                        offset += (length + 3) & ~3
+            finally:
+                nl.close()
+        return active_connections
+
+    def _raw_match(self, family, local_ip, remote_ip):
+        if (family, remote_ip) in self.raw_exclude_ips:
+            return False
+        if (family, local_ip) in self.raw_ips:
+            return True
+        if (family, RAW_ANY_ADDRESS[len(local_ip)]) in self.raw_ips:
+            return True
+        return (family == socket.AF_INET6 and local_ip.startswith(IPV4_MAPPED_PREFIX) and
+                (family, IPV4_MAPPED_PREFIX + RAW_ANY_ADDRESS[4]) in self.raw_ips)
+
+    def _procfs_count(self):
         active_connections = 0
+        # the local port is checked on the raw line before anything is split
+        port_needle = ':%s ' % self.port
         for family in self.source_file.keys():
             f = open(self.source_file[family])
-            for tcp_connection in f.readlines():
-                tcp_connection = tcp_connection.strip().split()
-                if tcp_connection[self.local_address_field] == 'local_address':
-                    continue
-                if tcp_connection[self.connection_state_field] not in self.connection_states:
-                    continue
-                (local_ip, local_port) = tcp_connection[self.local_address_field].split(':')
-                if self.port != local_port:
-                    continue
-                (remote_ip, remote_port) = tcp_connection[self.remote_address_field].split(':')
-                if (family, remote_ip) in self.exclude_ips:
-                    continue
-                if any((
-                    (family, local_ip) in self.ips,
-                    (family, self.match_all_ips[family]) in self.ips,
-                    local_ip.startswith(self.ipv4_mapped_ipv6_address['prefix']) and
-                        (family, self.ipv4_mapped_ipv6_address['match_all']) in self.ips,
-                )):
-                    active_connections += 1
-            f.close()
+            try:
+                for tcp_connection in f:
+                    if port_needle not in tcp_connection:
+                        continue
+                    tcp_connection = tcp_connection.split()
+                    if tcp_connection[self.local_address_field] == 'local_address':
+                        continue
+                    if tcp_connection[self.connection_state_field] not in self.connection_states:
+                        continue
+                    (local_ip, local_port) = tcp_connection[self.local_address_field].split(':')
+                    if self.port != local_port:
+                        continue
+                    (remote_ip, remote_port) = tcp_connection[self.remote_address_field].split(':')
+                    if (family, remote_ip) in self.exclude_ips:
+                        continue
+                    if any((
+                        (family, local_ip) in self.ips,
+                        (family, self.match_all_ips[family]) in self.ips,
+                        local_ip.startswith(self.ipv4_mapped_ipv6_address['prefix']) and
+                            (family, self.ipv4_mapped_ipv6_address['match_all']) in self.ips,
+                    )):
+                        active_connections += 1
+            finally:
+                f.close()
         return active_connections
 
 
@@ -300,6 +484,27 @@ def _convert_host_to_ip(host):
             ips.append((socket.AF_INET6, "::ffff:" + ip))
     return ips
 
+# packed addresses as reported by sock_diag; struct keeps them bytes on
+# python 3 without bytes literals
+IPV4_MAPPED_PREFIX = struct.pack('10xBB', 0xff, 0xff)
+RAW_ANY_ADDRESS = {4: struct.pack('4x'), 16: struct.pack('16x')}
+
+def _convert_host_to_raw(host):
+    """
+    Convert the provided host to the packed addresses reported by sock_diag
+
+    Args:
+        host: String with either hostname, IPv4, or IPv6 address
+
+    Returns:
+        List of tuples containing address family and the packed address
+    """
+    ips = []
+    if host is not None:
+        for family, ip in _convert_host_to_ip(host):
+            ips.append((family, socket.inet_pton(family, ip)))
+    return ips
+
 def _convert_host_to_hex(host):
     """
     Convert the provided host to the format in /proc/net/tcp*
@@ -350,6 +555,501 @@ def _timedelta_total_seconds(timedelta):
         timedelta.microseconds + 0.0 +
         (timedelta.seconds + timedelta.days * 24 * 3600) * 10 ** 6) / 10 ** 6
 
+def _remaining(end):
+    return max(0.0, _timedelta_total_seconds(end - datetime.datetime.now()))
+
+def _to_text(data):
+    if sys.version_info[0] >= 3 and isinstance(data, bytes):
+        return data.decode('utf-8', 'replace')
+    return data
+
+def _path_present(path):
+    try:
+        f = open(path)
+        f.close()
+    except IOError:
+        return False
+    return True
+
+
+class Backoff(object):
+    """
+    Exponential backoff with jitter between BACKOFF_INITIAL and BACKOFF_MAX.
+    """
+
+    def __init__(self, initial=BACKOFF_INITIAL, maximum=BACKOFF_MAX):
+        self.delay = initial
+        self.maximum = maximum
+
+    def next(self):
+        delay = self.delay
+        self.delay = min(self.delay * 2, self.maximum)
+        return random.uniform(delay / 2.0, delay)
+
+    def sleep(self, end):
+        time.sleep(min(self.next(), _remaining(end)))
+
+
+class PathWatcher(object):
+    """
+    Block until something happens to a path, or a timeout expires.
+
+    The nearest existing parent directory of the path is watched with
+    inotify, which reports the path being created, removed, renamed or
+    written to. When inotify is not available wait() simply sleeps for
+    POLL_INTERVAL.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.parent = os.path.dirname(self.path)
+        self.watched = None
+        self.fd = None
+        if HAS_INOTIFY:
+            fd = _inotify_init()
+            if fd >= 0:
+                self.fd = fd
+                self._add_watch()
+
+    def _add_watch(self):
+        directory = self.parent
+        while directory != self.watched:
+            if os.path.isdir(directory):
+                name = directory
+                if not isinstance(name, bytes):
+                    name = name.encode(sys.getfilesystemencoding())
+                if _inotify_add_watch(self.fd, name, INOTIFY_MASK) >= 0:
+                    self.watched = directory
+                    return
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            directory = parent
+
+    @property
+    def active(self):
+        return self.fd is not None and self.watched is not None
+
+    def drain(self):
+        readable = [self.fd]
+        while readable:
+            # The events themselves are not interesting, the caller looks at
+            # the path again whatever happened
+            os.read(self.fd, 65536)
+            readable = select.select([self.fd], [], [], 0)[0]
+        if self.watched != self.parent:
+            # a missing parent directory may have been created in the meantime
+            self._add_watch()
+
+    def wait(self, timeout):
+        if not self.active:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return
+        if select.select([self.fd], [], [], min(timeout, WATCH_RESCAN_INTERVAL))[0]:
+            self.drain()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FileSearcher(object):
+    """
+    Check whether a file exists and, optionally, contains a regex match.
+
+    The offset of the data already searched is remembered so that every
+    check only reads what was appended since the previous one. If the file
+    is truncated or replaced, searching starts again from the beginning.
+    """
+
+    def __init__(self, path, compiled_re=None):
+        self.path = path
+        self.regex = compiled_re
+        self._reset(None)
+
+    def _reset(self, inode):
+        self.inode = inode
+        self.offset = 0
+        self.carry = ''
+
+    def _carry(self, data):
+        if len(data) <= SCAN_OVERLAP:
+            return data
+        # keep whole lines so that anchors in the regex keep working
+        start = data.rfind('\n', 0, len(data) - SCAN_OVERLAP) + 1
+        if len(data) - start > 2 * SCAN_OVERLAP:
+            start = len(data) - SCAN_OVERLAP
+        return data[start:]
+
+    def check(self):
+        """
+        Returns True once the condition is met. Raises OSError if the path
+        cannot be stat'ed for any reason other than not existing (yet).
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            e = get_exception()
+            if e.errno != errno.ENOENT:
+                raise
+            self._reset(None)
+            return False
+
+        if not self.regex:
+            return True
+
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            self._reset(st.st_ino)
+        if st.st_size == self.offset:
+            return False
+
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return False
+        try:
+            f.seek(self.offset)
+            while True:
+                chunk = f.read(SCAN_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.offset += len(chunk)
+                data = self.carry + _to_text(chunk)
+                if self.regex.search(data):
+                    return True
+                self.carry = self._carry(data)
+        finally:
+            f.close()
+        return False
+
+class WaitTarget(object):
+    """
+    One entry of the targets option. Subclasses implement poll(now,
+    readable, writable) and, when they wait on file descriptors or timers,
+    fds() and wakeup(), so that all targets can be driven from a single
+    select loop. poll() must never block.
+    """
+
+    def __init__(self, name, state, start):
+        self.name = name
+        self.state = state
+        self.start = start
+        self.met = False
+        self.elapsed = None
+        self.error = None
+
+    def fds(self):
+        """ Returns the (read, write) lists of file descriptors to select on """
+        return [], []
+
+    def wakeup(self):
+        """ Returns the time poll() needs to be called at even without events """
+        return None
+
+    def _done(self, now):
+        self.met = True
+        self.elapsed = round(now - self.start, 3)
+
+    def close(self):
+        pass
+
+    def result(self):
+        res = dict(target=self.name, state=self.state, met=self.met, elapsed=self.elapsed)
+        if self.error:
+            res['msg'] = self.error
+        return res
+
+
+class PortTarget(WaitTarget):
+    """
+    Waits for a port to accept connections (optionally returning data
+    matching a regex) or, with state=stopped, to refuse them. Connections
+    are made with non-blocking sockets and retried with a Backoff. The host
+    is resolved once, in a thread, and again only after a failed lookup.
+    """
+
+    def __init__(self, name, state, start, host, port, compiled_re, connect_timeout):
+        super(PortTarget, self).__init__(name, state, start)
+        self.host = host
+        self.port = port
+        self.regex = compiled_re
+        self.connect_timeout = connect_timeout
+        self.backoff = Backoff()
+        self.sock = None
+        self.phase = 'idle'
+        self.next_attempt = start
+        self.deadline = None
+        self.data = ''
+        self.addrinfo = None
+        self.resolved = None
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.sock.close()
+            self.sock = None
+
+    def _retry(self, now):
+        self._close()
+        self.phase = 'idle'
+        self.next_attempt = now + self.backoff.next()
+
+    def _finish(self, now):
+        self._close()
+        self.phase = 'done'
+        self._done(now)
+
+    def _resolve(self):
+        try:
+            self.resolved = (socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)[0], None)
+        except socket.error:
+            e = get_exception()
+            self.resolved = (None, str(e))
+
+    def _start_resolve(self):
+        self.phase = 'resolving'
+        self.resolved = None
+        resolver = threading.Thread(target=self._resolve)
+        resolver.setDaemon(True)
+        resolver.start()
+
+    def _connect(self, now):
+        if self.addrinfo is None:
+            self._start_resolve()
+            return
+        try:
+            family, socktype, proto, _, addr = self.addrinfo
+            self.sock = socket.socket(family, socktype, proto)
+            self.sock.setblocking(0)
+            err = self.sock.connect_ex(addr)
+        except socket.error:
+            e = get_exception()
+            self.error = str(e)
+            return self._refused(now)
+        if err == 0:
+            self._connected(now)
+        elif err in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            self.phase = 'connecting'
+            self.deadline = now + self.connect_timeout
+        else:
+            self._refused(now)
+
+    def _refused(self, now):
+        if self.state == 'stopped':
+            self._finish(now)
+        else:
+            self._retry(now)
+
+    def _connected(self, now):
+        self.error = None
+        if self.state == 'stopped':
+            self._retry(now)
+        elif self.regex:
+            self.phase = 'reading'
+            self.data = ''
+        else:
+            self._finish(now)
+
+    def fds(self):
+        if self.phase == 'connecting':
+            return [], [self.sock]
+        if self.phase == 'reading':
+            return [self.sock], []
+        return [], []
+
+    def wakeup(self):
+        if self.phase == 'idle':
+            return self.next_attempt
+        if self.phase == 'resolving':
+            return time.time() + RESOLVE_POLL_INTERVAL
+        if self.phase == 'connecting':
+            return self.deadline
+        return None
+
+    def poll(self, now, readable, writable):
+        if self.phase == 'idle':
+            if now >= self.next_attempt:
+                self._connect(now)
+        elif self.phase == 'resolving':
+            if self.resolved is not None:
+                self.addrinfo, self.error = self.resolved
+                if self.addrinfo is None:
+                    self._refused(now)
+                else:
+                    self._connect(now)
+        elif self.phase == 'connecting':
+            if self.sock in writable:
+                if self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    self._connected(now)
+                else:
+                    self._refused(now)
+            elif now >= self.deadline:
+                self._refused(now)
+        elif self.phase == 'reading' and self.sock in readable:
+            try:
+                response = self.sock.recv(1024)
+            except socket.error:
+                response = None
+            if not response:
+                # Server shutdown before the string showed up
+                self._retry(now)
+                return
+            self.data += _to_text(response)
+            if self.regex.search(self.data):
+                self._finish(now)
+
+    def close(self):
+        self._close()
+
+
+class PathTarget(WaitTarget):
+    """
+    Waits for a path to be present (optionally containing a regex match)
+    or absent, using a PathWatcher and a FileSearcher.
+    """
+
+    def __init__(self, name, state, start, path, compiled_re):
+        super(PathTarget, self).__init__(name, state, start)
+        self.path = path
+        self.watcher = PathWatcher(path)
+        self.searcher = FileSearcher(path, compiled_re)
+        self.next_check = start
+
+    def fds(self):
+        if self.watcher.active:
+            return [self.watcher.fd], []
+        return [], []
+
+    def wakeup(self):
+        return self.next_check
+
+    def poll(self, now, readable, writable):
+        if self.watcher.active and self.watcher.fd in readable:
+            self.watcher.drain()
+        elif now < self.next_check:
+            return
+
+        if self.state == 'absent':
+            met = not _path_present(self.path)
+        else:
+            try:
+                met = self.searcher.check()
+                self.error = None
+            except OSError:
+                e = get_exception()
+                self.error = "Failed to stat %s, %s" % (self.path, e.strerror)
+                met = False
+        if met:
+            self._done(now)
+            self.watcher.close()
+        elif self.watcher.active:
+            self.next_check = now + WATCH_RESCAN_INTERVAL
+        else:
+            self.next_check = now + POLL_INTERVAL
+
+    def close(self):
+        self.watcher.close()
+
+
+def _parse_target(module, entry, start):
+    """
+    Build a WaitTarget from an entry of the targets option, which is either
+    a string (C(host:port), C(port) or an absolute path) or a dict with the
+    host, port, path, search_regex and state keys.
+    """
+    params = module.params
+    if isinstance(entry, dict):
+        spec = dict(entry)
+    else:
+        entry = str(entry).strip()
+        if entry.startswith('/'):
+            spec = dict(path=entry)
+        elif ':' in entry:
+            target_host, target_port = entry.rsplit(':', 1)
+            spec = dict(host=target_host.strip('[]'), port=target_port)
+        else:
+            spec = dict(port=entry)
+
+    target_host = spec.get('host') or params['host']
+    target_path = spec.get('path')
+    target_port = spec.get('port')
+    search_regex = spec.get('search_regex')
+    state = spec.get('state') or params['state']
+
+    if target_path and target_port:
+        module.fail_json(msg="target %s: port and path can not both be set" % entry)
+    if not target_path and not target_port:
+        module.fail_json(msg="target %s: either port or path is required" % entry)
+    compiled_re = None
+    if search_regex is not None:
+        compiled_re = re.compile(search_regex, re.MULTILINE)
+
+    if target_path:
+        if state == 'started':
+            state = 'present'
+        if state not in ('present', 'absent'):
+            module.fail_json(msg="target %s: state=%s can not be used with a path" % (entry, state))
+        target_path = os.path.expanduser(target_path)
+        return PathTarget(target_path, state, start, target_path, compiled_re)
+
+    try:
+        target_port = int(target_port)
+    except ValueError:
+        module.fail_json(msg="target %s: invalid port %s" % (entry, target_port))
+    if state == 'present':
+        state = 'started'
+    if state not in ('started', 'stopped'):
+        module.fail_json(msg="target %s: state=%s can not be used with a port" % (entry, state))
+    name = "%s:%s" % (target_host, target_port)
+    return PortTarget(name, state, start, target_host, target_port, compiled_re, params['connect_timeout'])
+
+
+def wait_for_targets(targets, required, end):
+    """
+    Drive all targets from one select loop until at least C(required) of
+    them are met or the C(end) timestamp is reached. Returns the number
+    of targets that were met.
+    """
+    pending = list(targets)
+    met = 0
+    now = time.time()
+    while pending and met < required and now < end:
+        rlist = []
+        wlist = []
+        wakeup = end
+        for target in pending:
+            r, w = target.fds()
+            rlist.extend(r)
+            wlist.extend(w)
+            when = target.wakeup()
+            if when is not None:
+                wakeup = min(wakeup, when)
+
+        timeout = max(0.0, wakeup - time.time())
+        try:
+            readable, writable, _ = select.select(rlist, wlist, [], timeout)
+        except select.error:
+            e = get_exception()
+            if e.args[0] != errno.EINTR:
+                raise
+            readable, writable = [], []
+
+        now = time.time()
+        for target in list(pending):
+            target.poll(now, readable, writable)
+            if target.met:
+                pending.remove(target)
+                met += 1
+
+    for target in pending:
+        target.close()
+    return met
+
+
 def main():
 
     module = AnsibleModule(
@@ -362,8 +1062,12 @@ def main():
             path=dict(default=None, type='path'),
             search_regex=dict(default=None),
             state=dict(default='started', choices=['started', 'stopped', 'present', 'absent', 'drained']),
-            exclude_hosts=dict(default=None, type='list')
+            exclude_hosts=dict(default=None, type='list'),
+            targets=dict(default=None, type='list'),
+            condition=dict(default='all', choices=['all', 'any', 'quorum']),
+            quorum=dict(default=None, type='int'),
         ),
+        mutually_exclusive=[['targets', 'port'], ['targets', 'path'], ['targets', 'search_regex']],
     )
 
     params = module.params
@@ -391,7 +1095,40 @@ def main():
         module.fail_json(msg="exclude_hosts should only be with state=drained")
 
 
+    if params['targets'] is not None:
+        if state == 'drained':
+            module.fail_json(msg="state=drained can not be used with targets")
+        if not params['targets']:
+            module.fail_json(msg="targets must not be empty")
+
     start = datetime.datetime.now()
+    start_time = time.time()
+
+    if params['targets'] is not None:
+        targets = [_parse_target(module, entry, start_time) for entry in params['targets']]
+        condition = params['condition']
+        if condition == 'all':
+            required = len(targets)
+        elif condition == 'any':
+            required = 1
+        else:
+            required = params['quorum']
+            if required is None:
+                required = len(targets) // 2 + 1
+            if required < 1 or required > len(targets):
+                module.fail_json(msg="quorum must be between 1 and the number of targets (%d)" % len(targets))
+
+        if delay:
+            time.sleep(delay)
+        met = wait_for_targets(targets, required, start_time + timeout)
+
+        elapsed = datetime.datetime.now() - start
+        results = [t.result() for t in targets]
+        if met < required:
+            module.fail_json(msg="Timeout when waiting for %d of %d targets, %d met" % (required, len(targets), met),
+                             targets=results, elapsed=elapsed.seconds)
+        module.exit_json(state=state, condition=condition, required=required, met=met,
+                         targets=results, elapsed=elapsed.seconds)
 
     if delay:
         time.sleep(delay)
@@ -401,24 +1138,24 @@ def main():
     elif state in [ 'stopped', 'absent' ]:
         ### first wait for the stop condition
         end = start + datetime.timedelta(seconds=timeout)
+        backoff = Backoff()
+        watcher = None
+        if path:
+            watcher = PathWatcher(path)
 
         while datetime.datetime.now() < end:
             if path:
-                try:
-                    f = open(path)
-                    f.close()
-                    time.sleep(1)
-                    pass
-                except IOError:
+                if not _path_present(path):
                     break
+                watcher.wait(_remaining(end))
             elif port:
                 try:
                     s = _create_connection(host, port, connect_timeout)
                     s.shutdown(socket.SHUT_RDWR)
                     s.close()
-                    time.sleep(1)
                 except:
                     break
+                backoff.sleep(end)
             else:
                 time.sleep(1)
         else:
@@ -427,36 +1164,30 @@ def main():
                 module.fail_json(msg="Timeout when waiting for %s:%s to stop." % (host, port), elapsed=elapsed.seconds)
             elif path:
                 module.fail_json(msg="Timeout when waiting for %s to be absent." % (path), elapsed=elapsed.seconds)
+        if watcher:
+            watcher.close()
 
     elif state in ['started', 'present']:
         ### wait for start condition
         end = start + datetime.timedelta(seconds=timeout)
+        backoff = Backoff()
+        watcher = None
+        if path:
+            watcher = PathWatcher(path)
+            searcher = FileSearcher(path, compiled_search_re)
+
         while datetime.datetime.now() < end:
             if path:
                 try:
-                    os.stat(path)
+                    if searcher.check():
+                        # File exists and, if requested, the string was found
+                        break
                 except OSError:
                     e = get_exception()
-                    # If anything except file not present, throw an error
-                    if e.errno != 2:
-                        elapsed = datetime.datetime.now() - start
-                        module.fail_json(msg="Failed to stat %s, %s" % (path, e.strerror), elapsed=elapsed.seconds)
-                    # file doesn't exist yet, so continue
-                else:
-                    # File exists.  Are there additional things to check?
-                    if not compiled_search_re:
-                        # nope, succeed!
-                        break
-                    try:
-                        f = open(path)
-                        try:
-                            if re.search(compiled_search_re, f.read()):
-                                # String found, success!
-                                break
-                        finally:
-                            f.close()
-                    except IOError:
-                        pass
+                    elapsed = datetime.datetime.now() - start
+                    module.fail_json(msg="Failed to stat %s, %s" % (path, e.strerror), elapsed=elapsed.seconds)
+                watcher.wait(_remaining(end))
+                continue
             elif port:
                 alt_connect_timeout = math.ceil(_timedelta_total_seconds(end - datetime.datetime.now()))
                 try:
@@ -480,7 +1211,7 @@ def main():
                             if not response:
                                 # Server shutdown
                                 break
-                            data += response
+                            data += _to_text(response)
                             if re.search(compiled_search_re, data):
                                 matched = True
                                 break
@@ -497,8 +1228,10 @@ def main():
                         s.close()
                         break
 
-            # Conditions not yet met, wait and try again
-            time.sleep(1)
+                # Conditions not yet met, back off and try again
+                backoff.sleep(end)
+            else:
+                time.sleep(1)
 
         else:   # while-else
             # Timeout expired
@@ -513,18 +1246,21 @@ def main():
                     module.fail_json(msg="Timeout when waiting for search string %s in %s" % (search_regex, path), elapsed=elapsed.seconds)
                 else:
                     module.fail_json(msg="Timeout when waiting for file %s" % (path), elapsed=elapsed.seconds)
+        if watcher:
+            watcher.close()
 
     elif state == 'drained':
         ### wait until all active connections are gone
         end = start + datetime.timedelta(seconds=timeout)
         tcpconns = TCPConnectionInfo(module)
+        backoff = Backoff()
         while datetime.datetime.now() < end:
             try:
                 if tcpconns.get_active_connections_count() == 0:
                     break
             except IOError:
                 pass
-            time.sleep(1)
+            backoff.sleep(end)
         else:
             elapsed = datetime.datetime.now() - start
             module.fail_json(msg="Timeout when waiting for %s:%s to drain" % (host, port), elapsed=elapsed.seconds)